@@ -0,0 +1,262 @@
+"""Реплей синтетических сообщений через конвейер сообщений (стадия Levels) на временной базе.
+
+    python -m benchmarks.levels_replay --users 5000 --messages 20000 --hit-ratio 0.7 --json after.json
+    python -m benchmarks.levels_replay --flush-interval 5 --baseline after.json
+
+Время для кулдаунов виртуальное: сообщения идут с частотой ``--rate`` в
+секунду «по часам бота», а выполняются так быстро, как успевает код
+(``--concurrency`` одновременных обработчиков, как при пачке событий от
+шлюза). С ``--realtime`` сообщения приходят с той же частотой и по
+настоящим часам. Доля сообщений, попадающих на кулдаун, задаётся
+``--hit-ratio``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import types
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+
+from src.cogs.levels import Levels
+from src.utils.db import Database
+from src.utils.fixtures import FIRST_USER_ID, seed_user_levels
+from src.utils.pipeline import MessagePipeline
+
+GUILD_ID = 1
+
+
+class VirtualClock:
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self._epoch = datetime.now()
+
+    def monotonic(self) -> float:
+        return self.seconds
+
+    def now(self) -> datetime:
+        return self._epoch + timedelta(seconds=self.seconds)
+
+
+def plan_messages(
+    count: int, users: int, rate: float, hit_ratio: float, cooldown: float, seed: int
+) -> tuple[list[tuple[float, int]], int]:
+    """(виртуальное время, автор) для каждого сообщения и число ожидаемых попаданий в кулдаун.
+
+    Попадание — автор, получивший опыт меньше ``cooldown`` секунд назад;
+    промах — любой другой. Если нужной группы сейчас нет (все на
+    кулдауне или никого), берётся другая — фактическая доля возвращается.
+    """
+    rng = random.Random(seed)
+    recent: OrderedDict[int, float] = OrderedDict()  # автор -> время начисления
+    hot: deque[int] = deque(maxlen=1024)
+    plan = []
+    hits = 0
+    for i in range(count):
+        now = i / rate
+        while recent and now - next(iter(recent.values())) >= cooldown:
+            recent.popitem(last=False)
+        user_id = None
+        if recent and rng.random() < hit_ratio:
+            for _ in range(8):
+                candidate = rng.choice(hot)
+                if candidate in recent:
+                    user_id = candidate
+                    break
+        if user_id is None and len(recent) < users:
+            while True:
+                candidate = FIRST_USER_ID + rng.randrange(users)
+                if candidate not in recent:
+                    user_id = candidate
+                    break
+        if user_id is None:
+            user_id = next(iter(recent))
+        if user_id in recent:
+            hits += 1
+        else:
+            recent[user_id] = now
+            hot.append(user_id)
+        plan.append((now, user_id))
+    return plan, hits
+
+
+def _message(guild, user_id: int, created_at: datetime):
+    author = types.SimpleNamespace(id=user_id, bot=False, roles=[], guild=guild, mention=f"<@{user_id}>")
+    return types.SimpleNamespace(
+        author=author, guild=guild, channel=types.SimpleNamespace(id=1), content="hello", created_at=created_at
+    )
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    tmp_dir = None
+    options = dict(write_behind=args.write_behind, wal=args.wal, read_pool_size=args.read_pool, slow_query_ms=0)
+    if args.memory:
+        db = Database.in_memory(**options)
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix="amadeus-bench-")
+        db = Database(os.path.join(tmp_dir, "bench.db"), **options)
+    await db.connect()
+    try:
+        await db.init_schema()
+        await seed_user_levels(db, GUILD_ID, args.seeded, rng=random.Random(args.seed))
+
+        settings = types.SimpleNamespace(
+            levels_flush_interval=args.flush_interval,
+            levels_buffer_max_users=args.buffer_max_users,
+            rank_card_workers=0,
+        )
+        pipeline = MessagePipeline()
+        cog = Levels(types.SimpleNamespace(db=db, settings=settings, message_pipeline=pipeline))
+        clock = VirtualClock()
+        cog._monotonic = clock.monotonic
+        cog._now = clock.now
+        await cog.cog_load()
+        # Цикл сброса работает по настоящим часам; здесь буфер сбрасывается в конце прогона
+        cog.xp_flush_loop.cancel()
+
+        plan, planned_hits = plan_messages(
+            args.messages, args.users, args.rate, args.hit_ratio, cog.xp_cooldown, args.seed
+        )
+        guild = types.SimpleNamespace(id=GUILD_ID, get_role=lambda role_id: None)
+        epoch = datetime.now(timezone.utc)
+        messages = [(at, _message(guild, user_id, epoch + timedelta(seconds=at))) for at, user_id in plan]
+        latencies: list[float] = []
+
+        async def handle(at: float, message) -> None:
+            clock.seconds = max(clock.seconds, at)
+            started = time.perf_counter()
+            await pipeline.process(message)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        db.metrics.reset()
+        pipeline.reset()
+        started = time.perf_counter()
+        if args.realtime:
+            tasks = []
+            for at, message in messages:
+                delay = started + at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(handle(at, message)))
+            await asyncio.gather(*tasks)
+        else:
+            queue = iter(messages)
+
+            async def worker() -> None:
+                for at, message in queue:
+                    await handle(at, message)
+
+            await asyncio.gather(*(worker() for _ in range(max(1, args.concurrency))))
+        flushed = await cog.flush_pending()
+        await db.flush()
+        elapsed = time.perf_counter() - started
+        statements = db.metrics.total_calls
+
+        return {
+            "benchmark": "levels_replay",
+            "commit": _commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": {
+                "messages": args.messages,
+                "users": args.users,
+                "seeded": args.seeded,
+                "rate": args.rate,
+                "hit_ratio": args.hit_ratio,
+                "concurrency": args.concurrency,
+                "realtime": args.realtime,
+                "memory": args.memory,
+                "write_behind": args.write_behind,
+                "wal": args.wal,
+                "flush_interval": args.flush_interval,
+            },
+            "results": {
+                "messages_per_s": round(args.messages / elapsed, 1),
+                "seconds": round(elapsed, 3),
+                "cooldown_hit_ratio": round(planned_hits / max(1, args.messages), 3),
+                "latency_ms_p50": round(statistics.median(latencies), 3),
+                "latency_ms_p95": round(_percentile(latencies, 0.95), 3),
+                "latency_ms_p99": round(_percentile(latencies, 0.99), 3),
+                "latency_ms_max": round(max(latencies), 3),
+                "sql_statements": statements,
+                "sql_per_message": round(statements / max(1, args.messages), 3),
+                "final_flush_users": flushed,
+            },
+            "stages": [
+                {"stage": st.name, "calls": st.calls, "avg_ms": round(st.avg_ms, 4), "max_ms": round(st.max_ms, 3)}
+                for st in pipeline.stats()
+            ],
+            "statements": [
+                {"sql": s.sql, "calls": s.calls, "total_ms": round(s.total_ms, 2)} for s in db.metrics.top(8)
+            ],
+        }
+    finally:
+        await db.close()
+        if tmp_dir is not None:
+            for name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, name))
+            os.rmdir(tmp_dir)
+
+
+def _compare(result: dict, baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline.get('commit')}):")
+    for name, value in result["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if isinstance(old, (int, float)) and isinstance(value, (int, float)) and old:
+            print(f"  {name:<20} {old:>12} -> {value:<12} {100 * (value - old) / old:+.1f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=20_000, help="сколько разных авторов пишет")
+    parser.add_argument("--seeded", type=int, default=20_000, help="строк user_levels до начала")
+    parser.add_argument("--rate", type=float, default=200.0, help="сообщений в секунду виртуального времени")
+    parser.add_argument("--hit-ratio", type=float, default=0.5, help="доля сообщений на кулдауне")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--realtime", action="store_true", help="подавать сообщения по настоящим часам")
+    parser.add_argument("--memory", action="store_true", help="in-memory база вместо временного файла")
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--wal", action="store_true")
+    parser.add_argument("--read-pool", type=int, default=0)
+    parser.add_argument("--flush-interval", type=float, default=0.0, help="LEVELS_FLUSH_INTERVAL (0 — без буфера)")
+    parser.add_argument("--buffer-max-users", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="куда записать результат")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    for name, value in result["results"].items():
+        print(f"{name:<20} {value}")
+    if args.baseline:
+        _compare(result, args.baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Бенчмарк карточек /lvl: пропускная способность пула и задержка рендера.
+
+    python -m benchmarks.rank_cards --cards 200 --workers 4 --json out.json
+
+Аватар синтетический, сеть и Discord не нужны.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import time
+
+from src.utils.leveling import curve_for
+from src.utils.rank_card import RankCard, RankCardRenderer
+
+
+def _avatar_png(size: int = 256) -> bytes:
+    import numpy as np
+    from matplotlib.image import imsave
+
+    y, x = np.mgrid[0:size, 0:size] / size
+    image = np.dstack([x, y, 1 - x * y])
+    buffer = io.BytesIO()
+    imsave(buffer, image, format="png")
+    return buffer.getvalue()
+
+
+def _cards(count: int, avatar: bytes) -> list[tuple[tuple, RankCard]]:
+    curve = curve_for(1.2)
+    cards = []
+    for i in range(count):
+        xp = 137 * i + 50
+        level, into, span = curve.progress(xp)
+        cards.append(((i, level, xp, "bench"), RankCard(f"Участник {i}", level, xp, into, span, i + 1, count, avatar)))
+    return cards
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(cards: int, workers: int) -> dict:
+    avatar = _avatar_png()
+    renderer = RankCardRenderer(workers=workers)
+    try:
+        started = time.perf_counter()
+        await renderer.warm_up()
+        warm_up_s = time.perf_counter() - started
+
+        # Пропускная способность: все карточки разом, пул занят полностью
+        batch = _cards(cards, avatar)
+        started = time.perf_counter()
+        await asyncio.gather(*(renderer.render(key, card) for key, card in batch))
+        throughput_s = time.perf_counter() - started
+
+        # Задержка одного рендера без очереди
+        latencies = []
+        for key, card in _cards(min(cards, 100), avatar):
+            started = time.perf_counter()
+            await renderer.render(("latency", *key), card)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        hits = []
+        for key, card in batch[:100]:
+            started = time.perf_counter()
+            await renderer.render(key, card)
+            hits.append((time.perf_counter() - started) * 1e6)
+
+        return {
+            "cards": cards,
+            "workers": workers,
+            "warm_up_s": round(warm_up_s, 3),
+            "cards_per_s": round(cards / throughput_s, 1),
+            "render_ms_p50": round(statistics.median(latencies), 2),
+            "render_ms_p99": round(_percentile(latencies, 0.99), 2),
+            "render_ms_max": round(max(latencies), 2),
+            "cache_hit_us_p50": round(statistics.median(hits), 2),
+            "png_bytes_avg": renderer.cached_bytes // max(1, len(renderer)),
+        }
+    finally:
+        renderer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--json", help="куда записать результат")
+    args = parser.parse_args()
+    result = asyncio.run(run(args.cards, args.workers))
+    for name, value in result.items():
+        print(f"{name:<18} {value}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,11 @@ from discord.ext import commands
 from .config import load_settings
 from discord import app_commands
 from .utils.logging_setup import setup_logging
+from .utils.backup import restore_latest
 from .utils.db import Database
+from .utils.migrations import adopt_legacy_rows
+from .utils.pipeline import MessagePipeline
+from .utils.settings_store import SettingsStore
 
 
 class RestrictedCommandTree(app_commands.CommandTree):
@@ -37,39 +41,31 @@ class AmadeusBot(commands.Bot):
         super().__init__(command_prefix=commands.when_mentioned_or(prefix), intents=intents, tree_cls=RestrictedCommandTree)
         self.db = db
         self.settings = settings
+        self._legacy_rows_checked = False
+        # Один слушатель on_message; cog'и регистрируют в нём свои стадии
+        self.message_pipeline = MessagePipeline()
+        self.add_listener(self.message_pipeline.process, "on_message")
 
     async def setup_hook(self) -> None:
+        # Восстановление из снимка возможно только до открытия файла БД
+        if self.settings.db_backup_dir and self.settings.db_restore != "off":
+            await asyncio.to_thread(
+                restore_latest, self.db.path, self.settings.db_backup_dir, self.settings.db_restore
+            )
         await self.db.connect()
-        await self.db.init_schema()
+        # Старые строки без guild_id достаются серверу из GUILD_ID (если задан)
+        await self.db.init_schema(legacy_guild_id=self.settings.guild_id or 0)
         
-        # Добавляем персистентные view для кнопок с учётом сохранённых настроек
+        # Таблица settings целиком в памяти; cog'и читают её отсюда
+        self.settings_store = SettingsStore(self.db)
+        await self.settings_store.load()
+
+        # Добавляем персистентные view для кнопок; настройки сервера
+        # (категория, роль поддержки) кнопка берёт из settings_store при нажатии
         from src.cogs.tickets import TicketButton, CloseTicketView
-        category_id_val = None
-        support_role_id_val = None
-        try:
-            row = await self.db.fetchone("SELECT value FROM settings WHERE key='tickets_category_id'")
-            if row and str(row[0]).isdigit():
-                category_id_val = int(row[0])
-        except Exception:
-            pass
-        try:
-            row = await self.db.fetchone("SELECT value FROM settings WHERE key='tickets_support_role_id'")
-            if row and str(row[0]).isdigit():
-                support_role_id_val = int(row[0])
-        except Exception:
-            pass
-        self.add_view(TicketButton(self, category_id_val, support_role_id_val))
+        self.add_view(TicketButton(self))
         self.add_view(CloseTicketView())
 
-        # Подтягиваем welcome настройки
-        try:
-            row = await self.db.fetchone("SELECT value FROM settings WHERE key='welcome_channel_id'")
-            self.welcome_channel_id = int(row[0]) if row and str(row[0]).isdigit() else None  # type: ignore[attr-defined]
-            row2 = await self.db.fetchone("SELECT value FROM settings WHERE key='welcome_image_url'")
-            self.welcome_image_url = row2[0] if row2 else None  # type: ignore[attr-defined]
-        except Exception:
-            pass
-
         # Ограничение для prefix/hybrid-команд
         async def predicate(ctx: commands.Context) -> bool:
             # Команды уровней доступны всем
@@ -94,6 +90,7 @@ class AmadeusBot(commands.Bot):
             "src.cogs.stats",
             "src.cogs.security",
             "src.cogs.levels",
+            "src.cogs.maintenance",
         ):
             try:
                 await self.load_extension(ext)
@@ -106,7 +103,27 @@ class AmadeusBot(commands.Bot):
         except Exception:
             logging.exception("Failed to sync application commands")
 
+    async def on_ready(self) -> None:
+        # База, мигрировавшая без GUILD_ID, хранит старые строки под guild_id = 0;
+        # если бот работает на одном сервере, отдаём их ему
+        if not self._legacy_rows_checked and len(self.guilds) == 1:
+            self._legacy_rows_checked = True
+            try:
+                if await adopt_legacy_rows(self.db, self.guilds[0].id):
+                    await self.settings_store.load()
+            except Exception:
+                logging.exception("Failed to adopt legacy rows")
+
     async def close(self) -> None:
+        # Буферы cog'ов (например, накопленный опыт Levels) пишем, пока БД открыта
+        for cog in list(self.cogs.values()):
+            flush = getattr(cog, "flush_pending", None)
+            if flush is None:
+                continue
+            try:
+                await flush()
+            except Exception:
+                logging.exception("Failed to flush %s on shutdown", type(cog).__name__)
         await super().close()
         await self.db.close()
 
@@ -130,7 +147,16 @@ async def main() -> None:
     intents.voice_states = True
     intents.presences = False
 
-    db = Database(settings.db_path)
+    db = Database(
+        settings.db_path,
+        write_behind=settings.db_write_behind,
+        batch_size=settings.db_batch_size,
+        flush_interval=settings.db_flush_interval,
+        wal=settings.db_wal,
+        read_pool_size=settings.db_read_pool_size,
+        statement_cache_size=settings.db_statement_cache_size,
+        slow_query_ms=settings.db_slow_query_ms,
+    )
     bot = AmadeusBot(intents=intents, db=db, prefix=settings.prefix, settings=settings)
 
     async with bot:
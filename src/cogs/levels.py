@@ -1,15 +1,141 @@
 from __future__ import annotations
 
 import asyncio
+import io
+import json
 import logging
+import os
 import random
+import tempfile
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Literal
 
+import aiohttp
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+
+from src.utils.leveling import LevelCurve, curve_for
+from src.utils.levels_io import detect_format, export_levels, import_levels, open_text
+from src.utils.pipeline import ORDER_LEVELS, MessageContext
+from src.utils.rank_card import RankCard, RankCardRenderer
+from src.utils.ranking import GuildRanking, RankingIndex
+from src.utils.rewards import RewardSyncReport, RewardTable, run_reward_sync
 
 log = logging.getLogger(__name__)
 
+# Начисление за одно сообщение. WHERE у DO UPDATE пропускает пользователя,
+# если кулдаун ещё идёт: тогда RETURNING не вернёт строк.
+_AWARD_XP_SQL = """
+    INSERT INTO user_levels (guild_id, user_id, xp, level, last_message_time)
+    VALUES (?, ?, ?, xp_level(?), ?)
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET
+        xp = xp + excluded.xp,
+        level = xp_level(xp + excluded.xp),
+        last_message_time = excluded.last_message_time
+    WHERE last_message_time IS NULL OR last_message_time < ?
+    RETURNING xp, level
+"""
+
+# Сброс накопленного опыта пачкой (режим буфера): кулдаун уже проверен в памяти
+_FLUSH_XP_SQL = """
+    INSERT INTO user_levels (guild_id, user_id, xp, level, last_message_time)
+    VALUES (?, ?, ?, xp_level(?), ?)
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET
+        xp = xp + excluded.xp,
+        level = xp_level(xp + excluded.xp),
+        last_message_time = max(coalesce(last_message_time, ''), excluded.last_message_time)
+"""
+
+# Опыт за голос: все собеседники за тик — одним оператором. Пары
+# (guild_id, user_id) приходят JSON-массивом; WHERE true нужен парсеру
+# SQLite, чтобы отличить ON CONFLICT upsert'а от JOIN ... ON.
+_VOICE_XP_SQL = """
+    INSERT INTO user_levels (guild_id, user_id, xp, level, last_message_time)
+    SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), ?, xp_level(?), NULL
+    FROM json_each(?) WHERE true
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET
+        xp = xp + excluded.xp,
+        level = xp_level(xp + excluded.xp)
+    RETURNING guild_id, user_id, xp, level
+"""
+
+class LeaderboardView(discord.ui.View):
+    """Кнопки листания топа. Для каждой открытой страницы хранится курсор —
+    (xp, user_id) последней строки предыдущей, так что «назад» тоже без OFFSET."""
+
+    def __init__(self, cog: "Levels", guild_id: int, author_id: int, page_size: int):
+        super().__init__(timeout=180)
+        self.cog = cog
+        self.guild_id = guild_id
+        self.author_id = author_id
+        self.page_size = page_size
+        self.page = 0
+        self.cursors: list[tuple[int, int] | None] = [None]
+        self.message: discord.Message | None = None
+
+    async def render(self) -> discord.Embed | None:
+        """Embed текущей страницы; None, если рейтинг пуст."""
+        description, next_cursor, total = await self.cog._leaderboard_page(
+            self.guild_id, self.page_size, self.cursors[self.page]
+        )
+        if not total:
+            return None
+        del self.cursors[self.page + 1:]
+        if next_cursor is not None:
+            self.cursors.append(next_cursor)
+        self.first_page.disabled = self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = next_cursor is None
+
+        embed = discord.Embed(
+            title="🏆 Топ пользователей по уровню",
+            description=description,
+            color=discord.Color.gold()
+        )
+        pages = -(-total // self.page_size)
+        embed.set_footer(text=f"Страница {self.page + 1} из {pages} • участников в топе: {total:,}")
+        embed.timestamp = discord.utils.utcnow()
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ Листать топ может только тот, кто его вызвал.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction, page: int):
+        self.page = page
+        embed = await self.render()
+        if embed is None:
+            await interaction.response.edit_message(content="📊 Пока нет данных об уровнях.", embed=None, view=None)
+            return
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(emoji="⏮️", style=discord.ButtonStyle.secondary)
+    async def first_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, 0)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.primary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, max(0, self.page - 1))
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.page + 1 < len(self.cursors):
+            await self._show(interaction, self.page + 1)
+        else:
+            await interaction.response.defer()
+
+    async def on_timeout(self) -> None:
+        for item in self.children:
+            item.disabled = True  # type: ignore[attr-defined]
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
 
 class Levels(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -17,92 +143,351 @@ class Levels(commands.Cog):
         self.xp_cooldown = 60  # секунды между начислением XP
         self.xp_range = (15, 25)  # диапазон XP за сообщение
         self.level_multiplier = 1.2  # множитель для расчета следующего уровня
+        # Время последнего начисления по (guild_id, user_id); ограничено по размеру
+        self.cooldown_cache_size = 10_000
+        self._cooldowns: OrderedDict[tuple[int, int], float] = OrderedDict()
+        # Часы начисления; benchmarks/levels_replay подменяет их виртуальными
+        self._monotonic = time.monotonic
+        self._now = datetime.now
+        # Буфер опыта: прирост копится в памяти и пишется пачкой раз в
+        # xp_flush_interval секунд (0 — каждое начисление сразу в БД)
+        settings = getattr(bot, "settings", None)
+        self.xp_flush_interval: float = getattr(settings, "levels_flush_interval", 0.0)
+        self.xp_buffer_max_users: int = getattr(settings, "levels_buffer_max_users", 5000)
+        self._pending: dict[tuple[int, int], list] = {}  # key -> [прирост, время последнего]
+        self._flushing: dict[tuple[int, int], list] = {}
+        self._xp_totals: OrderedDict[tuple[int, int], int] = OrderedDict()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        # Рейтинг серверов в памяти: место в /lvl и страницы /leaderboard без SQL
+        self.ranking = RankingIndex(bot.db)
+        # Награды за уровни по серверам (сбрасываются при /reward-add и /reward-remove)
+        self._rewards: dict[int, RewardTable] = {}
+        self.rewards_sync_chunk_size = 500
+        self.rewards_sync_concurrency = 4  # одновременных member.edit
+        self._sync_tasks: dict[int, asyncio.Task] = {}
+        self._sync_reports: dict[int, RewardSyncReport] = {}
+        # Картинка-карточка для /lvl; рендер в пуле процессов, PNG в LRU-кэше
+        workers: int = getattr(settings, "rank_card_workers", 0)
+        self.rank_cards: RankCardRenderer | None = None
+        if workers > 0:
+            cache_mb: float = getattr(settings, "rank_card_cache_mb", 16.0)
+            self.rank_cards = RankCardRenderer(workers=workers, cache_bytes=int(cache_mb * 1024 * 1024))
+        self._warm_up_task: asyncio.Task | None = None
+        # Опыт за голос: раз в voice_xp_interval секунд (0 — выключено) всем,
+        # кто сидит не в AFK-канале, не заглушён и не один
+        self.voice_xp_interval: float = getattr(settings, "levels_voice_interval", 0.0)
+        self.voice_xp_per_tick: int = getattr(settings, "levels_voice_xp", 10)
+        self.voice_xp_min_members: int = getattr(settings, "levels_voice_min_members", 2)
+
+    @property
+    def curve(self) -> LevelCurve:
+        """Таблица порогов для текущего множителя (строится один раз)"""
+        return curve_for(self.level_multiplier)
 
     def calculate_level(self, xp: int) -> int:
         """Вычисляет уровень на основе опыта"""
-        level = 0
-        required_xp = 100
-        while xp >= required_xp:
-            xp -= required_xp
-            level += 1
-            required_xp = int(required_xp * self.level_multiplier)
-        return level
+        return self.curve.level_for(xp)
 
     def calculate_xp_for_level(self, level: int) -> int:
         """Вычисляет общий опыт, необходимый для достижения уровня"""
-        total_xp = 0
-        required_xp = 100
-        for _ in range(level):
-            total_xp += required_xp
-            required_xp = int(required_xp * self.level_multiplier)
-        return total_xp
+        return self.curve.xp_for_level(level)
 
     def calculate_xp_to_next_level(self, current_xp: int) -> int:
         """Вычисляет опыт до следующего уровня"""
-        current_level = self.calculate_level(current_xp)
-        next_level_xp = self.calculate_xp_for_level(current_level + 1)
-        return next_level_xp - current_xp
+        return self.curve.xp_to_next(current_xp)
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        """Начисляет опыт за сообщения"""
-        if message.author.bot or not message.guild:
-            return
+    async def cog_load(self) -> None:
+        # Уровень считается прямо в UPSERT начисления, по той же таблице порогов
+        await self.bot.db.create_function("xp_level", 1, self.calculate_level)
+        if self.xp_flush_interval > 0:
+            self.xp_flush_loop.change_interval(seconds=self.xp_flush_interval)
+            self.xp_flush_loop.start()
+        if self.rank_cards is not None:
+            self._warm_up_task = asyncio.create_task(self._warm_up_rank_cards())
+        if self.voice_xp_interval > 0:
+            self.voice_xp_loop.change_interval(seconds=self.voice_xp_interval)
+            self.voice_xp_loop.start()
+        self.bot.message_pipeline.register("levels", self.levels_stage, order=ORDER_LEVELS)
 
+    async def _warm_up_rank_cards(self) -> None:
         try:
-            db = self.bot.db
-            user_id = message.author.id
+            await self.rank_cards.warm_up()
+        except Exception as e:
+            log.exception("Failed to start rank card workers: %s", e)
 
-            # Проверяем кулдаун
-            result = await db.fetchone(
-                "SELECT last_message_time FROM user_levels WHERE user_id = ?", user_id
-            )
-            
-            if result:
-                last_message_time = datetime.fromisoformat(result[0])
-                if datetime.now() - last_message_time < timedelta(seconds=self.xp_cooldown):
-                    return
-            else:
-                # Создаем запись для нового пользователя
-                await db.exec(
-                    "INSERT INTO user_levels (user_id, xp, level, last_message_time) VALUES (?, 0, 0, ?)",
-                    user_id, datetime.now().isoformat()
-                )
+    async def cog_unload(self) -> None:
+        self.bot.message_pipeline.unregister("levels")
+        self.xp_flush_loop.cancel()
+        self.voice_xp_loop.cancel()
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+        if self.rank_cards is not None:
+            self.rank_cards.close()
+        # Прогресс /rewards-sync сохранён по пачкам — следующий запуск продолжит
+        for task in self._sync_tasks.values():
+            task.cancel()
+        await self.flush_pending()
 
-            # Начисляем случайный опыт
-            xp_gained = random.randint(*self.xp_range)
-            
-            # Обновляем опыт и время последнего сообщения
-            await db.exec(
-                "UPDATE user_levels SET xp = xp + ?, last_message_time = ? WHERE user_id = ?",
-                xp_gained, datetime.now().isoformat(), user_id
-            )
+    @tasks.loop(seconds=5)
+    async def xp_flush_loop(self):
+        await self.flush_pending()
 
-            # Получаем обновленные данные
-            result = await db.fetchone(
-                "SELECT xp, level FROM user_levels WHERE user_id = ?", user_id
+    @tasks.loop(seconds=60)
+    async def voice_xp_loop(self):
+        try:
+            await self.award_voice_xp()
+        except Exception as e:
+            log.exception("Error awarding voice XP: %s", e)
+
+    @voice_xp_loop.before_loop
+    async def _before_voice_xp_loop(self):
+        await self.bot.wait_until_ready()
+
+    def _voice_eligible(self, guild: discord.Guild) -> list[int]:
+        """Кто получает опыт за голос в этом тике — по кэшу шлюза, без запросов"""
+        afk_id = guild.afk_channel.id if guild.afk_channel else None
+        eligible = []
+        for channel in (*guild.voice_channels, *guild.stage_channels):
+            if channel.id == afk_id:
+                continue
+            humans = [m for m in channel.members if not m.bot]
+            # Одному в канале опыт не идёт: иначе его можно фармить в пустой комнате
+            if len(humans) < self.voice_xp_min_members:
+                continue
+            eligible.extend(
+                m.id for m in humans
+                if m.voice is not None and not (m.voice.self_deaf or m.voice.deaf)
             )
-            if not result:
-                return
+        return eligible
 
-            old_xp, old_level = result
-            new_level = self.calculate_level(old_xp)
+    async def award_voice_xp(self) -> int:
+        """Один тик опыта за голос: одна транзакция на все серверы; возвращает число участников."""
+        pairs = [[guild.id, user_id] for guild in self.bot.guilds for user_id in self._voice_eligible(guild)]
+        if not pairs:
+            return 0
+        gain = self.voice_xp_per_tick
+        rows = await self.bot.db.exec_returning(_VOICE_XP_SQL, gain, gain, json.dumps(pairs))
+        for guild_id, user_id, xp, _ in rows:
+            key = (guild_id, user_id)
+            # В БД нет опыта из буфера сообщений — досчитываем его, как в _get_user_xp;
+            # уровень тоже по полному опыту, иначе повышение заметит только следующий flush
+            total = xp + self._buffered_gain(key)
+            if key in self._xp_totals:
+                self._remember_total(key, total)
+            self.ranking.update(guild_id, user_id, total)
+            level = self.calculate_level(total)
+            if level > self.calculate_level(total - gain):
+                guild = self.bot.get_guild(guild_id)
+                member = guild.get_member(user_id) if guild else None
+                if member is not None:
+                    await self._give_level_rewards(guild, member, level)
+        return len(rows)
 
-            # Проверяем, повысился ли уровень
-            if new_level > old_level:
-                await db.exec(
-                    "UPDATE user_levels SET level = ? WHERE user_id = ?",
-                    new_level, user_id
+    async def flush_pending(self) -> int:
+        """Пишет накопленный опыт одной транзакцией; возвращает число пользователей."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            try:
+                await self.bot.db.exec_many(
+                    _FLUSH_XP_SQL,
+                    [(g, u, gain, gain, stamp) for (g, u), (gain, stamp) in batch.items()],
                 )
-                
-                # Выдаем награды за уровень
-                await self._give_level_rewards(message.guild, message.author, new_level)
-                
-                # Уведомления о повышении уровня отключены
-                # await self._send_level_up_message(message, message.author, new_level, old_level)
+            except Exception:
+                log.exception("Failed to flush XP for %d users, keeping them buffered", len(batch))
+                for key, (gain, stamp) in batch.items():
+                    pending = self._pending.setdefault(key, [0, stamp])
+                    pending[0] += gain
+                    pending[1] = max(pending[1], stamp)
+                return 0
+            finally:
+                self._flushing = {}
+            return len(batch)
+
+    def _buffered_gain(self, key: tuple[int, int]) -> int:
+        return self._pending.get(key, (0,))[0] + self._flushing.get(key, (0,))[0]
+
+    async def _guild_ranking(self, guild_id: int) -> GuildRanking:
+        # Опыт из буфера ещё не в БД — досыпаем его при первой загрузке рейтинга
+        return await self.ranking.guild(
+            guild_id,
+            overlay=lambda: [(u, xp) for (g, u), xp in self._xp_totals.items() if g == guild_id],
+        )
+
+    def _remember_total(self, key: tuple[int, int], xp: int) -> None:
+        totals = self._xp_totals
+        totals[key] = xp
+        totals.move_to_end(key)
+        if len(totals) > self.cooldown_cache_size:
+            totals.popitem(last=False)
+
+    def _on_cooldown(self, key: tuple[int, int], now: float) -> bool:
+        last = self._cooldowns.get(key)
+        return last is not None and now - last < self.xp_cooldown
+
+    def _touch_cooldown(self, key: tuple[int, int], now: float) -> None:
+        cooldowns = self._cooldowns
+        cooldowns[key] = now
+        cooldowns.move_to_end(key)
+        # Записи упорядочены по времени: истёкшие и лишние всегда в начале
+        while cooldowns:
+            oldest_key, oldest = next(iter(cooldowns.items()))
+            if now - oldest < self.xp_cooldown and len(cooldowns) <= self.cooldown_cache_size:
+                break
+            del cooldowns[oldest_key]
+
+    async def _leaderboard_page(
+        self, guild_id: int, page_size: int, cursor: tuple[int, int] | None
+    ) -> tuple[str, tuple[int, int] | None, int]:
+        """(текст страницы, курсор следующей или None, участников в топе).
+
+        Страница берётся из того же рейтинга в памяти, что и место в /lvl:
+        с опытом из буфера и без задержки до записи в БД. Строк берётся на
+        одну больше размера страницы — так видно, есть ли следующая.
+        """
+        ranking = await self._guild_ranking(guild_id)
+        rows = ranking.after(cursor, page_size + 1)
+        lines = []
+        for user_id, xp in rows[:page_size]:
+            i = ranking.rank(user_id)
+            medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"**{i}.**"
+            lines.append(f"{medal} <@{user_id}> - Уровень **{self.calculate_level(xp)}** ({xp:,} XP)")
+        next_cursor = (rows[page_size - 1][1], rows[page_size - 1][0]) if len(rows) > page_size else None
+        return "\n".join(lines), next_cursor, len(ranking)
+
+    async def _set_in_guild(self, guild_id: int, user_ids: list[int], present: bool) -> None:
+        await self.bot.db.exec_many(
+            "UPDATE user_levels SET in_guild = ? WHERE guild_id = ? AND user_id = ?",
+            [(int(present), guild_id, user_id) for user_id in user_ids],
+        )
+
+    async def _sync_members(self, guild: discord.Guild) -> int:
+        """Сверяет флаг in_guild с полным списком участников; возвращает число исправленных строк."""
+        if not guild.chunked:
+            return 0  # без полного списка ушедшего не отличить от незагруженного
+        member_ids = {member.id for member in guild.members}
+        left, returned = [], []
+        async for user_id, in_guild in self.bot.db.iterate(
+            "SELECT user_id, in_guild FROM user_levels WHERE guild_id = ?", guild.id, chunk_size=5000
+        ):
+            if in_guild and user_id not in member_ids:
+                left.append(user_id)
+            elif not in_guild and user_id in member_ids:
+                returned.append(user_id)
+        if left:
+            await self._set_in_guild(guild.id, left, False)
+        if returned:
+            await self._set_in_guild(guild.id, returned, True)
+        if left or returned:
+            self.ranking.invalidate(guild.id)
+            log.info("Leaderboard membership for guild %s: %d left, %d returned", guild.id, len(left), len(returned))
+        return len(left) + len(returned)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        for guild in self.bot.guilds:
+            try:
+                await self._sync_members(guild)
+            except Exception as e:
+                log.exception("Failed to sync members of guild %s: %s", guild.id, e)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        await self._sync_members(guild)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        """Ушедший пропадает из топа, но его опыт сохраняется до возвращения"""
+        try:
+            await self._set_in_guild(member.guild.id, [member.id], False)
+            self.ranking.remove(member.guild.id, member.id)
+        except Exception as e:
+            log.exception("Failed to hide %s from leaderboard: %s", member, e)
 
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        try:
+            rows = await self.bot.db.exec_returning(
+                "UPDATE user_levels SET in_guild = 1 WHERE guild_id = ? AND user_id = ? RETURNING xp",
+                member.guild.id, member.id,
+            )
+            if rows:
+                key = (member.guild.id, member.id)
+                total = self._xp_totals.get(key, rows[0][0] + self._buffered_gain(key))
+                self.ranking.update(member.guild.id, member.id, total)
         except Exception as e:
-            log.exception("Error in level system: %s", e)
+            log.exception("Failed to restore %s in leaderboard: %s", member, e)
+
+    async def levels_stage(self, ctx: MessageContext):
+        """Начисляет опыт за сообщения (стадия конвейера после security и stats)"""
+        # Кулдаун проверяется в памяти: сообщения внутри окна не трогают БД
+        key = (ctx.guild_id, ctx.author_id)
+        now = self._monotonic()
+        if self._on_cooldown(key, now):
+            return
+        self._touch_cooldown(key, now)
+
+        xp_gained = random.randint(*self.xp_range)
+        if self.xp_flush_interval > 0:
+            result = await self._award_buffered(key, xp_gained)
+        else:
+            result = await self._award_direct(key, xp_gained)
+        if result is None:
+            return
+        old_level, new_level = result
+
+        # Проверяем, повысился ли уровень
+        if new_level > old_level:
+            # Выдаем награды за уровень
+            await self._give_level_rewards(ctx.guild, ctx.author, new_level)
+
+            # Уведомления о повышении уровня отключены
+            # await self._send_level_up_message(ctx.message, ctx.author, new_level, old_level)
+
+    async def _award_direct(self, key: tuple[int, int], xp_gained: int) -> tuple[int, int] | None:
+        """Начисление одним UPSERT; возвращает (старый уровень, новый) или None на кулдауне."""
+        stamp = self._now()
+        # Один UPSERT: создаёт запись, начисляет опыт и пересчитывает уровень.
+        # Условие по last_message_time страхует кулдаун для вытесненных из
+        # памяти пользователей и после перезапуска бота.
+        rows = await self.bot.db.exec_returning(
+            _AWARD_XP_SQL,
+            *key, xp_gained, xp_gained, stamp.isoformat(),
+            (stamp - timedelta(seconds=self.xp_cooldown)).isoformat(),
+        )
+        if not rows:
+            return None
+        new_xp, new_level = rows[0]
+        self.ranking.update(*key, new_xp)
+        return self.calculate_level(new_xp - xp_gained), new_level
+
+    async def _award_buffered(self, key: tuple[int, int], xp_gained: int) -> tuple[int, int] | None:
+        """Начисление в буфер: уровень считается по опыту в памяти, запись — позже пачкой."""
+        stamp = self._now().isoformat()
+        total = self._xp_totals.get(key)
+        if total is None:
+            row = await self.bot.db.fetchone(
+                "SELECT xp, last_message_time FROM user_levels WHERE guild_id = ? AND user_id = ?", *key
+            )
+            cutoff = (self._now() - timedelta(seconds=self.xp_cooldown)).isoformat()
+            if row and row[1] and row[1] >= cutoff and not self._buffered_gain(key):
+                return None  # кулдаун из БД: например, сразу после перезапуска
+            total = self._xp_totals.get(key, (row[0] if row else 0) + self._buffered_gain(key))
+        self._remember_total(key, total + xp_gained)
+        self.ranking.update(*key, total + xp_gained)
+
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = [xp_gained, stamp]
+        else:
+            pending[0] += xp_gained
+            pending[1] = stamp
+        if len(self._pending) >= self.xp_buffer_max_users and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush_pending())
+        return self.calculate_level(total), self.calculate_level(total + xp_gained)
 
     async def _send_level_up_message(self, message: discord.Message, user: discord.Member, new_level: int, old_level: int):
         """Отправляет уведомление о повышении уровня"""
@@ -115,12 +500,12 @@ class Levels(commands.Cog):
             embed.set_thumbnail(url=user.display_avatar.url)
             embed.add_field(
                 name="Текущий опыт",
-                value=f"{await self._get_user_xp(user.id)} XP",
+                value=f"{await self._get_user_xp(user.guild.id, user.id)} XP",
                 inline=True
             )
             embed.add_field(
                 name="До следующего уровня",
-                value=f"{self.calculate_xp_to_next_level(await self._get_user_xp(user.id))} XP",
+                value=f"{self.calculate_xp_to_next_level(await self._get_user_xp(user.guild.id, user.id))} XP",
                 inline=True
             )
             embed.timestamp = discord.utils.utcnow()
@@ -129,49 +514,58 @@ class Levels(commands.Cog):
         except Exception as e:
             log.exception("Failed to send level up message: %s", e)
 
-    async def _get_user_xp(self, user_id: int) -> int:
+    async def _get_user_xp(self, guild_id: int, user_id: int) -> int:
         """Получает опыт пользователя"""
         try:
             db = self.bot.db
-            result = await db.fetchone("SELECT xp FROM user_levels WHERE user_id = ?", user_id)
-            return result[0] if result else 0
+            total = self._xp_totals.get((guild_id, user_id))
+            if total is not None:
+                return total
+            result = await db.fetchone(
+                "SELECT xp FROM user_levels WHERE guild_id = ? AND user_id = ?", guild_id, user_id
+            )
+            return (result[0] if result else 0) + self._buffered_gain((guild_id, user_id))
         except Exception:
             return 0
 
-    async def _get_user_level(self, user_id: int) -> int:
+    async def _get_user_level(self, guild_id: int, user_id: int) -> int:
         """Получает уровень пользователя"""
         try:
             db = self.bot.db
-            result = await db.fetchone("SELECT level FROM user_levels WHERE user_id = ?", user_id)
+            result = await db.fetchone(
+                "SELECT level FROM user_levels WHERE guild_id = ? AND user_id = ?", guild_id, user_id
+            )
             return result[0] if result else 0
         except Exception:
             return 0
 
+    async def _reward_table(self, guild_id: int) -> RewardTable:
+        """Награды сервера, отсортированные по уровню; читаются из БД один раз до изменения"""
+        table = self._rewards.get(guild_id)
+        if table is None:
+            rows = await self.bot.db.fetchall("SELECT level, role_id FROM level_rewards WHERE guild_id = ?", guild_id)
+            table = self._rewards[guild_id] = RewardTable.from_rows(rows)
+        return table
+
     async def _give_level_rewards(self, guild: discord.Guild, user: discord.Member, level: int):
         """Выдает награды за достижение уровня"""
         try:
-            db = self.bot.db
-            # Получаем все награды для этого уровня и ниже
-            rewards = await db.fetchall(
-                "SELECT role_id, role_name FROM level_rewards WHERE level <= ? ORDER BY level DESC",
-                level
-            )
-            
-            if not rewards:
+            table = await self._reward_table(guild.id)
+            if not table:
                 return
                 
-            # Получаем роли, которые уже есть у пользователя
+            # Все недостающие награды для этого уровня и ниже — одним запросом
             user_role_ids = {role.id for role in user.roles}
-            
-            for role_id, role_name in rewards:
-                if role_id not in user_role_ids:
-                    role = guild.get_role(role_id)
-                    if role and role not in user.roles:
-                        try:
-                            await user.add_roles(role, reason=f"Награда за достижение {level} уровня")
-                            log.info(f"Gave reward role {role_name} to {user} for level {level}")
-                        except Exception as e:
-                            log.exception(f"Failed to give role {role_name} to {user}: {e}")
+            roles = [
+                role for role_id in table.roles_for(level) - user_role_ids
+                if (role := guild.get_role(role_id)) is not None
+            ]
+            if roles:
+                try:
+                    await user.add_roles(*roles, reason=f"Награда за достижение {level} уровня")
+                    log.info(f"Gave reward roles {[r.name for r in roles]} to {user} for level {level}")
+                except Exception as e:
+                    log.exception(f"Failed to give reward roles to {user}: {e}")
                             
         except Exception as e:
             log.exception(f"Error giving level rewards to {user}: {e}")
@@ -179,47 +573,56 @@ class Levels(commands.Cog):
     async def _remove_level_rewards(self, guild: discord.Guild, user: discord.Member, level: int):
         """Удаляет награды выше указанного уровня"""
         try:
-            db = self.bot.db
-            # Получаем награды выше указанного уровня
-            rewards = await db.fetchall(
-                "SELECT role_id, role_name FROM level_rewards WHERE level > ?",
-                level
-            )
-            
-            if not rewards:
+            table = await self._reward_table(guild.id)
+            if not table:
                 return
                 
-            # Получаем роли, которые есть у пользователя
             user_role_ids = {role.id for role in user.roles}
-            
-            for role_id, role_name in rewards:
-                if role_id in user_role_ids:
-                    role = guild.get_role(role_id)
-                    if role and role in user.roles:
-                        try:
-                            await user.remove_roles(role, reason=f"Снижение уровня до {level}")
-                            log.info(f"Removed reward role {role_name} from {user} due to level {level}")
-                        except Exception as e:
-                            log.exception(f"Failed to remove role {role_name} from {user}: {e}")
+            above = (table.all_roles - table.roles_for(level)) & user_role_ids
+            roles = [role for role_id in above if (role := guild.get_role(role_id)) is not None]
+            if roles:
+                try:
+                    await user.remove_roles(*roles, reason=f"Снижение уровня до {level}")
+                    log.info(f"Removed reward roles {[r.name for r in roles]} from {user} due to level {level}")
+                except Exception as e:
+                    log.exception(f"Failed to remove reward roles from {user}: {e}")
                             
         except Exception as e:
             log.exception(f"Error removing level rewards from {user}: {e}")
 
+    async def _rank_card(
+        self, user: discord.Member, xp: int, level: int, progress: int, span: int, rank: int | None, total: int
+    ) -> bytes | None:
+        """PNG карточки для /lvl или None (картинки выключены или рендер не удался)"""
+        renderer = self.rank_cards
+        if renderer is None:
+            return None
+        avatar = user.display_avatar
+        key = renderer.key(user.id, level, xp, avatar.key)
+        png = renderer.cached(key)
+        if png is not None:
+            return png
+        try:
+            # Аватар качается только при промахе кэша
+            avatar_png = await avatar.replace(size=256, format="png").read()
+            card = RankCard(user.display_name, level, xp, progress, span, rank, total, avatar_png)
+            return await renderer.render(key, card)
+        except Exception as e:
+            log.exception("Failed to render rank card for %s: %s", user, e)
+            return None
+
     @commands.hybrid_command(name="lvl", description="Показать уровень и опыт пользователя")
     async def lvl(self, ctx: commands.Context, user: discord.Member | None = None):
         """Показать уровень и опыт пользователя"""
         target_user = user or ctx.author
         
         try:
-            xp = await self._get_user_xp(target_user.id)
-            level = self.calculate_level(xp)
-            xp_to_next = self.calculate_xp_to_next_level(xp)
-            
-            # Создаем прогресс-бар
-            current_level_xp = self.calculate_xp_for_level(level)
-            next_level_xp = self.calculate_xp_for_level(level + 1)
-            progress = xp - current_level_xp
-            total_needed = next_level_xp - current_level_xp
+            ranking = await self._guild_ranking(ctx.guild.id)
+            xp = ranking.xp(target_user.id) or 0
+            rank = ranking.rank(target_user.id)
+            # Уровень и прогресс внутри него — один поиск по таблице порогов
+            level, progress, total_needed = self.curve.progress(xp)
+            xp_to_next = total_needed - progress
             
             # Создаем визуальный прогресс-бар
             bar_length = 10
@@ -246,6 +649,11 @@ class Levels(commands.Cog):
                 value=f"**{xp_to_next:,}** XP",
                 inline=True
             )
+            embed.add_field(
+                name="Место",
+                value=f"**#{rank}** из {len(ranking)}" if rank else "—",
+                inline=True
+            )
             embed.add_field(
                 name="Прогресс",
                 value=f"`{bar}` {progress}/{total_needed}",
@@ -253,7 +661,12 @@ class Levels(commands.Cog):
             )
             embed.timestamp = discord.utils.utcnow()
             
-            await ctx.reply(embed=embed)
+            png = await self._rank_card(target_user, xp, level, progress, total_needed, rank, len(ranking))
+            if png is None:
+                await ctx.reply(embed=embed)
+            else:
+                embed.set_image(url="attachment://rank.png")
+                await ctx.reply(embed=embed, file=discord.File(io.BytesIO(png), filename="rank.png"))
             
         except Exception as e:
             log.exception("Error in level command: %s", e)
@@ -261,38 +674,19 @@ class Levels(commands.Cog):
 
     @commands.hybrid_command(name="leaderboard", description="Показать топ пользователей по уровню")
     async def leaderboard(self, ctx: commands.Context, limit: int = 10):
-        """Показать топ пользователей по уровню"""
+        """Показать топ пользователей по уровню (limit — строк на странице)"""
         if limit < 1 or limit > 25:
             await ctx.reply("❌ Лимит должен быть от 1 до 25.")
             return
             
         try:
-            db = self.bot.db
-            results = await db.fetchall(
-                "SELECT user_id, xp, level FROM user_levels ORDER BY xp DESC LIMIT ?",
-                limit
-            )
-            
-            if not results:
+            view = LeaderboardView(self, ctx.guild.id, ctx.author.id, limit)
+            embed = await view.render()
+            if embed is None:
                 await ctx.reply("📊 Пока нет данных об уровнях.")
                 return
             
-            embed = discord.Embed(
-                title="🏆 Топ пользователей по уровню",
-                color=discord.Color.gold()
-            )
-            
-            description = ""
-            for i, (user_id, xp, level) in enumerate(results, 1):
-                user = ctx.guild.get_member(user_id)
-                if user:
-                    medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"**{i}.**"
-                    description += f"{medal} {user.mention} - Уровень **{level}** ({xp:,} XP)\n"
-            
-            embed.description = description
-            embed.timestamp = discord.utils.utcnow()
-            
-            await ctx.reply(embed=embed)
+            view.message = await ctx.reply(embed=embed, view=view)
             
         except Exception as e:
             log.exception("Error in leaderboard command: %s", e)
@@ -307,10 +701,14 @@ class Levels(commands.Cog):
             # Удаляем награды перед сбросом
             await self._remove_level_rewards(ctx.guild, user, 0)
             
+            # Накопленный в буфере опыт тоже обнуляется
+            await self.flush_pending()
             await db.exec(
-                "UPDATE user_levels SET xp = 0, level = 0 WHERE user_id = ?",
-                user.id
+                "UPDATE user_levels SET xp = 0, level = 0 WHERE guild_id = ? AND user_id = ?",
+                ctx.guild.id, user.id
             )
+            self._xp_totals.pop((ctx.guild.id, user.id), None)
+            self.ranking.update(ctx.guild.id, user.id, 0)
             await ctx.reply(f"✅ Уровень пользователя {user.mention} сброшен.")
         except Exception as e:
             log.exception("Error in level reset: %s", e)
@@ -327,10 +725,11 @@ class Levels(commands.Cog):
         try:
             db = self.bot.db
             await db.exec(
-                "INSERT OR REPLACE INTO level_rewards (level, role_id, role_name) VALUES (?, ?, ?)",
-                level, role.id, role.name
+                "INSERT OR REPLACE INTO level_rewards (guild_id, level, role_id, role_name) VALUES (?, ?, ?, ?)",
+                ctx.guild.id, level, role.id, role.name, durable=True
             )
-            await ctx.reply(f"✅ Награда {role.mention} добавлена за {level} уровень.")
+            self._rewards.pop(ctx.guild.id, None)
+            await ctx.reply(f"✅ Награда {role.mention} добавлена за {level} уровень. Выдать её уже набравшим уровень: `/rewards-sync`.")
         except Exception as e:
             log.exception("Error adding level reward: %s", e)
             await ctx.reply("❌ Произошла ошибка при добавлении награды.")
@@ -341,24 +740,166 @@ class Levels(commands.Cog):
         """Удалить награду-роль за уровень"""
         try:
             db = self.bot.db
-            result = await db.fetchone("SELECT role_name FROM level_rewards WHERE level = ?", level)
+            result = await db.fetchone(
+                "SELECT role_name FROM level_rewards WHERE guild_id = ? AND level = ?", ctx.guild.id, level
+            )
             if not result:
                 await ctx.reply(f"❌ Награда за {level} уровень не найдена.")
                 return
                 
-            await db.exec("DELETE FROM level_rewards WHERE level = ?", level)
+            await db.exec("DELETE FROM level_rewards WHERE guild_id = ? AND level = ?", ctx.guild.id, level, durable=True)
+            self._rewards.pop(ctx.guild.id, None)
             await ctx.reply(f"✅ Награда за {level} уровень удалена.")
         except Exception as e:
             log.exception("Error removing level reward: %s", e)
             await ctx.reply("❌ Произошла ошибка при удалении награды.")
 
+    @commands.hybrid_command(name="rewards-sync", description="Привести роли-награды всех участников в соответствие с уровнями")
+    @commands.has_guild_permissions(administrator=True)
+    async def rewards_sync(self, ctx: commands.Context, restart: bool = False):
+        """Пересчитать роли-награды всех участников (прерванный прогон продолжается)"""
+        task = self._sync_tasks.get(ctx.guild.id)
+        if task is not None and not task.done():
+            report = self._sync_reports.get(ctx.guild.id)
+            progress = (
+                f": проверено {report.scanned:,}, обновлено {report.updated:,}, ошибок {report.failed:,}"
+                if report is not None else ""
+            )
+            await ctx.reply(f"⏳ Синхронизация уже идёт{progress}.")
+            return
+
+        table = await self._reward_table(ctx.guild.id)
+        if not table:
+            await ctx.reply("📋 Награды за уровни не настроены.")
+            return
+        await ctx.reply("🔄 Синхронизация наград запущена, итог придёт в этот канал.")
+        self._sync_tasks[ctx.guild.id] = asyncio.create_task(self._run_rewards_sync(ctx, table, restart))
+
+    async def _run_rewards_sync(self, ctx: commands.Context, table: RewardTable, restart: bool):
+        guild = ctx.guild
+        try:
+            # Уровни из буфера должны быть в БД до начала прохода
+            await self.flush_pending()
+            report = await run_reward_sync(
+                self.bot.db, guild, table,
+                chunk_size=self.rewards_sync_chunk_size,
+                concurrency=self.rewards_sync_concurrency,
+                restart=restart,
+                on_chunk=lambda r: self._sync_reports.__setitem__(guild.id, r),
+            )
+        except Exception as e:
+            log.exception("Reward sync for guild %s failed: %s", guild.id, e)
+            await ctx.channel.send("❌ Синхронизация наград прервалась; повторный `/rewards-sync` продолжит с места остановки.")
+            return
+        finally:
+            self._sync_tasks.pop(guild.id, None)
+            self._sync_reports.pop(guild.id, None)
+
+        embed = discord.Embed(
+            title="✅ Синхронизация наград завершена",
+            color=discord.Color.green() if not report.failed else discord.Color.orange()
+        )
+        embed.add_field(name="Проверено", value=f"{report.scanned:,}", inline=True)
+        embed.add_field(name="Обновлено", value=f"{report.updated:,}", inline=True)
+        embed.add_field(name="Без изменений", value=f"{report.unchanged:,}", inline=True)
+        embed.add_field(name="Нет на сервере", value=f"{report.missing:,}", inline=True)
+        embed.add_field(name="Ошибок", value=f"{report.failed:,}", inline=True)
+        embed.add_field(name="Время", value=f"{report.seconds:.1f} с", inline=True)
+        if report.resumed:
+            embed.set_footer(text="Продолжен прерванный прогон")
+        embed.timestamp = discord.utils.utcnow()
+        await ctx.channel.send(embed=embed)
+
+    def _forget_guild_xp(self, guild_id: int) -> None:
+        """Сбрасывает всё, что закэшировано об опыте сервера (после массовой записи в обход начисления)"""
+        for key in [key for key in self._xp_totals if key[0] == guild_id]:
+            del self._xp_totals[key]
+        self.ranking.invalidate(guild_id)
+
+    @commands.hybrid_command(name="levels-export", description="Выгрузить опыт участников в CSV или JSONL")
+    @commands.has_guild_permissions(administrator=True)
+    async def levels_export(self, ctx: commands.Context, fmt: Literal["csv", "jsonl"] = "csv"):
+        """Выгрузить опыт всех участников сервера (файл сжат gzip)"""
+        await ctx.defer()
+        path = os.path.join(tempfile.mkdtemp(prefix="amadeus-export-"), f"levels-{ctx.guild.id}.{fmt}.gz")
+        try:
+            await self.flush_pending()
+            with open_text(path, "w") as f:
+                report = await export_levels(self.bot.db, ctx.guild.id, f, fmt)
+            size = os.path.getsize(path)
+            if size > ctx.guild.filesize_limit:
+                await ctx.reply(
+                    f"❌ Файл получился {size / 1024 / 1024:.1f} МБ — больше лимита загрузки сервера. "
+                    "Используйте офлайн-выгрузку: `python -m src.utils.levels_io export`."
+                )
+                return
+            await ctx.reply(
+                f"📤 Выгружено **{report.rows:,}** строк за {report.seconds:.1f} с ({report.rows_per_s:,.0f} строк/с).",
+                file=discord.File(path),
+            )
+        except Exception as e:
+            log.exception("Error exporting levels: %s", e)
+            await ctx.reply("❌ Произошла ошибка при выгрузке опыта.")
+        finally:
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    @commands.hybrid_command(name="levels-import", description="Загрузить опыт из CSV/JSONL (MEE6, Arcane и т.п.)")
+    @commands.has_guild_permissions(administrator=True)
+    async def levels_import(
+        self,
+        ctx: commands.Context,
+        file: discord.Attachment,
+        mode: Literal["replace", "add", "max"] = "max",
+    ):
+        """Загрузить опыт из файла: replace — заменить, add — прибавить, max — оставить больший"""
+        try:
+            fmt = detect_format(file.filename)
+        except ValueError:
+            await ctx.reply("❌ Поддерживаются файлы .csv и .jsonl (можно .gz). Нужны колонки user_id и xp.")
+            return
+        await ctx.defer()
+        suffix = ".gz" if file.filename.lower().endswith(".gz") else ""
+        fd, path = tempfile.mkstemp(prefix="amadeus-import-", suffix=f".{fmt}{suffix}")
+        try:
+            # Вложение пишется на диск потоком, а не читается в память целиком
+            with os.fdopen(fd, "wb") as out:
+                async with aiohttp.ClientSession() as session, session.get(file.url) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.content.iter_chunked(64 * 1024):
+                        await asyncio.to_thread(out.write, chunk)
+            # Начисления из буфера должны лечь до импорта, а не поверх него
+            await self.flush_pending()
+            with open_text(path, "r") as f:
+                report = await import_levels(
+                    self.bot.db, ctx.guild.id, f, fmt, mode=mode, multiplier=self.level_multiplier
+                )
+            self._forget_guild_xp(ctx.guild.id)
+            await self._sync_members(ctx.guild)
+            await ctx.reply(
+                f"📥 Импортировано **{report.rows:,}** строк ({mode}) за {report.seconds:.1f} с "
+                f"— {report.rows_per_s:,.0f} строк/с. Пропущено: {report.skipped:,}.\n"
+                "Роли-награды по новым уровням выдаст `/rewards-sync`."
+            )
+        except Exception as e:
+            log.exception("Error importing levels: %s", e)
+            await ctx.reply("❌ Произошла ошибка при импорте опыта.")
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
     @commands.hybrid_command(name="rewards-list", description="Показать список наград за уровни")
     async def rewards_list(self, ctx: commands.Context):
         """Показать список наград за уровни"""
         try:
             db = self.bot.db
             rewards = await db.fetchall(
-                "SELECT level, role_name FROM level_rewards ORDER BY level ASC"
+                "SELECT level, role_name FROM level_rewards WHERE guild_id = ? ORDER BY level ASC", ctx.guild.id
             )
             
             if not rewards:
@@ -11,24 +11,21 @@ log = logging.getLogger(__name__)
 class Logs(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.log_channel_id: int | None = None
-        self.welcome_channel_id: int | None = None
-        self.welcome_image_url: str | None = None
-
-    async def cog_load(self):
-        """Загружается при инициализации кога"""
-        await self._load_welcome_settings()
+        self.log_channel_ids: dict[int, int] = {}  # guild_id -> channel_id
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         log.info("Member joined: %s (%s)", member, member.id)
         await self._send_log(
+            member.guild,
             embed=discord.Embed(title="👋 Присоединился", description=f"{member.mention}", color=discord.Color.green())
         )
         
         # Отправка приветственного embed в отдельный канал, если настроен
-        if self.welcome_channel_id:
-            channel = member.guild.get_channel(self.welcome_channel_id)
+        store = self.bot.settings_store  # type: ignore[attr-defined]
+        channel = store.get_channel(member.guild, "welcome_channel_id")
+        if channel is not None:
+            welcome_image_url = store.get_url(member.guild.id, "welcome_image_url")
             if isinstance(channel, discord.TextChannel):
                 try:
                     # Создаем красивое приветственное сообщение как на картинке
@@ -55,8 +52,8 @@ class Logs(commands.Cog):
                         embed.description += f"{instruction}\n"
                     
                     # Устанавливаем изображение если есть
-                    if hasattr(self, "welcome_image_url") and self.welcome_image_url:
-                        embed.set_image(url=self.welcome_image_url)
+                    if welcome_image_url:
+                        embed.set_image(url=welcome_image_url)
                     
                     # Добавляем информацию о сервере
                     embed.add_field(
@@ -76,27 +73,25 @@ class Logs(commands.Cog):
     async def on_member_remove(self, member: discord.Member):
         log.info("Member left: %s (%s)", member, member.id)
         await self._send_log(
+            member.guild,
             embed=discord.Embed(title="👋 Покинул", description=f"{member.mention}", color=discord.Color.red())
         )
 
     @commands.hybrid_command(name="logs-setup", description="Указать канал для логов")
     @commands.has_guild_permissions(manage_guild=True)
     async def logs_setup(self, ctx: commands.Context, channel: discord.TextChannel):
-        self.log_channel_id = channel.id
+        self.log_channel_ids[ctx.guild.id] = channel.id
         await ctx.reply("✅ Канал логов сохранён на время работы бота")
 
     @commands.hybrid_command(name="welcome-setup", description="Указать канал для приветствий и (опц.) картинку")
     @commands.has_guild_permissions(manage_guild=True)
     async def welcome_setup(self, ctx: commands.Context, channel: discord.TextChannel, image_url: str | None = None):
-        self.welcome_channel_id = channel.id
-        if image_url:
-            self.welcome_image_url = image_url
-        # persist в БД
+        # persist в БД (кэш settings обновится сразу)
         try:
-            db = self.bot.db  # type: ignore[attr-defined]
-            await db.exec("INSERT OR REPLACE INTO settings(key, value) VALUES('welcome_channel_id', ?)", str(channel.id))
+            store = self.bot.settings_store  # type: ignore[attr-defined]
+            await store.set(ctx.guild.id, "welcome_channel_id", channel.id)
             if image_url:
-                await db.exec("INSERT OR REPLACE INTO settings(key, value) VALUES('welcome_image_url', ?)", image_url)
+                await store.set(ctx.guild.id, "welcome_image_url", image_url)
         except Exception:
             log.exception("Failed to persist welcome settings")
         await ctx.reply(f"✅ Приветствия: {channel.mention}{' (картинка сохранена)' if image_url else ''}")
@@ -126,24 +121,24 @@ class Logs(commands.Cog):
             
             if rules:
                 await db.exec(
-                    "INSERT OR REPLACE INTO welcome_channels (channel_type, channel_id, channel_name, description) VALUES (?, ?, ?, ?)",
-                    "rules", rules.id, rules.name, rules_desc or ""
+                    "INSERT OR REPLACE INTO welcome_channels (guild_id, channel_type, channel_id, channel_name, description) VALUES (?, ?, ?, ?, ?)",
+                    ctx.guild.id, "rules", rules.id, rules.name, rules_desc or ""
                 )
                 desc_text = f" ({rules_desc})" if rules_desc else ""
                 channels_set.append(f"📖 Rules: {rules.mention}{desc_text}")
                 
             if roles:
                 await db.exec(
-                    "INSERT OR REPLACE INTO welcome_channels (channel_type, channel_id, channel_name, description) VALUES (?, ?, ?, ?)",
-                    "roles", roles.id, roles.name, roles_desc or ""
+                    "INSERT OR REPLACE INTO welcome_channels (guild_id, channel_type, channel_id, channel_name, description) VALUES (?, ?, ?, ?, ?)",
+                    ctx.guild.id, "roles", roles.id, roles.name, roles_desc or ""
                 )
                 desc_text = f" ({roles_desc})" if roles_desc else ""
                 channels_set.append(f"🎭 Roles: {roles.mention}{desc_text}")
                 
             if general:
                 await db.exec(
-                    "INSERT OR REPLACE INTO welcome_channels (channel_type, channel_id, channel_name, description) VALUES (?, ?, ?, ?)",
-                    "general", general.id, general.name, general_desc or ""
+                    "INSERT OR REPLACE INTO welcome_channels (guild_id, channel_type, channel_id, channel_name, description) VALUES (?, ?, ?, ?, ?)",
+                    ctx.guild.id, "general", general.id, general.name, general_desc or ""
                 )
                 desc_text = f" ({general_desc})" if general_desc else ""
                 channels_set.append(f"💬 General: {general.mention}{desc_text}")
@@ -186,8 +181,9 @@ class Logs(commands.Cog):
                 embed.description += f"{instruction}\n"
             
             # Устанавливаем изображение если есть
-            if hasattr(self, "welcome_image_url") and self.welcome_image_url:
-                embed.set_image(url=self.welcome_image_url)
+            welcome_image_url = self.bot.settings_store.get_url(ctx.guild.id, "welcome_image_url")  # type: ignore[attr-defined]
+            if welcome_image_url:
+                embed.set_image(url=welcome_image_url)
             
             # Добавляем информацию о сервере
             embed.add_field(
@@ -212,7 +208,8 @@ class Logs(commands.Cog):
         try:
             db = self.bot.db
             channels = await db.fetchall(
-                "SELECT channel_type, channel_id, channel_name, description FROM welcome_channels ORDER BY channel_type"
+                "SELECT channel_type, channel_id, channel_name, description FROM welcome_channels WHERE guild_id = ? ORDER BY channel_type",
+                ctx.guild.id
             )
             
             if not channels:
@@ -240,29 +237,13 @@ class Logs(commands.Cog):
             log.exception("Error listing welcome channels: %s", e)
             await ctx.reply("❌ Произошла ошибка при получении списка каналов.")
 
-    async def _load_welcome_settings(self):
-        """Загружает настройки приветствия из БД"""
-        try:
-            db = self.bot.db
-            # Загружаем ID канала приветствий
-            result = await db.fetchone("SELECT value FROM settings WHERE key='welcome_channel_id'")
-            if result and result[0].isdigit():
-                self.welcome_channel_id = int(result[0])
-            
-            # Загружаем URL изображения
-            result = await db.fetchone("SELECT value FROM settings WHERE key='welcome_image_url'")
-            if result:
-                self.welcome_image_url = result[0]
-        except Exception as e:
-            log.exception("Failed to load welcome settings: %s", e)
-
     async def _get_channel_link(self, channel_type: str, guild_id: int) -> str:
         """Получает ссылку на канал по типу"""
         try:
             db = self.bot.db
             result = await db.fetchone(
-                "SELECT channel_id, channel_name, description FROM welcome_channels WHERE channel_type = ?", 
-                channel_type
+                "SELECT channel_id, channel_name, description FROM welcome_channels WHERE guild_id = ? AND channel_type = ?", 
+                guild_id, channel_type
             )
             if result:
                 channel_id, channel_name, description = result
@@ -274,10 +255,11 @@ class Logs(commands.Cog):
         except Exception:
             return channel_type.replace('_', ' ').title()
 
-    async def _send_log(self, *, embed: discord.Embed):
-        if not self.log_channel_id:
+    async def _send_log(self, guild: discord.Guild, *, embed: discord.Embed):
+        log_channel_id = self.log_channel_ids.get(guild.id)
+        if not log_channel_id:
             return
-        channel = self.bot.get_channel(self.log_channel_id)
+        channel = guild.get_channel(log_channel_id)
         if isinstance(channel, discord.TextChannel):
             try:
                 await channel.send(embed=embed)
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import typing as t
+
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+
+from src.utils.backup import create_snapshot, list_snapshots
+from src.utils.retention import RetentionReport, default_policies, run_retention
+
+log = logging.getLogger(__name__)
+
+_SORT_KEYS = {"total": "total_ms", "avg": "avg_ms", "max": "max_ms", "calls": "calls", "rows": "rows"}
+
+
+class Maintenance(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._backup_lock = asyncio.Lock()
+        self._retention_lock = asyncio.Lock()
+
+    async def cog_load(self) -> None:
+        settings = self.bot.settings  # type: ignore[attr-defined]
+        if settings.db_backup_dir and settings.db_backup_interval > 0:
+            self.backup_loop.change_interval(minutes=settings.db_backup_interval)
+            self.backup_loop.start()
+        if settings.retention_interval > 0:
+            self.retention_loop.change_interval(hours=settings.retention_interval)
+            self.retention_loop.start()
+
+    async def cog_unload(self) -> None:
+        self.backup_loop.cancel()
+        self.retention_loop.cancel()
+
+    async def _snapshot(self):
+        settings = self.bot.settings  # type: ignore[attr-defined]
+        async with self._backup_lock:
+            return await create_snapshot(
+                self.bot.db,  # type: ignore[attr-defined]
+                settings.db_backup_dir,
+                pages=settings.db_backup_pages,
+                keep=settings.db_backup_keep,
+            )
+
+    @tasks.loop(minutes=60)
+    async def backup_loop(self):
+        try:
+            await self._snapshot()
+        except Exception:
+            log.exception("Scheduled database backup failed")
+
+    @backup_loop.before_loop
+    async def _before_backup_loop(self):
+        # Первый снимок — после старта, а не во время миграций и синхронизации
+        await self.bot.wait_until_ready()
+
+    @app_commands.command(name="db-stats", description="Самые тяжёлые SQL-запросы бота")
+    @app_commands.describe(
+        top="Сколько запросов показать",
+        sort="Сортировка: суммарное время, среднее, максимум, вызовы или строки",
+        reset="Сбросить статистику после вывода",
+    )
+    @app_commands.default_permissions(administrator=True)
+    async def db_stats(
+        self,
+        interaction: discord.Interaction,
+        top: app_commands.Range[int, 1, 25] = 10,
+        sort: t.Literal["total", "avg", "max", "calls", "rows"] = "total",
+        reset: bool = False,
+    ):
+        db = self.bot.db  # type: ignore[attr-defined]
+        metrics = db.metrics
+        stats = metrics.top(top, by=_SORT_KEYS[sort])
+        if not stats:
+            return await interaction.response.send_message("📊 Запросов пока не было.", ephemeral=True)
+
+        lines = []
+        for i, s in enumerate(stats, 1):
+            sql = s.sql if len(s.sql) <= 90 else s.sql[:87] + "..."
+            lines.append(
+                f"{i:>2}. {s.calls:>7} calls | {s.total_ms:>9.1f} ms total | avg {s.avg_ms:.2f} | "
+                f"p95 ≤{s.percentile(0.95):g} | max {s.max_ms:.1f} | rows {s.rows}\n    {sql}"
+            )
+        body = "\n".join(lines)
+        if len(body) > 3900:
+            body = body[:3900] + "\n..."
+
+        embed = discord.Embed(
+            title=f"🗄️ Топ-{len(stats)} SQL по {sort}",
+            description=f"```\n{body}\n```",
+            color=discord.Color.blurple(),
+        )
+        embed.set_footer(text=f"Всего вызовов: {metrics.total_calls} | порог slow-query: {metrics.slow_query_ms:g} мс")
+        if db.write_behind:
+            ws = db.write_stats
+            embed.add_field(
+                name="Очередь записей",
+                value=(
+                    f"глубина {ws.queue_depth} (макс {ws.max_queue_depth})\n"
+                    f"пачек {ws.batches}, средняя {ws.avg_batch_size:.1f}, макс {ws.max_batch_size}\n"
+                    f"ошибок {ws.failed}"
+                ),
+                inline=False,
+            )
+        embed.timestamp = discord.utils.utcnow()
+        if reset:
+            metrics.reset()
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="pipeline-stats", description="Время стадий обработки сообщений")
+    @app_commands.describe(reset="Сбросить статистику после вывода")
+    @app_commands.default_permissions(administrator=True)
+    async def pipeline_stats(self, interaction: discord.Interaction, reset: bool = False):
+        pipeline = self.bot.message_pipeline  # type: ignore[attr-defined]
+        stats = pipeline.stats()
+        if not stats:
+            return await interaction.response.send_message("📊 Стадий не зарегистрировано.", ephemeral=True)
+
+        lines = [
+            f"{s.order:>4} {s.name:<10} {s.calls:>8} calls | avg {s.avg_ms:.3f} ms | "
+            f"p95 ≤{s.percentile(0.95):g} | max {s.max_ms:.1f} | stops {s.stops} | errors {s.errors}"
+            for s in stats
+        ]
+        embed = discord.Embed(
+            title="📨 Конвейер сообщений",
+            description="```\n" + "\n".join(lines) + "\n```",
+            color=discord.Color.blurple(),
+        )
+        embed.set_footer(text=f"Сообщений: {pipeline.messages} | остановлено: {pipeline.stopped}")
+        embed.timestamp = discord.utils.utcnow()
+        if reset:
+            pipeline.reset()
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+    def _member_ids(self, guild_id: int) -> set[int] | None:
+        # Без полного списка участников нельзя отличить ушедшего от незагруженного
+        guild = self.bot.get_guild(guild_id)
+        if guild is None or not guild.chunked:
+            return None
+        return {member.id for member in guild.members}
+
+    async def _retention(self, *, dry_run: bool, convert_vacuum: bool = False) -> RetentionReport:
+        settings = self.bot.settings  # type: ignore[attr-defined]
+        policies = default_policies(
+            modlog_days=settings.retention_modlog_days,
+            departed_days=settings.retention_departed_days,
+        )
+        async with self._retention_lock:
+            return await run_retention(
+                self.bot.db,  # type: ignore[attr-defined]
+                policies,
+                members=self._member_ids,
+                dry_run=dry_run,
+                batch_size=settings.retention_batch_size,
+                archive_dir=settings.retention_archive_dir,
+                convert_vacuum=convert_vacuum,
+            )
+
+    @tasks.loop(hours=24)
+    async def retention_loop(self):
+        try:
+            report = await self._retention(dry_run=False)
+        except Exception:
+            log.exception("Scheduled retention run failed")
+            return
+        if report.vacuum_conversion_needed:
+            log.warning(
+                "Retention deleted %d rows, but the database is not in incremental auto_vacuum mode "
+                "and the file will not shrink; run /db-retention with convert_vacuum once "
+                "(full VACUUM, writes wait for it)",
+                report.rows,
+            )
+
+    @retention_loop.before_loop
+    async def _before_retention_loop(self):
+        await self.bot.wait_until_ready()
+
+    @app_commands.command(name="db-backup", description="Сделать снимок базы данных прямо сейчас")
+    @app_commands.default_permissions(administrator=True)
+    async def db_backup(self, interaction: discord.Interaction):
+        backup_dir = self.bot.settings.db_backup_dir  # type: ignore[attr-defined]
+        if not backup_dir:
+            return await interaction.response.send_message(
+                "❌ Каталог для снимков не задан (переменная `DB_BACKUP_DIR`).", ephemeral=True
+            )
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            result = await self._snapshot()
+        except Exception as e:
+            log.exception("Manual database backup failed")
+            return await interaction.followup.send(f"❌ Не удалось сделать снимок: {e}", ephemeral=True)
+
+        embed = discord.Embed(title="💾 Снимок БД создан", color=discord.Color.green())
+        embed.add_field(name="Файл", value=f"`{os.path.basename(result.path)}`", inline=False)
+        embed.add_field(name="Размер", value=f"{result.size_bytes / 1024:.1f} KiB", inline=True)
+        embed.add_field(name="Страниц / шагов", value=f"{result.pages} / {result.steps} (перезапусков {result.restarts})", inline=True)
+        embed.add_field(name="Время", value=f"{result.seconds:.2f} с", inline=True)
+        snapshots = list_snapshots(backup_dir)
+        embed.add_field(
+            name=f"Хранится снимков: {len(snapshots)}",
+            value="\n".join(f"`{os.path.basename(p)}`" for p in snapshots[:10]) or "—",
+            inline=False,
+        )
+        embed.timestamp = discord.utils.utcnow()
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+    @app_commands.command(name="db-retention", description="Очистка устаревших строк по политикам хранения")
+    @app_commands.describe(
+        dry_run="Только посчитать, сколько строк и байт освободится",
+        convert_vacuum="Разово перевести старую базу в incremental vacuum (полный VACUUM, запись ждёт)",
+    )
+    @app_commands.default_permissions(administrator=True)
+    async def db_retention(self, interaction: discord.Interaction, dry_run: bool = True, convert_vacuum: bool = False):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            report = await self._retention(dry_run=dry_run, convert_vacuum=convert_vacuum)
+        except Exception as e:
+            log.exception("Manual retention run failed")
+            return await interaction.followup.send(f"❌ Ошибка очистки: {e}", ephemeral=True)
+        if not report.policies and not report.vacuumed_bytes:
+            return await interaction.followup.send(
+                "ℹ️ Политики хранения не настроены (`RETENTION_MODLOG_DAYS`, `RETENTION_DEPARTED_DAYS`).",
+                ephemeral=True,
+            )
+
+        lines = []
+        for p in report.policies:
+            size = "?" if p.bytes is None else f"{p.bytes / 1024:.1f} KiB"
+            line = f"{p.name:<16} {p.rows:>8} rows"
+            line += f" ~{size}" if dry_run else f" {p.batches} batches, archived {p.archived}"
+            if p.skipped_guilds:
+                line += f" (skipped guilds: {p.skipped_guilds})"
+            lines.append(line)
+        embed = discord.Embed(
+            title="🧹 Retention: пробный прогон" if dry_run else "🧹 Retention выполнен",
+            description="```\n" + "\n".join(lines) + "\n```",
+            color=discord.Color.blurple() if dry_run else discord.Color.green(),
+        )
+        if not dry_run:
+            embed.add_field(name="Освобождено файлом", value=f"{report.vacuumed_bytes / 1024:.1f} KiB")
+        if report.vacuum_conversion_needed:
+            embed.add_field(
+                name="⚠️ Место не возвращено",
+                value="База старая, не в режиме incremental vacuum: один раз запустите с `convert_vacuum`",
+                inline=False,
+            )
+        embed.timestamp = discord.utils.utcnow()
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Maintenance(bot))
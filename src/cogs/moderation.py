@@ -18,7 +18,7 @@ class Moderation(commands.Cog):
     async def kick(self, interaction: discord.Interaction, user: discord.Member, reason: str | None = None):
         await user.kick(reason=reason)
         await interaction.response.send_message(f"✅ {user.mention} кикнут. Причина: {reason or 'не указана'}", ephemeral=True)
-        await self._log_action("kick", user.id, interaction.user.id, reason)
+        await self._log_action(interaction.guild_id, "kick", user.id, interaction.user.id, reason)
 
     @app_commands.command(name="ban", description="Забанить участника")
     @app_commands.describe(user="Кого забанить", reason="Причина", delete_message_days="Удалить сообщения за N дней")
@@ -34,7 +34,7 @@ class Moderation(commands.Cog):
         await interaction.response.send_message(
             f"🔨 {user.mention} забанен. Причина: {reason or 'не указана'}", ephemeral=True
         )
-        await self._log_action("ban", user.id, interaction.user.id, reason)
+        await self._log_action(interaction.guild_id, "ban", user.id, interaction.user.id, reason)
 
     @app_commands.command(name="mute", description="Временный мут участника")
     @app_commands.describe(user="Кого замьютить", minutes="На сколько минут", reason="Причина")
@@ -52,38 +52,39 @@ class Moderation(commands.Cog):
             f"🤐 {user.mention} замьючен на {minutes} минут. Причина: {reason or 'не указана'}",
             ephemeral=True,
         )
-        await self._log_action("mute", user.id, interaction.user.id, reason)
+        await self._log_action(interaction.guild_id, "mute", user.id, interaction.user.id, reason)
 
     @app_commands.command(name="warn", description="Выдать предупреждение участнику")
     @app_commands.describe(user="Кому выдать", reason="Причина")
     @app_commands.default_permissions(moderate_members=True)
     async def warn(self, interaction: discord.Interaction, user: discord.Member, reason: str | None = None):
         db = self.bot.db  # type: ignore[attr-defined]
-        row = await db.fetchone("SELECT count FROM warns WHERE user_id=?", user.id)
+        row = await db.fetchone("SELECT count FROM warns WHERE guild_id=? AND user_id=?", user.guild.id, user.id)
         current = row[0] if row else 0
         new_count = current + 1
         if row:
-            await db.exec("UPDATE warns SET count=? WHERE user_id=?", new_count, user.id)
+            await db.exec("UPDATE warns SET count=? WHERE guild_id=? AND user_id=?", new_count, user.guild.id, user.id)
         else:
-            await db.exec("INSERT INTO warns(user_id, count) VALUES(?, ?)", user.id, new_count)
+            await db.exec("INSERT INTO warns(guild_id, user_id, count) VALUES(?, ?, ?)", user.guild.id, user.id, new_count)
         await interaction.response.send_message(
             f"⚠️ {user.mention} получил предупреждение ({new_count}). Причина: {reason or 'не указана'}",
             ephemeral=True,
         )
-        await self._log_action("warn", user.id, interaction.user.id, reason)
+        await self._log_action(interaction.guild_id, "warn", user.id, interaction.user.id, reason)
 
     @app_commands.command(name="warns", description="Показать количество предупреждений")
     async def warns(self, interaction: discord.Interaction, user: discord.Member):
         db = self.bot.db  # type: ignore[attr-defined]
-        row = await db.fetchone("SELECT count FROM warns WHERE user_id=?", user.id)
+        row = await db.fetchone("SELECT count FROM warns WHERE guild_id=? AND user_id=?", user.guild.id, user.id)
         count = row[0] if row else 0
         await interaction.response.send_message(f"{user.mention} имеет предупреждений: {count}", ephemeral=True)
 
-    async def _log_action(self, action: str, target_id: int, moderator_id: int, reason: str | None):
+    async def _log_action(self, guild_id: int, action: str, target_id: int, moderator_id: int, reason: str | None):
         try:
             db = self.bot.db  # type: ignore[attr-defined]
             await db.exec(
-                "INSERT INTO moderation_logs(action, target_id, moderator_id, reason) VALUES(?, ?, ?, ?)",
+                "INSERT INTO moderation_logs(guild_id, action, target_id, moderator_id, reason) VALUES(?, ?, ?, ?, ?)",
+                guild_id,
                 action,
                 target_id,
                 moderator_id,
@@ -8,18 +8,6 @@ from discord.ext import commands
 class Roles(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.autorole_id: int | None = None
-
-    async def cog_load(self) -> None:
-        """Load persisted settings when the cog is loaded."""
-        try:
-            db = self.bot.db  # type: ignore[attr-defined]
-            row = await db.fetchone("SELECT value FROM settings WHERE key='autorole_role_id'")
-            if row and str(row[0]).isdigit():
-                self.autorole_id = int(row[0])
-        except Exception:
-            # ignore load errors
-            pass
 
     @app_commands.command(name="role-add", description="Выдать роль пользователю")
     @app_commands.default_permissions(manage_roles=True)
@@ -71,31 +59,33 @@ class Roles(commands.Cog):
     @app_commands.command(name="autorole-set", description="Установить роль для авто-выдачи при входе")
     @app_commands.default_permissions(manage_roles=True)
     async def autorole_set(self, interaction: discord.Interaction, role: discord.Role):
-        self.autorole_id = role.id
         try:
-            db = self.bot.db  # type: ignore[attr-defined]
-            await db.exec("INSERT OR REPLACE INTO settings(key, value) VALUES('autorole_role_id', ?)", str(role.id))
+            await self.bot.settings_store.set(interaction.guild_id, "autorole_role_id", role.id)  # type: ignore[attr-defined]
         except Exception:
             pass
         await interaction.response.send_message(f"✅ Установлена авто-роль: {role.mention}", ephemeral=True)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        if self.autorole_id:
-            role = member.guild.get_role(self.autorole_id)
-            if role:
-                try:
-                    await member.add_roles(role, reason="Autorole")
-                except Exception:
-                    pass
+        role = self.bot.settings_store.get_role(member.guild, "autorole_role_id")  # type: ignore[attr-defined]
+        if role:
+            try:
+                await member.add_roles(role, reason="Autorole")
+            except Exception:
+                pass
 
     # Reaction roles (simplified via one message setup)
     # удалена команда /reaction-role по запросу, функционал оставлен через /reaction-bind
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if payload.guild_id is None:
+            return
         db = self.bot.db  # type: ignore[attr-defined]
-        row = await db.fetchone("SELECT role_id FROM reaction_roles WHERE message_id=? AND emoji=?", payload.message_id, str(payload.emoji))
+        row = await db.fetchone(
+            "SELECT role_id FROM reaction_roles WHERE guild_id=? AND message_id=? AND emoji=?",
+            payload.guild_id, payload.message_id, str(payload.emoji),
+        )
         if not row:
             return
         role_id = int(row[0])
@@ -112,8 +102,13 @@ class Roles(commands.Cog):
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        if payload.guild_id is None:
+            return
         db = self.bot.db  # type: ignore[attr-defined]
-        row = await db.fetchone("SELECT role_id FROM reaction_roles WHERE message_id=? AND emoji=?", payload.message_id, str(payload.emoji))
+        row = await db.fetchone(
+            "SELECT role_id FROM reaction_roles WHERE guild_id=? AND message_id=? AND emoji=?",
+            payload.guild_id, payload.message_id, str(payload.emoji),
+        )
         if not row:
             return
         role_id = int(row[0])
@@ -151,7 +146,10 @@ class Roles(commands.Cog):
             return await interaction.response.send_message("Не удалось добавить реакцию. Проверьте эмодзи.", ephemeral=True)
 
         db = self.bot.db  # type: ignore[attr-defined]
-        await db.exec("INSERT OR REPLACE INTO reaction_roles(message_id, emoji, role_id) VALUES(?, ?, ?)", msg.id, str(emoji), role.id)
+        await db.exec(
+            "INSERT OR REPLACE INTO reaction_roles(guild_id, message_id, emoji, role_id) VALUES(?, ?, ?, ?)",
+            msg.guild.id, msg.id, str(emoji), role.id,
+        )
         await interaction.response.send_message("✅ Привязка создана: реакция выдаёт роль.", ephemeral=True)
 
 
@@ -5,6 +5,8 @@ import re
 import discord
 from discord.ext import commands
 
+from src.utils.pipeline import ORDER_SECURITY, MessageContext
+
 
 class Security(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -13,28 +15,34 @@ class Security(commands.Cog):
         self.max_msgs_per_10s = 8
         self.user_windows: dict[int, list[float]] = {}
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if not message.guild or message.author.bot:
-            return
+    async def cog_load(self) -> None:
+        self.bot.message_pipeline.register("security", self.security_stage, order=ORDER_SECURITY)  # type: ignore[attr-defined]
+
+    async def cog_unload(self) -> None:
+        self.bot.message_pipeline.unregister("security")  # type: ignore[attr-defined]
+
+    async def security_stage(self, ctx: MessageContext):
+        """Стадия конвейера сообщений: удалённое сообщение дальше не идёт"""
         # Simple anti-link: delete obvious invite links
-        if "discord.gg/" in message.content.lower():
-            try:
-                await message.delete()
-            except Exception:
-                pass
+        if "discord.gg/" in ctx.content:
+            await self._delete(ctx.message)
+            ctx.stop("invite")
             return
         # Rate-limit per user (anti-spam)
-        now = message.created_at.timestamp() if message.created_at else discord.utils.utcnow().timestamp()
-        win = self.user_windows.setdefault(message.author.id, [])
+        now = ctx.timestamp
+        win = self.user_windows.setdefault(ctx.author_id, [])
         win.append(now)
         # keep only last 10 seconds
-        self.user_windows[message.author.id] = [t for t in win if now - t <= 10]
-        if len(self.user_windows[message.author.id]) > self.max_msgs_per_10s:
-            try:
-                await message.delete()
-            except Exception:
-                pass
+        self.user_windows[ctx.author_id] = [t for t in win if now - t <= 10]
+        if len(self.user_windows[ctx.author_id]) > self.max_msgs_per_10s:
+            await self._delete(ctx.message)
+            ctx.stop("spam")
+
+    async def _delete(self, message: discord.Message) -> None:
+        try:
+            await message.delete()
+        except Exception:
+            pass
 
     # удалена команда /verify по запросу (фильтры и анти-спам оставлены)
 
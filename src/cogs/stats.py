@@ -1,36 +1,247 @@
 from __future__ import annotations
 
-import collections
+import io
+import logging
+import time
+import typing as t
 
 import discord
-from discord.ext import commands
+from discord import app_commands
+from discord.ext import commands, tasks
+
+from src.utils.activity import DAY, HOUR, ActivityStore
+from src.utils.charts import ChartRenderer, ChartSpec, Series
+from src.utils.heavy_hitters import HeavyHitter, SlidingTopK
+from src.utils.pipeline import ORDER_STATS, MessageContext
+from src.utils.voice_sessions import VoiceSessionTracker
+
+log = logging.getLogger(__name__)
+
+# Окно графика -> (число корзин, ширина корзины)
+_WINDOWS = {"24h": (24, HOUR), "7d": (7 * 24, HOUR), "30d": (30, DAY), "90d": (90, DAY)}
+_METRIC_TITLES = {"messages": "Сообщения", "members": "Пришли / ушли", "voice": "Минуты в голосе"}
 
 
 class Stats(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.message_counts: dict[int, int] = collections.defaultdict(int)
+        settings = getattr(bot, "settings", None)
+        # Счётчики копятся в памяти и пишутся пачкой раз в flush_interval секунд
+        self.flush_interval: float = getattr(settings, "stats_flush_interval", 30.0)
+        self.activity = ActivityStore(
+            bot.db,  # type: ignore[attr-defined]
+            hourly_days=getattr(settings, "stats_hourly_days", 14),
+        )
+        self.charts = ChartRenderer(workers=getattr(settings, "stats_chart_workers", 1))
+        self.voice = VoiceSessionTracker(bot.db)  # type: ignore[attr-defined]
+        # Живой топ за последний час в фиксированной памяти (0 — выключен)
+        self.live_capacity: int = getattr(settings, "stats_topk_capacity", 0)
+        self._live: dict[int, dict[str, SlidingTopK]] = {}
+        # Сколько дней хранить журнал голосовых сессий (итоги не чистятся)
+        self.voice_session_days: int = getattr(settings, "stats_voice_session_days", 90)
+
+    async def cog_load(self) -> None:
+        await self.activity.load()
+        await self.voice.load()
+        if self.bot.is_ready():
+            # Перезагрузка расширения: on_ready уже был
+            self._reconcile_voice()
+        self.flush_loop.change_interval(seconds=max(1.0, self.flush_interval))
+        self.flush_loop.start()
+        self.rollup_loop.start()
+        self.bot.message_pipeline.register("stats", self.stats_stage, order=ORDER_STATS)  # type: ignore[attr-defined]
+
+    async def cog_unload(self) -> None:
+        self.bot.message_pipeline.unregister("stats")  # type: ignore[attr-defined]
+        self.flush_loop.cancel()
+        self.rollup_loop.cancel()
+        await self.flush_pending()
+        self.charts.close()
+
+    async def flush_pending(self) -> int:
+        written = 0
+        try:
+            written += await self.activity.flush()
+        except Exception:
+            log.exception("Failed to flush activity, keeping it buffered")
+        try:
+            written += await self.voice.flush()
+        except Exception:
+            log.exception("Failed to flush voice sessions, keeping them buffered")
+        return written
+
+    @tasks.loop(seconds=30)
+    async def flush_loop(self):
+        await self.flush_pending()
+
+    @tasks.loop(hours=1)
+    async def rollup_loop(self):
+        try:
+            # Сначала сброс: свёртка не должна пропустить часы, ещё лежащие в памяти
+            await self.flush_pending()
+            await self.activity.rollup()
+            if self.voice_session_days > 0:
+                await self.voice.prune(time.time() - self.voice_session_days * DAY)
+        except Exception:
+            log.exception("Activity rollup failed")
+
+    async def stats_stage(self, ctx: MessageContext):
+        self.activity.record_message(ctx.guild_id, ctx.channel_id, ctx.author_id, ctx.timestamp)
+        if self.live_capacity > 0:
+            live = self._live.get(ctx.guild_id)
+            if live is None:
+                live = self._live[ctx.guild_id] = {
+                    "user_id": SlidingTopK(self.live_capacity),
+                    "channel_id": SlidingTopK(self.live_capacity),
+                }
+            live["user_id"].add(ctx.author_id, now=ctx.timestamp)
+            live["channel_id"].add(ctx.channel_id, now=ctx.timestamp)
+
+    def live_top(self, guild_id: int, *, by: str = "user_id", limit: int = 10) -> list[HeavyHitter]:
+        """Самые активные участники/каналы за последний час по скетчу, с границами ошибки.
+
+        Без БД и без ожидания flush; пусто, если STATS_TOPK_CAPACITY = 0.
+        """
+        live = self._live.get(guild_id)
+        if live is None:
+            return []
+        return live[by].top(limit)
+
+    @app_commands.command(name="stats-live", description="Самые активные за последний час (оценка в реальном времени)")
+    @app_commands.describe(by="Участники или каналы", limit="Сколько позиций показать")
+    @app_commands.default_permissions(administrator=True)
+    async def stats_live(
+        self,
+        interaction: discord.Interaction,
+        by: t.Literal["members", "channels"] = "members",
+        limit: app_commands.Range[int, 1, 25] = 10,
+    ):
+        if interaction.guild is None:
+            return await interaction.response.send_message("Команда работает только на сервере.", ephemeral=True)
+        if self.live_capacity <= 0:
+            return await interaction.response.send_message(
+                "ℹ️ Живой топ выключен (переменная `STATS_TOPK_CAPACITY`).", ephemeral=True
+            )
+        hitters = self.live_top(interaction.guild.id, by="user_id" if by == "members" else "channel_id", limit=limit)
+        if not hitters:
+            return await interaction.response.send_message("📊 За последний час сообщений не было.", ephemeral=True)
+
+        mention = "<@{}>" if by == "members" else "<#{}>"
+        lines = []
+        for i, h in enumerate(hitters, 1):
+            # Точное значение — в [count - error, count]
+            value = f"**{h.count}**" if not h.error else f"**{h.guaranteed}–{h.count}**"
+            lines.append(f"{i}. {mention.format(h.key)} — {value}")
+        embed = discord.Embed(
+            title="⚡ Активность за последний час",
+            description="\n".join(lines),
+            color=discord.Color.blurple(),
+        )
+        embed.set_footer(text=f"Оценка Space-Saving (счётчиков на 10 минут: {self.live_capacity}); диапазон — граница ошибки")
+        embed.timestamp = discord.utils.utcnow()
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.guild and not message.author.bot:
-            self.message_counts[message.author.id] += 1
-            # persist periodically
-            if self.message_counts[message.author.id] % 20 == 0:
-                db = self.bot.db  # type: ignore[attr-defined]
-                user_id = message.author.id
-                row = await db.fetchone("SELECT count FROM message_stats WHERE user_id=?", user_id)
-                base = row[0] if row else 0
-                await db.exec(
-                    "INSERT OR REPLACE INTO message_stats(user_id, count) VALUES(?, ?)",
-                    user_id,
-                    base + self.message_counts[user_id],
-                )
-
-    # удалена команда /top по запросу (сбор статистики оставлен)
+    async def on_member_join(self, member: discord.Member):
+        if not member.bot:
+            self.activity.record_member(member.guild.id, True)
 
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        if not member.bot:
+            self.activity.record_member(member.guild.id, False)
 
-async def setup(bot: commands.Bot):
-    await bot.add_cog(Stats(bot))
+    @staticmethod
+    def _counted_channel(member: discord.Member, state: discord.VoiceState) -> int | None:
+        # AFK-канал в голосовую активность не идёт
+        channel = state.channel
+        if channel is None or channel == member.guild.afk_channel:
+            return None
+        return channel.id
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        if member.bot:
+            return
+        # Мьют/демонстрация экрана канал не меняют — moved() такое пропустит
+        self.voice.moved(member.guild.id, member.id, self._counted_channel(member, after))
+
+    def _reconcile_voice(self) -> None:
+        present = {}
+        for guild in self.bot.guilds:
+            present[guild.id] = {
+                member.id: channel.id
+                for channel in guild.voice_channels + guild.stage_channels
+                if channel != guild.afk_channel
+                for member in channel.members
+                if not member.bot
+            }
+        self.voice.reconcile(present)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # И после запуска, и после переподключения: события за время разрыва потеряны
+        self._reconcile_voice()
 
+    async def _chart(self, guild_id: int, metric: str, window: str) -> bytes:
+        count, step = _WINDOWS[window]
+        if step == HOUR and count > self.activity.hourly_days * 24:
+            # Почасовых корзин за такое окно уже нет — рисуем по суткам
+            count, step = count // 24, DAY
+        end = int(time.time() // step)  # текущая корзина не закрыта и в график не входит
+        key = (guild_id, metric, window)
+        png = self.charts.cached(key)
+        if png is not None:
+            return png
 
+        # Закрытые корзины могли ещё лежать в памяти
+        await self.flush_pending()
+        data = await self.activity.series(guild_id, metric, end - count, end, step)
+        unit = "по часам" if step == HOUR else "по суткам"
+        if metric == "messages":
+            series = (Series("Сообщения", tuple(data["messages"]), "#5865f2"),)
+        elif metric == "members":
+            series = (
+                Series("Пришли", tuple(data["joins"]), "#57f287"),
+                Series("Ушли", tuple(data["leaves"]), "#ed4245", negative=True),
+            )
+        else:
+            series = (Series("Минуты", tuple(round(v / 60, 1) for v in data["voice_seconds"]), "#fee75c"),)
+        spec = ChartSpec(
+            title=f"{_METRIC_TITLES[metric]} {unit}, {window} (UTC)",
+            start=(end - count) * step,
+            step=step,
+            series=series,
+        )
+        return await self.charts.render(key, spec, expires_at=(end + 1) * step)
+
+    @app_commands.command(name="stats-chart", description="График активности сервера")
+    @app_commands.describe(
+        metric="Сообщения, приход/уход участников или минуты в голосе",
+        window="За какой период",
+    )
+    @app_commands.default_permissions(administrator=True)
+    async def stats_chart(
+        self,
+        interaction: discord.Interaction,
+        metric: t.Literal["messages", "members", "voice"] = "messages",
+        window: t.Literal["24h", "7d", "30d", "90d"] = "7d",
+    ):
+        if interaction.guild is None:
+            return await interaction.response.send_message("Команда работает только на сервере.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True)
+        try:
+            png = await self._chart(interaction.guild.id, metric, window)
+        except Exception:
+            log.exception("Failed to render %s chart", metric)
+            return await interaction.followup.send("❌ Не удалось построить график.", ephemeral=True)
+        await interaction.followup.send(
+            file=discord.File(io.BytesIO(png), filename=f"{metric}-{window}.png"), ephemeral=True
+        )
+
+    # удалена команда /top по запросу (сбор статистики оставлен);
+    # выборки за окно — ActivityStore.top
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Stats(bot))
@@ -21,18 +21,25 @@ class TicketButton(discord.ui.View):
 
         # Проверяем, есть ли уже открытый тикет у пользователя
         db = self.bot.db  # type: ignore[attr-defined]
-        existing = await db.fetchone("SELECT channel_id FROM tickets WHERE owner_id=?", interaction.user.id)
+        existing = await db.fetchone(
+            "SELECT channel_id FROM tickets WHERE guild_id=? AND owner_id=?", guild.id, interaction.user.id
+        )
         if existing:
             channel = guild.get_channel(existing[0])
             if channel:
                 return await interaction.response.send_message(f"У вас уже есть открытый тикет: {channel.mention}", ephemeral=True)
 
+        # Актуальные настройки берём из кэша settings: /ticket setup применяется сразу
+        store = self.bot.settings_store  # type: ignore[attr-defined]
+        category_id = store.get_int(guild.id, "tickets_category_id", self.category_id)
+        support_role_id = store.get_int(guild.id, "tickets_support_role_id", self.support_role_id)
+
         # Создаем приватный канал только в заранее заданной категории
-        if not self.category_id:
+        if not category_id:
             return await interaction.response.send_message(
                 "Категория для тикетов не настроена. Используйте /ticket setup.", ephemeral=True
             )
-        category = guild.get_channel(self.category_id)
+        category = guild.get_channel(category_id)
         if not isinstance(category, discord.CategoryChannel):
             return await interaction.response.send_message(
                 "Указанная категория не найдена. Проверьте /ticket setup.", ephemeral=True
@@ -42,8 +49,8 @@ class TicketButton(discord.ui.View):
             guild.default_role: discord.PermissionOverwrite(view_channel=False),
             interaction.user: discord.PermissionOverwrite(view_channel=True, send_messages=True),
         }
-        if self.support_role_id:
-            role = guild.get_role(self.support_role_id)
+        if support_role_id:
+            role = guild.get_role(support_role_id)
             if role:
                 overwrites[role] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
 
@@ -55,7 +62,10 @@ class TicketButton(discord.ui.View):
         )
 
         # Сохраняем в БД
-        await db.exec("INSERT OR REPLACE INTO tickets(channel_id, owner_id) VALUES(?, ?)", channel.id, interaction.user.id)
+        await db.exec(
+            "INSERT OR REPLACE INTO tickets(guild_id, channel_id, owner_id) VALUES(?, ?, ?)",
+            guild.id, channel.id, interaction.user.id,
+        )
 
         # Отправляем приветственное сообщение
         embed = discord.Embed(
@@ -90,10 +100,9 @@ class CloseTicketView(discord.ui.View):
         # подготовим лог и удалим канал через 5 сек
         db = interaction.client.db  # type: ignore[attr-defined]
         guild = interaction.guild
-        log_channel_id_row = await db.fetchone("SELECT value FROM settings WHERE key='tickets_closed_channel_id'")
         log_channel = None
-        if log_channel_id_row and guild:
-            log_channel = guild.get_channel(int(log_channel_id_row[0]))
+        if guild:
+            log_channel = interaction.client.settings_store.get_channel(guild, "tickets_closed_channel_id")  # type: ignore[attr-defined]
 
         embed = discord.Embed(
             title="🔒 Тикет закрыт",
@@ -116,7 +125,7 @@ class CloseTicketView(discord.ui.View):
         # немедленное закрытие
 
         # Удаляем из БД
-        await db.exec("DELETE FROM tickets WHERE channel_id=?", channel.id)
+        await db.exec("DELETE FROM tickets WHERE guild_id=? AND channel_id=?", channel.guild.id, channel.id)
 
         # Отправляем лог
         if isinstance(log_channel, discord.TextChannel):
@@ -135,31 +144,29 @@ class CloseTicketView(discord.ui.View):
 class Tickets(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.category_id: int | None = None  # optional: preset category
-        self.support_role_id: int | None = None
+
+    def _ticket_config(self, guild: discord.Guild) -> tuple[int | None, int | None]:
+        """Категория и роль поддержки сервера из кэша settings"""
+        store = self.bot.settings_store  # type: ignore[attr-defined]
+        return store.get_int(guild.id, "tickets_category_id"), store.get_int(guild.id, "tickets_support_role_id")
 
     ticket = app_commands.Group(name="ticket", description="Система тикетов")
 
     @ticket.command(name="setup", description="Настроить систему тикетов (категория, роль поддержки)")
     @app_commands.default_permissions(manage_channels=True)
     async def setup(self, interaction: discord.Interaction, category: t.Optional[discord.CategoryChannel] = None, support_role: t.Optional[discord.Role] = None):
+        # persist settings in DB for persistence views (кэш обновится сам)
+        store = self.bot.settings_store  # type: ignore[attr-defined]
         if category:
-            self.category_id = category.id
+            await store.set(interaction.guild_id, "tickets_category_id", category.id)
         if support_role:
-            self.support_role_id = support_role.id
-        # persist settings in DB for persistence views
-        db = self.bot.db  # type: ignore[attr-defined]
-        if self.category_id:
-            await db.exec("INSERT OR REPLACE INTO settings(key, value) VALUES('tickets_category_id', ?)", str(self.category_id))
-        if self.support_role_id:
-            await db.exec("INSERT OR REPLACE INTO settings(key, value) VALUES('tickets_support_role_id', ?)", str(self.support_role_id))
+            await store.set(interaction.guild_id, "tickets_support_role_id", support_role.id)
         await interaction.response.send_message("✅ Настройки тикетов сохранены.", ephemeral=True)
 
     @ticket.command(name="set-closed-channel", description="Указать канал для логов закрытых тикетов")
     @app_commands.default_permissions(manage_channels=True)
     async def set_closed_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        db = self.bot.db  # type: ignore[attr-defined]
-        await db.exec("INSERT OR REPLACE INTO settings(key, value) VALUES('tickets_closed_channel_id', ?)", str(channel.id))
+        await self.bot.settings_store.set(interaction.guild_id, "tickets_closed_channel_id", channel.id)  # type: ignore[attr-defined]
         await interaction.response.send_message(f"✅ Канал для закрытых тикетов: {channel.mention}", ephemeral=True)
 
     @ticket.command(name="close", description="Закрыть тикет")
@@ -168,10 +175,10 @@ class Tickets(commands.Cog):
         if not isinstance(channel, discord.TextChannel):
             return await interaction.response.send_message("Эта команда доступна только в текстовом канале.", ephemeral=True)
         db = self.bot.db  # type: ignore[attr-defined]
-        row = await db.fetchone("SELECT owner_id FROM tickets WHERE channel_id=?", channel.id)
+        row = await db.fetchone("SELECT owner_id FROM tickets WHERE guild_id=? AND channel_id=?", channel.guild.id, channel.id)
         if not row:
             return await interaction.response.send_message("Этот канал не является тикетом.", ephemeral=True)
-        await db.exec("DELETE FROM tickets WHERE channel_id=?", channel.id)
+        await db.exec("DELETE FROM tickets WHERE guild_id=? AND channel_id=?", channel.guild.id, channel.id)
         await interaction.response.send_message("🔒 Канал будет удалён через 5 секунд.", ephemeral=True)
         await discord.utils.sleep_until(discord.utils.utcnow() + discord.utils.timedelta(seconds=5))
         await channel.delete(reason=f"Ticket closed by {interaction.user}")
@@ -211,7 +218,7 @@ class Tickets(commands.Cog):
         embed.set_footer(text="Нажмите кнопку ниже, чтобы создать тикет")
         embed.timestamp = discord.utils.utcnow()
 
-        view = TicketButton(self.bot, self.category_id, self.support_role_id)
+        view = TicketButton(self.bot, *self._ticket_config(target_channel.guild))
         await target_channel.send(embed=embed, view=view)
         await interaction.response.send_message(f"✅ Панель тикетов создана в {target_channel.mention}", ephemeral=True)
 
@@ -219,11 +226,12 @@ class Tickets(commands.Cog):
     async def create_ticket(self, interaction: discord.Interaction, topic: str):
         guild = interaction.guild
         assert guild is not None
-        if not self.category_id:
+        category_id, support_role_id = self._ticket_config(guild)
+        if not category_id:
             return await interaction.response.send_message(
                 "Категория для тикетов не настроена. Используйте /ticket setup.", ephemeral=True
             )
-        category = guild.get_channel(self.category_id)
+        category = guild.get_channel(category_id)
         if not isinstance(category, discord.CategoryChannel):
             return await interaction.response.send_message(
                 "Указанная категория не найдена. Проверьте /ticket setup.", ephemeral=True
@@ -232,8 +240,8 @@ class Tickets(commands.Cog):
             guild.default_role: discord.PermissionOverwrite(view_channel=False),
             interaction.user: discord.PermissionOverwrite(view_channel=True, send_messages=True),
         }
-        if self.support_role_id:
-            role = guild.get_role(self.support_role_id)
+        if support_role_id:
+            role = guild.get_role(support_role_id)
             if role:
                 overwrites[role] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
 
@@ -245,7 +253,10 @@ class Tickets(commands.Cog):
         )
 
         db = self.bot.db  # type: ignore[attr-defined]
-        await db.exec("INSERT OR REPLACE INTO tickets(channel_id, owner_id) VALUES(?, ?)", channel.id, interaction.user.id)
+        await db.exec(
+            "INSERT OR REPLACE INTO tickets(guild_id, channel_id, owner_id) VALUES(?, ?, ?)",
+            guild.id, channel.id, interaction.user.id,
+        )
 
         embed = discord.Embed(title="Тикет создан", description=topic, color=discord.Color.green())
         embed.add_field(name="Автор", value=interaction.user.mention)
@@ -41,6 +41,7 @@ class VoiceControlModal(discord.ui.Modal, title="Управление голос
                 cog = interaction.client.get_cog("PrivateVoice")
                 if cog and hasattr(cog, 'save_user_voice_settings'):
                     await cog.save_user_voice_settings(
+                        interaction.guild_id,
                         interaction.user.id, 
                         self.name_input.value, 
                         self.voice_channel.user_limit or 0,
@@ -61,6 +62,7 @@ class VoiceControlModal(discord.ui.Modal, title="Управление голос
                     if cog and hasattr(cog, 'save_user_voice_settings'):
                         channel_name = self.voice_channel.name.replace("🔒 ", "")
                         await cog.save_user_voice_settings(
+                            interaction.guild_id,
                             interaction.user.id, 
                             channel_name, 
                             limit,
@@ -115,6 +117,7 @@ class VoiceControlView(discord.ui.View):
         if cog and hasattr(cog, 'save_user_voice_settings'):
             channel_name = self.voice_channel.name.replace("🔒 ", "")
             await cog.save_user_voice_settings(
+                interaction.guild_id,
                 interaction.user.id, 
                 channel_name, 
                 self.voice_channel.user_limit or 0,
@@ -140,6 +143,7 @@ class VoiceControlView(discord.ui.View):
         if cog and hasattr(cog, 'save_user_voice_settings'):
             channel_name = self.voice_channel.name.replace("🔒 ", "")
             await cog.save_user_voice_settings(
+                interaction.guild_id,
                 interaction.user.id, 
                 channel_name, 
                 self.voice_channel.user_limit or 0,
@@ -252,25 +256,19 @@ class TransferModal(discord.ui.Modal, title="Передать владение 
 class PrivateVoice(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.template_channel_id: Optional[int] = None  # голосовой канал-шаблон
         self.owner_map: dict[int, int] = {}  # channel_id -> owner_id
         self.text_channels: dict[int, int] = {}  # voice_channel_id -> text_channel_id
 
-    async def cog_load(self) -> None:
-        """Загрузка кога: подхватываем сохранённый шаблонный канал"""
-        try:
-            row = await self.bot.db.fetchone("SELECT value FROM settings WHERE key='voice_template_channel_id'")
-            if row and str(row[0]).isdigit():
-                self.template_channel_id = int(row[0])
-        except Exception as e:
-            print(f"Failed to load voice template id: {e}")
+    def get_template_channel_id(self, guild_id: int) -> Optional[int]:
+        """Голосовой канал-шаблон сервера (из кэша settings)"""
+        return self.bot.settings_store.get_int(guild_id, "voice_template_channel_id")
 
-    async def get_user_voice_settings(self, user_id: int) -> dict:
+    async def get_user_voice_settings(self, guild_id: int, user_id: int) -> dict:
         """Получает настройки голосового канала пользователя"""
         try:
             result = await self.bot.db.fetchone(
-                "SELECT channel_name, user_limit, is_locked FROM voice_settings WHERE user_id = ?",
-                user_id
+                "SELECT channel_name, user_limit, is_locked FROM voice_settings WHERE guild_id = ? AND user_id = ?",
+                guild_id, user_id
             )
             if result:
                 return {
@@ -283,13 +281,13 @@ class PrivateVoice(commands.Cog):
             print(f"Failed to get user voice settings: {e}")
             return {'channel_name': '', 'user_limit': 0, 'is_locked': False}
 
-    async def save_user_voice_settings(self, user_id: int, channel_name: str = '', user_limit: int = 0, is_locked: bool = False):
+    async def save_user_voice_settings(self, guild_id: int, user_id: int, channel_name: str = '', user_limit: int = 0, is_locked: bool = False):
         """Сохраняет настройки голосового канала пользователя"""
         try:
             await self.bot.db.exec(
-                """INSERT OR REPLACE INTO voice_settings (user_id, channel_name, user_limit, is_locked) 
-                   VALUES (?, ?, ?, ?)""",
-                user_id, channel_name, user_limit, is_locked
+                """INSERT OR REPLACE INTO voice_settings (guild_id, user_id, channel_name, user_limit, is_locked) 
+                   VALUES (?, ?, ?, ?, ?)""",
+                guild_id, user_id, channel_name, user_limit, is_locked
             )
         except Exception as e:
             print(f"Failed to save user voice settings: {e}")
@@ -301,13 +299,9 @@ class PrivateVoice(commands.Cog):
             await interaction.response.send_message("❌ У вас нет прав для управления каналами", ephemeral=True)
             return
             
-        self.template_channel_id = template_channel.id
         # Сохраняем в БД, чтобы не сбрасывалось после перезапуска бота
         try:
-            await self.bot.db.exec(
-                "INSERT OR REPLACE INTO settings (key, value) VALUES ('voice_template_channel_id', ?)",
-                str(template_channel.id)
-            )
+            await self.bot.settings_store.set(interaction.guild_id, "voice_template_channel_id", template_channel.id)
         except Exception as e:
             print(f"Failed to persist voice template id: {e}")
 
@@ -319,8 +313,9 @@ class PrivateVoice(commands.Cog):
             await interaction.response.send_message("❌ У вас нет прав для управления каналами", ephemeral=True)
             return
             
-        if self.template_channel_id:
-            channel = interaction.guild.get_channel(self.template_channel_id)
+        template_channel_id = self.get_template_channel_id(interaction.guild_id)
+        if template_channel_id:
+            channel = interaction.guild.get_channel(template_channel_id)
             if channel:
                 await interaction.response.send_message(f"📢 Текущий шаблонный канал: {channel.mention}", ephemeral=True)
             else:
@@ -330,7 +325,7 @@ class PrivateVoice(commands.Cog):
 
     @discord.app_commands.command(name="voice-settings", description="Показать ваши сохраненные настройки голосового канала")
     async def voice_settings(self, interaction: discord.Interaction):
-        settings = await self.get_user_voice_settings(interaction.user.id)
+        settings = await self.get_user_voice_settings(interaction.guild_id, interaction.user.id)
         
         embed = discord.Embed(
             title="🎛️ Ваши настройки голосового канала",
@@ -403,12 +398,13 @@ class PrivateVoice(commands.Cog):
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
         # Создание приватного канала при входе в шаблон
-        if self.template_channel_id and after.channel and after.channel.id == self.template_channel_id:
+        template_channel_id = self.get_template_channel_id(member.guild.id)
+        if template_channel_id and after.channel and after.channel.id == template_channel_id:
             try:
                 guild = member.guild
                 
                 # Получаем сохраненные настройки пользователя
-                settings = await self.get_user_voice_settings(member.id)
+                settings = await self.get_user_voice_settings(guild.id, member.id)
                 channel_name = settings['channel_name'] or member.display_name
                 user_limit = settings['user_limit'] or 0
                 is_locked = settings['is_locked']
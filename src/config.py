@@ -15,6 +15,74 @@ class Settings:
     log_level: str
     db_path: str
     prefix: str
+    # group-commit очередь записей в БД (см. Database.exec)
+    db_write_behind: bool = False
+    db_batch_size: int = 100
+    db_flush_interval: float = 0.05
+    # WAL и пул read-only соединений для fetchone/fetchall
+    db_wal: bool = False
+    db_read_pool_size: int = 0
+    db_statement_cache_size: int = 256
+    # порог медленного запроса, мс (0 — не логировать)
+    db_slow_query_ms: float = 100.0
+    # онлайн-бэкап: каталог снимков (пусто — выключено), период в минутах,
+    # сколько снимков хранить, страниц за шаг и режим восстановления при старте
+    db_backup_dir: str = ""
+    db_backup_interval: float = 0.0
+    db_backup_keep: int = 7
+    db_backup_pages: int = 256
+    db_restore: str = "off"
+    # retention: сколько дней хранить журнал модерации и данные ушедших
+    # участников (0 — вечно), период фоновой чистки в часах, размер пачки
+    # и каталог JSONL-архива удалённых строк (пусто — без архива)
+    retention_modlog_days: int = 0
+    retention_departed_days: int = 0
+    retention_interval: float = 0.0
+    retention_batch_size: int = 500
+    retention_archive_dir: str = ""
+    # буфер опыта Levels: период сброса в секундах (0 — писать сразу)
+    # и сколько пользователей копить до внеочередного сброса
+    levels_flush_interval: float = 0.0
+    levels_buffer_max_users: int = 5000
+    # опыт за голос: период тика в секундах (0 — выключено), XP за тик и
+    # сколько людей должно быть в канале, чтобы опыт шёл
+    levels_voice_interval: float = 0.0
+    levels_voice_xp: int = 10
+    levels_voice_min_members: int = 2
+    # статистика активности: период сброса счётчиков в секундах и сколько
+    # дней хранить почасовые корзины (дальше — только суточные)
+    stats_flush_interval: float = 30.0
+    stats_hourly_days: int = 14
+    # процессов, рисующих /stats-chart
+    stats_chart_workers: int = 1
+    # сколько дней хранить журнал голосовых сессий (0 — всегда)
+    stats_voice_session_days: int = 90
+    # счётчиков Space-Saving на отрезок для живого топа за час (0 — выключен)
+    stats_topk_capacity: int = 0
+    # картинка-карточка в /lvl: процессов-рендереров (0 — только текст)
+    # и объём кэша готовых PNG в мегабайтах
+    rank_card_workers: int = 1
+    rank_card_cache_mb: float = 16.0
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    raw = os.getenv(name)
+    if raw is None or not raw.strip():
+        return default
+    return raw.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    return int(raw) if raw.lstrip("-").isdigit() else default
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name, "").strip()
+    try:
+        return float(raw) if raw else default
+    except ValueError:
+        return default
 
 
 def load_settings() -> Settings:
@@ -35,6 +103,35 @@ def load_settings() -> Settings:
     log_level = os.getenv("LOG_LEVEL", "INFO").upper()
     db_path = os.getenv("DB_PATH", "./src/data/amadeus.db")
     prefix = os.getenv("PREFIX", "!")
+    db_write_behind = _env_bool("DB_WRITE_BEHIND")
+    db_batch_size = _env_int("DB_BATCH_SIZE", 100)
+    db_flush_interval = _env_float("DB_FLUSH_INTERVAL", 0.05)
+    db_wal = _env_bool("DB_WAL")
+    db_read_pool_size = _env_int("DB_READ_POOL_SIZE", 0)
+    db_statement_cache_size = _env_int("DB_STATEMENT_CACHE_SIZE", 256)
+    db_slow_query_ms = _env_float("DB_SLOW_QUERY_MS", 100.0)
+    db_backup_dir = os.getenv("DB_BACKUP_DIR", "").strip()
+    db_backup_interval = _env_float("DB_BACKUP_INTERVAL", 0.0)
+    db_backup_keep = _env_int("DB_BACKUP_KEEP", 7)
+    db_backup_pages = _env_int("DB_BACKUP_PAGES", 256)
+    db_restore = os.getenv("DB_RESTORE", "off").strip().lower() or "off"
+    retention_modlog_days = _env_int("RETENTION_MODLOG_DAYS", 0)
+    retention_departed_days = _env_int("RETENTION_DEPARTED_DAYS", 0)
+    retention_interval = _env_float("RETENTION_INTERVAL", 0.0)
+    retention_batch_size = _env_int("RETENTION_BATCH_SIZE", 500)
+    retention_archive_dir = os.getenv("RETENTION_ARCHIVE_DIR", "").strip()
+    levels_flush_interval = _env_float("LEVELS_FLUSH_INTERVAL", 0.0)
+    levels_buffer_max_users = _env_int("LEVELS_BUFFER_MAX_USERS", 5000)
+    levels_voice_interval = _env_float("LEVELS_VOICE_INTERVAL", 0.0)
+    levels_voice_xp = _env_int("LEVELS_VOICE_XP", 10)
+    levels_voice_min_members = _env_int("LEVELS_VOICE_MIN_MEMBERS", 2)
+    stats_flush_interval = _env_float("STATS_FLUSH_INTERVAL", 30.0)
+    stats_hourly_days = _env_int("STATS_HOURLY_DAYS", 14)
+    stats_chart_workers = _env_int("STATS_CHART_WORKERS", 1)
+    stats_voice_session_days = _env_int("STATS_VOICE_SESSION_DAYS", 90)
+    stats_topk_capacity = _env_int("STATS_TOPK_CAPACITY", 0)
+    rank_card_workers = _env_int("RANK_CARD_WORKERS", 1)
+    rank_card_cache_mb = _env_float("RANK_CARD_CACHE_MB", 16.0)
 
     return Settings(
         token=token,
@@ -43,6 +140,35 @@ def load_settings() -> Settings:
         log_level=log_level,
         db_path=db_path,
         prefix=prefix,
+        db_write_behind=db_write_behind,
+        db_batch_size=db_batch_size,
+        db_flush_interval=db_flush_interval,
+        db_wal=db_wal,
+        db_read_pool_size=db_read_pool_size,
+        db_statement_cache_size=db_statement_cache_size,
+        db_slow_query_ms=db_slow_query_ms,
+        db_backup_dir=db_backup_dir,
+        db_backup_interval=db_backup_interval,
+        db_backup_keep=db_backup_keep,
+        db_backup_pages=db_backup_pages,
+        db_restore=db_restore,
+        retention_modlog_days=retention_modlog_days,
+        retention_departed_days=retention_departed_days,
+        retention_interval=retention_interval,
+        retention_batch_size=retention_batch_size,
+        retention_archive_dir=retention_archive_dir,
+        levels_flush_interval=levels_flush_interval,
+        levels_buffer_max_users=levels_buffer_max_users,
+        levels_voice_interval=levels_voice_interval,
+        levels_voice_xp=levels_voice_xp,
+        levels_voice_min_members=levels_voice_min_members,
+        stats_flush_interval=stats_flush_interval,
+        stats_hourly_days=stats_hourly_days,
+        stats_chart_workers=stats_chart_workers,
+        stats_voice_session_days=stats_voice_session_days,
+        stats_topk_capacity=stats_topk_capacity,
+        rank_card_workers=rank_card_workers,
+        rank_card_cache_mb=rank_card_cache_mb,
     )
 
 
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .db import Database
+
+log = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 24 * HOUR
+# Сутки сворачиваются не сразу после полуночи: сброс буфера мог ещё не дойти
+ROLLUP_GRACE = HOUR
+
+_HOURLY_UPSERT = """
+    INSERT INTO activity_hourly (guild_id, hour, channel_id, user_id, messages) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (guild_id, hour, channel_id, user_id) DO UPDATE SET messages = messages + excluded.messages
+"""
+_DAILY_UPSERT = """
+    INSERT INTO activity_daily (guild_id, day, channel_id, user_id, messages) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (guild_id, day, channel_id, user_id) DO UPDATE SET messages = messages + excluded.messages
+"""
+# Счётчик «за всё время»: прибавляем прирост, а не перезаписываем сумму
+_LIFETIME_UPSERT = """
+    INSERT INTO message_stats (guild_id, user_id, count) VALUES (?, ?, ?)
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET count = count + excluded.count
+"""
+# Свёртка закрытых суток: пересчёт целиком, поэтому повторный запуск безопасен
+_ROLLUP = """
+    INSERT INTO activity_daily (guild_id, day, channel_id, user_id, messages)
+    SELECT guild_id, hour / 24, channel_id, user_id, SUM(messages) FROM activity_hourly
+    WHERE hour >= ? AND hour < ?
+    GROUP BY guild_id, hour / 24, channel_id, user_id
+    ON CONFLICT (guild_id, day, channel_id, user_id) DO UPDATE SET messages = excluded.messages
+"""
+_GUILD_UPSERT = """
+    INSERT INTO guild_activity_hourly (guild_id, hour, joins, leaves) VALUES (?, ?, ?, ?)
+    ON CONFLICT (guild_id, hour) DO UPDATE SET
+        joins = joins + excluded.joins,
+        leaves = leaves + excluded.leaves
+"""
+_WATERMARK_KEY = "rolled_up_day"
+
+# Ряды графиков: метрика -> колонки
+SERIES = {
+    "messages": ("messages",),
+    "members": ("joins", "leaves"),
+    "voice": ("voice_seconds",),
+}
+
+
+@dataclass
+class RollupReport:
+    days: int = 0
+    rows: int = 0
+    pruned: int = 0
+
+
+class ActivityStore:
+    """Активность по корзинам «час» и «сутки» на (сервер, канал, участник).
+
+    Сообщения копятся в словаре в памяти и пишутся пачкой UPSERT'ов в
+    ``flush``; закрытые сутки ``rollup`` сворачивает из часовой таблицы в
+    суточную, а часовые строки старше ``hourly_days`` удаляет. Запросы за
+    любое окно берут целые сутки из activity_daily, края окна — из
+    activity_hourly; оба чтения — диапазон по первичному ключу.
+
+    Всё, что раньше ``watermark``-суток, уже лежит в activity_daily.
+    Входы/выходы по серверу целиком — в guild_activity_hourly (строка на
+    сервер в час, не чистится); минуты в голосе туда пишет
+    ``VoiceSessionTracker``.
+    """
+
+    def __init__(self, db: Database, *, hourly_days: int = 14) -> None:
+        self._db = db
+        self.hourly_days = max(1, hourly_days)
+        # (guild_id, hour, channel_id, user_id) -> сообщений
+        self._pending: defaultdict[tuple[int, int, int, int], int] = defaultdict(int)
+        # (guild_id, hour) -> [входов, выходов]
+        self._guild_pending: defaultdict[tuple[int, int], list[int]] = defaultdict(lambda: [0, 0])
+        self.watermark: int | None = None  # первый ещё не свёрнутый день
+
+    async def load(self) -> None:
+        row = await self._db.fetchone("SELECT value FROM activity_meta WHERE key = ?", _WATERMARK_KEY)
+        self.watermark = row[0] if row else None
+
+    def record_message(self, guild_id: int, channel_id: int, user_id: int, timestamp: float | None = None) -> None:
+        hour = int((time.time() if timestamp is None else timestamp) // HOUR)
+        self._pending[(guild_id, hour, channel_id, user_id)] += 1
+
+    def record_member(self, guild_id: int, joined: bool, timestamp: float | None = None) -> None:
+        hour = int((time.time() if timestamp is None else timestamp) // HOUR)
+        self._guild_pending[(guild_id, hour)][0 if joined else 1] += 1
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending) + len(self._guild_pending)
+
+    async def flush(self) -> int:
+        """Пишет накопленное одной транзакцией; возвращает число строк-корзин."""
+        if not self._pending and not self._guild_pending:
+            return 0
+        batch, self._pending = self._pending, defaultdict(int)
+        guild_batch, self._guild_pending = self._guild_pending, defaultdict(lambda: [0, 0])
+        hourly = [(*key, count) for key, count in batch.items()]
+        lifetime: defaultdict[tuple[int, int], int] = defaultdict(int)
+        for (guild_id, _, _, user_id), count in batch.items():
+            lifetime[(guild_id, user_id)] += count
+        try:
+            async with self._db.transaction() as tx:
+                # Водяной знак — изнутри транзакции: свёртка, прошедшая между
+                # началом flush и записью, могла его сдвинуть
+                row = await tx.fetchone("SELECT value FROM activity_meta WHERE key = ?", _WATERMARK_KEY)
+                watermark = row[0] if row else None
+                late: defaultdict[tuple[int, int, int, int], int] = defaultdict(int)
+                if watermark is not None:
+                    for (guild_id, hour, channel_id, user_id), count in batch.items():
+                        # Сутки уже свёрнуты (бот долго не сбрасывал буфер) — досылаем и в суточную
+                        if hour // 24 < watermark:
+                            late[(guild_id, hour // 24, channel_id, user_id)] += count
+                await tx.exec_many(_HOURLY_UPSERT, hourly)
+                if late:
+                    await tx.exec_many(_DAILY_UPSERT, [(*key, count) for key, count in late.items()])
+                await tx.exec_many(_LIFETIME_UPSERT, [(*key, count) for key, count in lifetime.items()])
+                if guild_batch:
+                    await tx.exec_many(_GUILD_UPSERT, [(*key, *counts) for key, counts in guild_batch.items()])
+        except Exception:
+            # Не теряем счётчики: вернутся в следующую пачку
+            for key, count in batch.items():
+                self._pending[key] += count
+            for key, counts in guild_batch.items():
+                pending = self._guild_pending[key]
+                for i, value in enumerate(counts):
+                    pending[i] += value
+            raise
+        return len(hourly) + len(guild_batch)
+
+    async def rollup(self, now: float | None = None) -> RollupReport:
+        """Сворачивает закрытые сутки в activity_daily и чистит старые часовые корзины."""
+        now = time.time() if now is None else now
+        closed_until = int((now - ROLLUP_GRACE) // DAY)  # сутки < closed_until закрыты
+        report = RollupReport()
+        async with self._db.transaction() as tx:
+            start = self.watermark
+            if start is None:
+                row = await tx.fetchone("SELECT MIN(hour) FROM activity_hourly")
+                start = closed_until if row is None or row[0] is None else min(row[0] // 24, closed_until)
+            if start < closed_until:
+                await tx.exec(_ROLLUP, start * 24, closed_until * 24)
+                row = await tx.fetchone("SELECT changes()")
+                report.rows = row[0] if row else 0
+                report.days = closed_until - start
+            await tx.exec(
+                "INSERT INTO activity_meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                _WATERMARK_KEY, max(start, closed_until),
+            )
+            prune_before = min(closed_until, int(now // DAY) - self.hourly_days) * 24
+            await tx.exec("DELETE FROM activity_hourly WHERE hour < ?", prune_before)
+            row = await tx.fetchone("SELECT changes()")
+            report.pruned = row[0] if row else 0
+        self.watermark = max(start, closed_until)
+        if report.days or report.pruned:
+            log.info("Activity rollup: %d days -> %d daily rows, pruned %d hourly rows", report.days, report.rows, report.pruned)
+        return report
+
+    def _parts(self, since: float, until: float) -> tuple[tuple[int, int], list[tuple[int, int]]]:
+        """Окно [since, until) -> (диапазон суток для activity_daily, диапазоны часов для activity_hourly)."""
+        first_hour = int(since // HOUR)
+        end_hour = -int(-until // HOUR)  # округление вверх: текущий час входит целиком
+        watermark = self.watermark if self.watermark is not None else 0
+        day_from = -(-first_hour // 24)
+        day_to = min(end_hour // 24, watermark)
+        if day_from >= day_to:
+            return (0, 0), [(first_hour, end_hour)]
+        # Часовые строки старше hourly_days удалены — такой край берём целыми сутками
+        oldest_hour = (int(time.time() // DAY) - self.hourly_days) * 24
+        if first_hour < day_from * 24 and first_hour < oldest_hour:
+            day_from -= 1
+        hours = [(first_hour, day_from * 24), (day_to * 24, end_hour)]
+        return (day_from, day_to), [(a, b) for a, b in hours if a < b]
+
+    async def top(
+        self,
+        guild_id: int,
+        since: float,
+        until: float | None = None,
+        *,
+        by: str = "user_id",
+        channel_id: int | None = None,
+        user_id: int | None = None,
+        limit: int = 10,
+    ) -> list[tuple[int, int]]:
+        """Самые активные участники (``by="user_id"``) или каналы (``by="channel_id"``) за окно.
+
+        Возвращает пары (id, сообщений). Данные — по последний ``flush``.
+        """
+        if by not in ("user_id", "channel_id"):
+            raise ValueError(f"unknown grouping {by!r}")
+        until = time.time() if until is None else until
+        (day_from, day_to), hours = self._parts(since, until)
+        extra = ""
+        extra_params: list[int] = []
+        if channel_id is not None:
+            extra += " AND channel_id = ?"
+            extra_params.append(channel_id)
+        if user_id is not None:
+            extra += " AND user_id = ?"
+            extra_params.append(user_id)
+
+        arms = []
+        params: list[int] = []
+        if day_from < day_to:
+            arms.append(f"SELECT {by} AS id, messages FROM activity_daily WHERE guild_id = ? AND day >= ? AND day < ?{extra}")
+            params += [guild_id, day_from, day_to, *extra_params]
+        for first, end in hours:
+            arms.append(f"SELECT {by} AS id, messages FROM activity_hourly WHERE guild_id = ? AND hour >= ? AND hour < ?{extra}")
+            params += [guild_id, first, end, *extra_params]
+        rows = await self._db.fetchall(
+            f"SELECT id, SUM(messages) AS total FROM ({' UNION ALL '.join(arms)}) "
+            "GROUP BY id ORDER BY total DESC, id LIMIT ?",
+            *params, limit,
+        )
+        return [(row[0], row[1]) for row in rows]
+
+    async def series(self, guild_id: int, metric: str, start: int, end: int, step: int) -> dict[str, list[int]]:
+        """Ряды ``metric`` по корзинам ``step`` (HOUR или DAY) с номерами [start, end).
+
+        Пустые корзины — нули. Сообщения по суткам берутся из activity_daily
+        до ``watermark`` и из activity_hourly после него.
+        """
+        if metric not in SERIES:
+            raise ValueError(f"unknown metric {metric!r}")
+        if step not in (HOUR, DAY):
+            raise ValueError(f"unsupported step {step}")
+        per = step // HOUR  # часов в корзине
+        columns = SERIES[metric]
+        if metric == "messages":
+            queries = []
+            first_hourly = start
+            if step == DAY and self.watermark is not None and self.watermark > start:
+                first_hourly = min(end, self.watermark)
+                queries.append((
+                    "SELECT day, SUM(messages) FROM activity_daily "
+                    "WHERE guild_id = ? AND day >= ? AND day < ? GROUP BY day",
+                    (guild_id, start, first_hourly),
+                ))
+            if first_hourly < end:
+                queries.append((
+                    f"SELECT hour / {per}, SUM(messages) FROM activity_hourly "
+                    f"WHERE guild_id = ? AND hour >= ? AND hour < ? GROUP BY hour / {per}",
+                    (guild_id, first_hourly * per, end * per),
+                ))
+        else:
+            sums = ", ".join(f"SUM({column})" for column in columns)
+            queries = [(
+                f"SELECT hour / {per}, {sums} FROM guild_activity_hourly "
+                f"WHERE guild_id = ? AND hour >= ? AND hour < ? GROUP BY hour / {per}",
+                (guild_id, start * per, end * per),
+            )]
+        result = {column: [0] * (end - start) for column in columns}
+        for sql, params in queries:
+            for row in await self._db.fetchall(sql, *params):
+                for column, value in zip(columns, row[1:]):
+                    result[column][row[0] - start] += value or 0
+        return result
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable
+
+from .migrations import LATEST_VERSION
+
+if TYPE_CHECKING:
+    from .db import Database
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_PREFIX = "amadeus-"
+SNAPSHOT_SUFFIX = ".db"
+RESTORE_MODES = ("off", "missing", "always")
+# Сколько раз копирование может начаться заново из-за записей бота
+MAX_RESTARTS = 2
+
+
+@dataclass
+class BackupResult:
+    path: str
+    pages: int
+    steps: int
+    restarts: int
+    size_bytes: int
+    seconds: float
+    removed: list[str]
+
+
+def list_snapshots(backup_dir: str) -> list[str]:
+    """Снимки в каталоге, от новых к старым (имя содержит время создания)."""
+    try:
+        names = os.listdir(backup_dir)
+    except FileNotFoundError:
+        return []
+    snapshots = [n for n in names if n.startswith(SNAPSHOT_PREFIX) and n.endswith(SNAPSHOT_SUFFIX)]
+    return [os.path.join(backup_dir, n) for n in sorted(snapshots, reverse=True)]
+
+
+def rotate(backup_dir: str, keep: int) -> list[str]:
+    """Удаляет всё, кроме ``keep`` последних снимков."""
+    removed = []
+    for path in list_snapshots(backup_dir)[max(1, keep):]:
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError:
+            log.warning("Failed to remove old snapshot %s", path)
+    return removed
+
+
+def verify_snapshot(path: str) -> bool:
+    """Снимок цел и по схеме не новее кода, который будет его открывать."""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return False
+    try:
+        (status,) = conn.execute("PRAGMA integrity_check").fetchone()
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+    if status != "ok":
+        log.warning("Snapshot %s failed integrity check: %s", path, status)
+        return False
+    if version > LATEST_VERSION:
+        log.warning("Snapshot %s has schema v%d, newer than v%d", path, version, LATEST_VERSION)
+        return False
+    return True
+
+
+def _copy_pages(
+    source: sqlite3.Connection,
+    dest_path: str,
+    pages: int,
+    step_delay: float,
+    hold_writes: Callable[[], None] | None = None,
+) -> tuple[int, int, int]:
+    """Постраничное копирование через sqlite3 backup API.
+
+    Между шагами блокировка источника отпускается, и пауза ``step_delay``
+    даёт основному соединению бота спокойно закоммитить свои записи. Каждая
+    такая запись заставляет SQLite начать копирование заново; после
+    ``MAX_RESTARTS`` перезапусков вызывается ``hold_writes``, и остаток
+    копируется без пауз при остановленной записи.
+    """
+    steps = 0
+    total = 0
+    restarts = 0
+    last_remaining: int | None = None
+    holding = False
+
+    def progress(status: int, remaining: int, page_count: int) -> None:
+        nonlocal steps, total, restarts, last_remaining, holding
+        steps += 1
+        total = page_count
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if hold_writes is not None and not holding and restarts >= MAX_RESTARTS:
+                hold_writes()
+                holding = True
+        last_remaining = remaining
+        if remaining and step_delay > 0 and not holding:
+            time.sleep(step_delay)
+
+    dest = sqlite3.connect(dest_path)
+    try:
+        source.backup(dest, pages=pages if pages > 0 else -1, progress=progress)
+        # Снимок — один самодостаточный файл, без -wal/-shm рядом
+        dest.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dest.close()
+    return total, steps, restarts
+
+
+async def create_snapshot(
+    db: Database,
+    backup_dir: str,
+    *,
+    pages: int = 256,
+    step_delay: float = 0.01,
+    keep: int = 7,
+) -> BackupResult:
+    """Делает проверенный снимок работающей БД и ротирует старые.
+
+    Копирование идёт в отдельном потоке через собственное соединение, так
+    что event loop не блокируется, а запись бота ждёт только на время шага.
+    """
+    if db.is_memory:
+        raise RuntimeError("in-memory database has no file to snapshot")
+    os.makedirs(backup_dir, exist_ok=True)
+    await db.flush()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    final_path = os.path.join(backup_dir, f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}")
+    tmp_path = final_path + ".part"
+    loop = asyncio.get_running_loop()
+    held = False
+
+    def hold_writes() -> None:
+        nonlocal held
+        asyncio.run_coroutine_threadsafe(db.write_lock.acquire(), loop).result()
+        held = True
+
+    def run() -> tuple[int, int, int]:
+        source = sqlite3.connect(f"file:{os.path.abspath(db.path)}?mode=ro", uri=True)
+        try:
+            return _copy_pages(source, tmp_path, pages, step_delay, hold_writes)
+        finally:
+            source.close()
+            if held:
+                loop.call_soon_threadsafe(db.write_lock.release)
+
+    started = time.perf_counter()
+    try:
+        total, steps, restarts = await asyncio.to_thread(run)
+        if not await asyncio.to_thread(verify_snapshot, tmp_path):
+            raise RuntimeError(f"snapshot {tmp_path} failed verification")
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    elapsed = time.perf_counter() - started
+    removed = await asyncio.to_thread(rotate, backup_dir, keep)
+    result = BackupResult(final_path, total, steps, restarts, os.path.getsize(final_path), elapsed, removed)
+    log.info(
+        "Snapshot %s: %d pages in %d steps (%d restarts), %.1f KiB, %.2fs, rotated %d",
+        final_path, total, steps, restarts, result.size_bytes / 1024, elapsed, len(removed),
+    )
+    return result
+
+
+def restore_latest(db_path: str, backup_dir: str, mode: str = "missing") -> str | None:
+    """Восстанавливает БД из самого свежего снимка, прошедшего проверку.
+
+    Вызывается до ``Database.connect()``. ``missing`` — только если файла
+    БД нет или он пуст (эфемерный диск после деплоя), ``always`` — всегда.
+    Текущий файл при этом сохраняется рядом как ``*.pre-restore``.
+    """
+    if mode not in RESTORE_MODES:
+        raise ValueError(f"unknown restore mode {mode!r}, expected one of {RESTORE_MODES}")
+    if mode == "off":
+        return None
+    exists = os.path.exists(db_path) and os.path.getsize(db_path) > 0
+    if mode == "missing" and exists:
+        return None
+
+    for snapshot in list_snapshots(backup_dir):
+        if not verify_snapshot(snapshot):
+            continue
+        parent_dir = os.path.dirname(db_path) or "."
+        os.makedirs(parent_dir, exist_ok=True)
+        tmp_path = db_path + ".restore"
+        source = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+        try:
+            _copy_pages(source, tmp_path, pages=-1, step_delay=0)
+        finally:
+            source.close()
+        if exists:
+            os.replace(db_path, db_path + ".pre-restore")
+        # WAL/SHM от прежнего файла нельзя применять к восстановленному
+        for suffix in ("-wal", "-shm", "-journal"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(db_path + suffix)
+        os.replace(tmp_path, db_path)
+        log.warning("Database %s restored from %s", db_path, snapshot)
+        return snapshot
+
+    log.warning("No valid snapshot in %s to restore %s from", backup_dir, db_path)
+    return None
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import io
+import logging
+from dataclasses import dataclass
+
+from .render_pool import PooledRenderer
+
+log = logging.getLogger(__name__)
+
+_BACKGROUND = "#23272a"
+_GRID = "#3a3e44"
+_TEXT = "#ffffff"
+_MUTED = "#b9bbbe"
+
+
+@dataclass(frozen=True)
+class Series:
+    label: str
+    values: tuple[float, ...]
+    color: str
+    negative: bool = False  # рисовать вниз от нуля (например, выходы)
+
+
+@dataclass(frozen=True)
+class ChartSpec:
+    """Данные графика; передаётся в процесс-воркер целиком."""
+
+    title: str
+    start: int  # unix-время начала первой корзины
+    step: int  # ширина корзины в секундах
+    series: tuple[Series, ...]
+    ylabel: str = ""
+
+
+def render_chart(spec: ChartSpec) -> bytes:
+    """Столбчатый график по корзинам; возвращает PNG. Выполняется в процессе-воркере."""
+    import warnings
+    from datetime import datetime, timezone
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+
+    warnings.filterwarnings("ignore", message="Glyph .* missing")
+
+    fig = Figure(figsize=(10, 4.5), dpi=100, facecolor=_BACKGROUND)
+    ax = fig.add_subplot()
+    ax.set_facecolor(_BACKGROUND)
+    count = max((len(s.values) for s in spec.series), default=0)
+    x = [datetime.fromtimestamp(spec.start + i * spec.step, timezone.utc) for i in range(count)]
+    width = spec.step / 86400 * 0.8  # ширина столбца в днях (единица оси дат)
+    for series in spec.series:
+        values = [-v for v in series.values] if series.negative else list(series.values)
+        ax.bar(x, values, width=width, align="edge", color=series.color, label=series.label)
+    if any(s.negative for s in spec.series):
+        ax.axhline(0, color=_MUTED, linewidth=0.8)
+        ax.yaxis.set_major_formatter(lambda value, _: f"{abs(value):g}")
+
+    locator = mdates.AutoDateLocator(minticks=4, maxticks=10)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator, tz=timezone.utc))
+    ax.set_title(spec.title, color=_TEXT, fontsize=14, loc="left")
+    ax.set_ylabel(spec.ylabel, color=_MUTED)
+    ax.tick_params(colors=_MUTED)
+    ax.grid(axis="y", color=_GRID, linewidth=0.6)
+    ax.set_axisbelow(True)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    if len(spec.series) > 1:
+        ax.legend(facecolor=_BACKGROUND, edgecolor=_GRID, labelcolor=_TEXT, loc="upper left")
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", facecolor=_BACKGROUND)
+    return buffer.getvalue()
+
+
+class ChartRenderer(PooledRenderer):
+    """Рендер графиков в пуле процессов с кэшем до закрытия следующей корзины.
+
+    График строится только по закрытым корзинам, поэтому до конца текущего
+    часа (или суток) он не меняется: PNG лежит в кэше под ключом
+    ``(guild_id, metric, window)`` до ``expires_at``. Кэш ограничен числом
+    записей (LRU).
+    """
+
+    def __init__(self, *, workers: int = 1, max_entries: int = 256) -> None:
+        super().__init__(workers=workers, max_entries=max_entries)
+
+    async def render(self, key: tuple, spec: ChartSpec, expires_at: float) -> bytes:
+        """PNG графика: из кэша или свежий рендер в пуле."""
+        return await self._render(key, render_chart, spec, expires_at=expires_at)
@@ -1,110 +1,207 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import logging
 import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterable, Sequence
+from urllib.parse import quote
+
 import aiosqlite
 
+from .migrations import MigrationContext, migrate
+from .query_stats import QueryMetrics, normalize_sql
+
+log = logging.getLogger(__name__)
+
+_RETURNING_RE = re.compile(r"\bRETURNING\b", re.IGNORECASE)
+
+# Путь для базы в памяти: та же схема и тот же интерфейс, но без файла и fsync
+MEMORY_PATH = ":memory:"
+
+
+@dataclass
+class WriteQueueStats:
+    """Счётчики очереди group-commit (для подбора batch_size/flush_interval)."""
+
+    enqueued: int = 0
+    committed: int = 0
+    failed: int = 0
+    batches: int = 0
+    last_batch_size: int = 0
+    max_batch_size: int = 0
+    max_queue_depth: int = 0
+    queue_depth: int = 0
+
+    @property
+    def avg_batch_size(self) -> float:
+        return self.committed / self.batches if self.batches else 0.0
+
+
+class Transaction:
+    """Операции внутри ``Database.transaction()``: без отдельных коммитов."""
+
+    def __init__(self, db: Database, conn: aiosqlite.Connection) -> None:
+        self._db = db
+        self._conn = conn
+
+    async def exec(self, query: str, *params) -> None:
+        started = time.perf_counter()
+        cursor = await self._conn.execute(query, params)
+        self._db._observe(query, params, started, cursor.rowcount)
+
+    async def exec_many(self, query: str, rows: Iterable[Sequence[Any]]) -> None:
+        started = time.perf_counter()
+        cursor = await self._conn.executemany(query, rows)
+        self._db._observe(query, (), started, cursor.rowcount, explain=False)
+
+    async def fetchone(self, query: str, *params):
+        started = time.perf_counter()
+        async with self._conn.execute(query, params) as cursor:
+            row = await cursor.fetchone()
+        self._db._observe(query, params, started, int(row is not None))
+        return row
+
+    async def fetchall(self, query: str, *params):
+        started = time.perf_counter()
+        async with self._conn.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+        self._db._observe(query, params, started, len(rows))
+        return rows
+
 
 class Database:
-    def __init__(self, path: str) -> None:
+    def __init__(
+        self,
+        path: str,
+        *,
+        write_behind: bool = False,
+        batch_size: int = 100,
+        flush_interval: float = 0.05,
+        wal: bool = False,
+        read_pool_size: int = 0,
+        statement_cache_size: int = 256,
+        slow_query_ms: float = 100.0,
+    ) -> None:
         self._path = path
         self._conn: aiosqlite.Connection | None = None
+        # Размер LRU-кэша подготовленных выражений sqlite3 на каждое соединение:
+        # частые запросы из cog'ов компилируются один раз.
+        self._statement_cache_size = max(0, statement_cache_size)
+        # WAL позволяет читать параллельно с записью: fetchone/fetchall идут
+        # через пул read-only соединений, запись остаётся на self._conn.
+        self._wal = wal
+        self._read_pool_size = max(0, read_pool_size)
+        self._readers: list[aiosqlite.Connection] = []
+        self._read_pool: asyncio.Queue[aiosqlite.Connection] | None = None
+        # Режим write-behind: exec() ставит запись в очередь, а единственный
+        # writer-таск коммитит их пачками по размеру или по таймауту.
+        self._write_behind = write_behind
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = max(0.0, flush_interval)
+        # None в очереди — команда writer'у завершиться; query None — барьер flush
+        self._queue: asyncio.Queue[tuple[str | None, tuple, asyncio.Future[Any]] | None] | None = None
+        self._writer: asyncio.Task[None] | None = None
+        self._write_lock = asyncio.Lock()
+        self.write_stats = WriteQueueStats()
+        # Латентность по нормализованному SQL; медленные запросы логируются
+        # вместе с EXPLAIN QUERY PLAN (один раз на каждый вид запроса).
+        self.metrics = QueryMetrics(slow_query_ms)
+        self._explained: set[str] = set()
+        self._background: set[asyncio.Task[None]] = set()
+        # SQL-функции из Python (create_function): регистрируются на всех соединениях
+        self._functions: dict[str, tuple[int, Callable[..., Any]]] = {}
+
+    @classmethod
+    def in_memory(cls, **options: Any) -> Database:
+        """База в памяти для тестов и бенчмарков: живёт, пока открыто соединение."""
+        options.pop("wal", None)
+        options.pop("read_pool_size", None)
+        return cls(MEMORY_PATH, **options)
 
     async def connect(self) -> None:
         if self._conn is None:
-            # Ensure parent directory exists to avoid 'unable to open database file'
-            parent_dir = os.path.dirname(self._path) or "."
-            os.makedirs(parent_dir, exist_ok=True)
-            self._conn = await aiosqlite.connect(self._path)
+            if not self.is_memory:
+                # Ensure parent directory exists to avoid 'unable to open database file'
+                parent_dir = os.path.dirname(self._path) or "."
+                os.makedirs(parent_dir, exist_ok=True)
+            self._conn = await aiosqlite.connect(self._path, cached_statements=self._statement_cache_size)
+            await self._register_functions(self._conn)
             await self._conn.execute("PRAGMA foreign_keys = ON;")
+            # Действует только на пустую базу: место после retention-чисток
+            # возвращается через PRAGMA incremental_vacuum (см. utils/retention.py)
+            await self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            if self._wal and not self.is_memory:
+                await self._conn.execute("PRAGMA journal_mode = WAL;")
+                # В WAL fsync на каждый коммит не нужен для целостности
+                await self._conn.execute("PRAGMA synchronous = NORMAL;")
             await self._conn.commit()
+            await self._open_read_pool()
+            if self._write_behind:
+                self._queue = asyncio.Queue()
+                self._writer = asyncio.create_task(self._writer_loop(), name="db-writer")
 
-    async def init_schema(self) -> None:
-        await self.exec(
-            """
-            CREATE TABLE IF NOT EXISTS warns (
-                user_id INTEGER PRIMARY KEY,
-                count INTEGER NOT NULL DEFAULT 0
-            );
-
-            CREATE TABLE IF NOT EXISTS moderation_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                action TEXT NOT NULL,
-                target_id INTEGER NOT NULL,
-                moderator_id INTEGER NOT NULL,
-                reason TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS tickets (
-                channel_id INTEGER PRIMARY KEY,
-                owner_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS message_stats (
-                user_id INTEGER PRIMARY KEY,
-                count INTEGER NOT NULL DEFAULT 0
-            );
-
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS reaction_roles (
-                message_id INTEGER NOT NULL,
-                emoji TEXT NOT NULL,
-                role_id INTEGER NOT NULL,
-                PRIMARY KEY (message_id, emoji)
-            );
-
-            CREATE TABLE IF NOT EXISTS user_levels (
-                user_id INTEGER PRIMARY KEY,
-                xp INTEGER NOT NULL DEFAULT 0,
-                level INTEGER NOT NULL DEFAULT 0,
-                last_message_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS level_rewards (
-                level INTEGER PRIMARY KEY,
-                role_id INTEGER NOT NULL,
-                role_name TEXT NOT NULL
-            );
-
-                    CREATE TABLE IF NOT EXISTS welcome_channels (
-                        channel_type TEXT PRIMARY KEY,
-                        channel_id INTEGER NOT NULL,
-                        channel_name TEXT NOT NULL,
-                        description TEXT NOT NULL DEFAULT ''
-                    );
-
-                    CREATE TABLE IF NOT EXISTS voice_settings (
-                        user_id INTEGER PRIMARY KEY,
-                        channel_name TEXT NOT NULL DEFAULT '',
-                        user_limit INTEGER NOT NULL DEFAULT 0,
-                        is_locked BOOLEAN NOT NULL DEFAULT FALSE
-                    );
-            """
-        )
-        
-        # Проверяем и добавляем колонку description если её нет
-        await self._migrate_welcome_channels()
+    async def _open_read_pool(self) -> None:
+        if not self._read_pool_size:
+            return
+        if not self._wal or self.is_memory:
+            log.warning("Read pool requires WAL mode and a file database; reads stay on the write connection")
+            return
+        uri = f"file:{quote(os.path.abspath(self._path))}?mode=ro"
+        self._read_pool = asyncio.Queue()
+        for _ in range(self._read_pool_size):
+            reader = await aiosqlite.connect(uri, uri=True, cached_statements=self._statement_cache_size)
+            await self._register_functions(reader)
+            await reader.execute("PRAGMA query_only = ON;")
+            self._readers.append(reader)
+            self._read_pool.put_nowait(reader)
 
-    async def _migrate_welcome_channels(self) -> None:
-        """Миграция: добавляем колонку description если её нет"""
-        try:
-            # Проверяем структуру таблицы
-            result = await self.fetchall("PRAGMA table_info(welcome_channels)")
-            columns = [row[1] for row in result]  # row[1] это имя колонки
-            
-            # Если колонки description нет, добавляем её
-            if 'description' not in columns:
-                await self.exec("ALTER TABLE welcome_channels ADD COLUMN description TEXT DEFAULT ''")
-        except Exception:
-            # Игнорируем ошибки миграции
-            pass
+    async def create_function(self, name: str, num_params: int, func: Callable[..., Any]) -> None:
+        """Делает Python-функцию доступной в SQL на всех соединениях, включая будущие.
+
+        Функция вызывается из потока aiosqlite и должна быть детерминированной.
+        """
+        self._functions[name] = (num_params, func)
+        for conn in (self._conn, *self._readers):
+            if conn is not None:
+                await conn.create_function(name, num_params, func, deterministic=True)
+
+    async def _register_functions(self, conn: aiosqlite.Connection) -> None:
+        for name, (num_params, func) in self._functions.items():
+            await conn.create_function(name, num_params, func, deterministic=True)
+
+    async def init_schema(self, *, legacy_guild_id: int = 0) -> None:
+        """Доводит схему до последней версии (см. utils/migrations.py)."""
+        await migrate(self, MigrationContext(legacy_guild_id=legacy_guild_id))
 
     async def close(self) -> None:
+        if self._writer is not None:
+            # Дописываем всё, что осталось в очереди, и останавливаем writer
+            # маркером после последней пачки — не cancel() посреди коммита
+            try:
+                if self._writer.done():
+                    self._raise_writer_error(self._writer)
+                else:
+                    await self.flush()
+                    self._queue.put_nowait(None)
+                    await self._writer
+            except Exception:
+                log.exception("Write-behind writer failed")
+            self._writer = None
+            self._queue = None
+            stats = self.write_stats
+            log.info(
+                "Write-behind: %d statements in %d batches (avg %.1f, max %d, max queue depth %d, failed %d)",
+                stats.committed, stats.batches, stats.avg_batch_size,
+                stats.max_batch_size, stats.max_queue_depth, stats.failed,
+            )
+        for reader in self._readers:
+            await reader.close()
+        self._readers.clear()
+        self._read_pool = None
         if self._conn is not None:
             await self._conn.close()
             self._conn = None
@@ -115,16 +212,301 @@ class Database:
             raise RuntimeError("Database is not connected")
         return self._conn
 
-    async def exec(self, query: str, *params) -> None:
-        await self.connection.executescript(query) if not params else await self.connection.execute(query, params)
-        await self.connection.commit()
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def is_memory(self) -> bool:
+        return self._path == MEMORY_PATH
+
+    @property
+    def write_lock(self) -> asyncio.Lock:
+        """Пока блокировка взята, основное соединение ничего не пишет."""
+        return self._write_lock
+
+    @property
+    def write_behind(self) -> bool:
+        return self._queue is not None
+
+    async def exec(self, query: str, *params, durable: bool = False) -> None:
+        """Выполняет запись.
+
+        В режиме write-behind запрос с параметрами уходит в очередь group-commit;
+        ``durable=True`` дожидается коммита пачки, в которую он попал.
+        Скрипты без параметров выполняются сразу, после сброса очереди.
+        """
+        if self._queue is None:
+            async with self._write_lock:
+                started = time.perf_counter()
+                if not params:
+                    await self.connection.executescript(query)
+                    rowcount = 0
+                else:
+                    rowcount = (await self.connection.execute(query, params)).rowcount
+                await self.connection.commit()
+                self._observe(query, params, started, rowcount, explain=bool(params))
+            return
+        if not params:
+            await self.flush()
+            async with self._write_lock:
+                started = time.perf_counter()
+                await self.connection.executescript(query)
+                await self.connection.commit()
+                self._observe(query, params, started, 0, explain=False)
+            return
+        future = self.submit(query, *params)
+        if durable:
+            await future
+
+    async def exec_returning(self, query: str, *params) -> list:
+        """Выполняет запись с ``RETURNING`` и возвращает её строки.
+
+        Один оператор вместо записи и последующего чтения. В режиме write-behind
+        запрос идёт в общую пачку group-commit, строки приходят после коммита.
+        """
+        if self._queue is None:
+            async with self._write_lock:
+                started = time.perf_counter()
+                try:
+                    rows = list(await self.connection.execute_fetchall(query, params))
+                except BaseException:
+                    await self.connection.rollback()
+                    raise
+                await self.connection.commit()
+                self._observe(query, params, started, len(rows))
+            return rows
+        return await self.submit(query, *params)
+
+    async def exec_many(self, query: str, rows: Iterable[Sequence[Any]]) -> None:
+        """Выполняет один запрос для множества строк в одной транзакции."""
+        await self.flush()
+        async with self._write_lock:
+            started = time.perf_counter()
+            try:
+                cursor = await self.connection.executemany(query, rows)
+            except BaseException:
+                await self.connection.rollback()
+                raise
+            await self.connection.commit()
+            self._observe(query, (), started, cursor.rowcount, explain=False)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Transaction]:
+        """Явная транзакция на пишущем соединении.
+
+        Коммит при выходе, откат при исключении. Внутри блока писать только
+        через выданный ``Transaction``: ``db.exec`` дождётся конца транзакции.
+        """
+        await self.flush()
+        async with self._write_lock:
+            conn = self.connection
+            await conn.execute("BEGIN")
+            try:
+                yield Transaction(self, conn)
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+
+    def submit(self, query: str, *params) -> asyncio.Future[Any]:
+        """Ставит запись в очередь group-commit и возвращает future её коммита.
+
+        Результат future — строки ``RETURNING`` (если есть) или None.
+        """
+        if self._queue is None:
+            raise RuntimeError("Write-behind mode is not enabled")
+        future = self._enqueue(query, params)
+        self.write_stats.enqueued += 1
+        return future
+
+    def _enqueue(self, query: str, params: tuple) -> asyncio.Future[Any]:
+        assert self._queue is not None
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._consume_write_error)
+        self._queue.put_nowait((query, params, future))
+        stats = self.write_stats
+        stats.queue_depth = self._queue.qsize()
+        stats.max_queue_depth = max(stats.max_queue_depth, stats.queue_depth)
+        return future
+
+    async def flush(self) -> None:
+        """Дожидается коммита записей, поставленных в очередь до вызова.
+
+        В очередь ставится барьер: writer закрывает на нём пачку и отмечает
+        его после коммита. Записи, пришедшие позже, flush не ждёт, так что
+        поток ``submit`` его не задерживает. Если writer упал, его ошибка
+        поднимается здесь, а не оставляет flush ждать вечно.
+        """
+        writer = self._writer
+        if self._queue is None or writer is None:
+            return
+        if not writer.done():
+            barrier: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait((None, (), barrier))
+            await asyncio.wait((barrier, writer), return_when=asyncio.FIRST_COMPLETED)
+            if barrier.done():
+                return
+            barrier.cancel()
+        self._raise_writer_error(writer)
+
+    @staticmethod
+    def _raise_writer_error(writer: asyncio.Task[None]) -> None:
+        if writer.cancelled():
+            raise RuntimeError("Write-behind writer was cancelled")
+        error = writer.exception()
+        if error is not None:
+            raise error
+
+    @staticmethod
+    def _consume_write_error(future: asyncio.Future[Any]) -> None:
+        # Ошибку уже залогировал writer; помечаем её прочитанной, чтобы
+        # asyncio не ругался на "exception was never retrieved".
+        if not future.cancelled():
+            future.exception()
+
+    async def _writer_loop(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self._flush_interval
+            # Барьер flush закрывает пачку: всё, что до него, коммитится сейчас
+            while len(batch) < self._batch_size and batch[-1][0] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 and queue.empty():
+                    break
+                try:
+                    item = queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    # Стоп-маркер: коммитим собранное и выходим
+                    stopping = True
+                    break
+                batch.append(item)
+            barrier = batch.pop()[2] if batch[-1][0] is None else None
+            try:
+                if batch:
+                    async with self._write_lock:
+                        await self._commit_batch(batch)  # type: ignore[arg-type]
+            finally:
+                if barrier is not None and not barrier.done():
+                    barrier.set_result(None)
+
+    async def _commit_batch(self, batch: list[tuple[str, tuple, asyncio.Future[Any]]]) -> None:
+        conn = self.connection
+        stats = self.write_stats
+        done: list[tuple[asyncio.Future[Any], Any]] = []
+        for query, params, future in batch:
+            try:
+                started = time.perf_counter()
+                if _RETURNING_RE.search(query):
+                    result = list(await conn.execute_fetchall(query, params))
+                    self._observe(query, params, started, len(result))
+                else:
+                    result = None
+                    cursor = await conn.execute(query, params)
+                    self._observe(query, params, started, cursor.rowcount)
+                done.append((future, result))
+            except Exception as e:
+                # Ошибка одного оператора откатывает только его, пачка продолжается
+                log.exception("Write-behind statement failed: %s", query)
+                stats.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+        try:
+            started = time.perf_counter()
+            await conn.commit()
+            self._observe("COMMIT", (), started, len(done), explain=False)
+        except Exception as e:
+            log.exception("Write-behind batch commit failed (%d statements)", len(done))
+            stats.failed += len(done)
+            for future, _ in done:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        stats.batches += 1
+        stats.committed += len(done)
+        stats.last_batch_size = len(batch)
+        stats.max_batch_size = max(stats.max_batch_size, len(batch))
+        stats.queue_depth = self._queue.qsize() if self._queue is not None else 0
+        for future, result in done:
+            if not future.done():
+                future.set_result(result)
+
+    @contextlib.asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдаёт свободное read-only соединение из пула (или основное, если пула нет)."""
+        if self._read_pool is None:
+            yield self.connection
+            return
+        reader = await self._read_pool.get()
+        try:
+            yield reader
+        finally:
+            self._read_pool.put_nowait(reader)
 
     async def fetchone(self, query: str, *params):
-        async with self.connection.execute(query, params) as cursor:
-            return await cursor.fetchone()
+        async with self._reader() as conn:
+            started = time.perf_counter()
+            async with conn.execute(query, params) as cursor:
+                row = await cursor.fetchone()
+        self._observe(query, params, started, int(row is not None))
+        return row
 
     async def fetchall(self, query: str, *params):
-        async with self.connection.execute(query, params) as cursor:
-            return await cursor.fetchall()
+        async with self._reader() as conn:
+            started = time.perf_counter()
+            async with conn.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+        self._observe(query, params, started, len(rows))
+        return rows
 
+    async def iterate(self, query: str, *params, chunk_size: int = 500) -> AsyncIterator[Any]:
+        """Потоково отдаёт строки большой выборки, подгружая их по chunk_size."""
+        elapsed = 0.0
+        count = 0
+        async with self._reader() as conn:
+            started = time.perf_counter()
+            async with conn.execute(query, params) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    # Время потребителя между пачками в латентность не входит
+                    elapsed += time.perf_counter() - started
+                    if not rows:
+                        break
+                    count += len(rows)
+                    for row in rows:
+                        yield row
+                    started = time.perf_counter()
+        self.metrics.record(query, elapsed * 1000, count)
 
+    def _observe(self, query: str, params: tuple, started: float, rows: int, *, explain: bool = True) -> None:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if not self.metrics.record(query, elapsed_ms, rows):
+            return
+        key = normalize_sql(query)
+        if explain and key not in self._explained:
+            self._explained.add(key)
+            task = asyncio.create_task(self._log_slow_query(query, params, elapsed_ms))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        else:
+            log.warning("Slow query (%.1f ms): %s", elapsed_ms, key)
+
+    async def _log_slow_query(self, query: str, params: tuple, elapsed_ms: float) -> None:
+        try:
+            async with self._reader() as conn:
+                async with conn.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+                    plan = [row[-1] for row in await cursor.fetchall()]
+        except Exception as e:
+            plan = [f"<explain failed: {e}>"]
+        log.warning(
+            "Slow query (%.1f ms): %s\n  plan: %s",
+            elapsed_ms, normalize_sql(query), "\n        ".join(plan) or "<empty>",
+        )
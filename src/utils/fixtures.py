@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import random
+from datetime import datetime, timedelta
+
+from .db import Database
+from .leveling import curve_for
+
+FIRST_USER_ID = 100000000000000000
+
+
+async def seed_user_levels(
+    db: Database,
+    guild_id: int,
+    count: int,
+    *,
+    rng: random.Random | None = None,
+    max_xp: int = 50_000,
+) -> list[int]:
+    """Заполняет user_levels; XP распределён с длинным хвостом, как на живом сервере.
+
+    Возвращает id созданных пользователей.
+    """
+    rng = rng or random.Random(0)
+    now = datetime.now()
+    user_ids = [FIRST_USER_ID + i for i in range(count)]
+    xps = [min(max_xp, int(rng.paretovariate(1.2) * 50) - 50) for _ in user_ids]
+    levels = curve_for(1.2).levels_for(xps)
+    rows = [
+        (guild_id, user_id, xp, int(level), (now - timedelta(seconds=rng.randint(0, 30 * 24 * 3600))).isoformat())
+        for user_id, xp, level in zip(user_ids, xps, levels)
+    ]
+    await db.exec_many(
+        "INSERT OR REPLACE INTO user_levels (guild_id, user_id, xp, level, last_message_time) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    return user_ids
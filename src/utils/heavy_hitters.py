@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import heapq
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Hashable
+
+
+@dataclass(frozen=True)
+class HeavyHitter:
+    """Оценка частоты из скетча: истинное значение лежит в [count - error, count]."""
+
+    key: Hashable
+    count: int
+    error: int
+
+    @property
+    def guaranteed(self) -> int:
+        return self.count - self.error
+
+
+class SpaceSaving:
+    """Space-Saving (Metwally и др.): top-K частых ключей в ``capacity`` счётчиках.
+
+    Пока счётчиков меньше ``capacity``, подсчёт точный. Дальше новый ключ
+    занимает счётчик минимального и наследует его значение как ошибку.
+    Гарантии при ``total`` событиях: оценка не меньше истинной и
+    завышена не больше чем на ``min_count <= total / capacity``; любой
+    ключ с частотой больше ``total / capacity`` в скетче есть.
+
+    Минимум ищется по куче, где у каждого ключа одна запись. Счётчики только
+    растут, поэтому значение в куче — нижняя граница текущего: инкремент
+    кучу не трогает, а устаревшую запись ``_pop_min`` обновляет и
+    возвращает на место.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.total = 0
+        self._counts: dict[Hashable, int] = {}
+        self._errors: dict[Hashable, int] = {}
+        self._heap: list[tuple[int, int, Hashable]] = []  # (count, порядок, key)
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def _pop_min(self) -> tuple[Hashable, int]:
+        heap, counts = self._heap, self._counts
+        while True:
+            count, seq, key = heap[0]
+            current = counts[key]
+            if current == count:
+                heapq.heappop(heap)
+                return key, count
+            heapq.heapreplace(heap, (current, seq, key))
+
+    def add(self, key: Hashable, count: int = 1) -> None:
+        self.total += count
+        counts = self._counts
+        current = counts.get(key)
+        if current is not None:
+            counts[key] = current + count
+            return
+        if len(counts) < self.capacity:
+            counts[key] = count
+            self._errors[key] = 0
+        else:
+            evicted, floor = self._pop_min()
+            del counts[evicted]
+            del self._errors[evicted]
+            counts[key] = floor + count
+            self._errors[key] = floor
+        self._seq += 1
+        heapq.heappush(self._heap, (counts[key], self._seq, key))
+
+    @property
+    def min_count(self) -> int:
+        """Верхняя граница частоты любого ключа, которого нет в скетче."""
+        if len(self._counts) < self.capacity:
+            return 0
+        return min(self._counts.values())
+
+    def estimate(self, key: Hashable) -> HeavyHitter:
+        count = self._counts.get(key)
+        if count is None:
+            floor = self.min_count
+            return HeavyHitter(key, floor, floor)
+        return HeavyHitter(key, count, self._errors[key])
+
+    def items(self) -> list[HeavyHitter]:
+        return [HeavyHitter(key, count, self._errors[key]) for key, count in self._counts.items()]
+
+    def top(self, n: int) -> list[HeavyHitter]:
+        return sorted(self.items(), key=lambda h: (-h.count, h.error))[:n]
+
+
+class SlidingTopK:
+    """Space-Saving за скользящее окно: кольцо из ``slices`` скетчей.
+
+    Событие попадает в скетч текущего отрезка окна (``window / slices``
+    секунд), устаревшие отрезки выбрасываются целиком, так что память —
+    не больше ``slices * capacity`` счётчиков при любом числе ключей.
+    Запрос складывает отрезки: если ключа в отрезке нет, к его ошибке
+    прибавляется ``min_count`` этого отрезка. Окно ступенчатое: захвачено
+    от ``window - window / slices`` до ``window`` секунд истории.
+    """
+
+    def __init__(self, capacity: int, *, window: float = 3600.0, slices: int = 6) -> None:
+        self.capacity = capacity
+        self.slices = max(1, slices)
+        self.slice_seconds = window / self.slices
+        self._ring: deque[tuple[int, SpaceSaving]] = deque()
+
+    def _expire(self, now: float) -> int:
+        current = int(now // self.slice_seconds)
+        while self._ring and self._ring[0][0] <= current - self.slices:
+            self._ring.popleft()
+        return current
+
+    def add(self, key: Hashable, count: int = 1, now: float | None = None) -> None:
+        current = self._expire(time.time() if now is None else now)
+        if not self._ring or self._ring[-1][0] != current:
+            self._ring.append((current, SpaceSaving(self.capacity)))
+        self._ring[-1][1].add(key, count)
+
+    @property
+    def total(self) -> int:
+        return sum(sketch.total for _, sketch in self._ring)
+
+    def __len__(self) -> int:
+        return sum(len(sketch) for _, sketch in self._ring)
+
+    def top(self, n: int, now: float | None = None) -> list[HeavyHitter]:
+        """Самые частые ключи окна с границами ошибки, по убыванию оценки."""
+        self._expire(time.time() if now is None else now)
+        # Снимок каждого отрезка: {key: HeavyHitter} и граница для отсутствующих ключей
+        slices = [({h.key: h for h in sketch.items()}, sketch.min_count) for _, sketch in self._ring]
+        keys = set()
+        for hitters, _ in slices:
+            keys.update(hitters)
+        merged = []
+        for key in keys:
+            count = error = 0
+            for hitters, floor in slices:
+                hitter = hitters.get(key)
+                if hitter is None:
+                    count += floor
+                    error += floor
+                else:
+                    count += hitter.count
+                    error += hitter.error
+            merged.append(HeavyHitter(key, count, error))
+        merged.sort(key=lambda h: (-h.count, h.error))
+        return merged[:n]
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import bisect
+import threading
+from functools import lru_cache
+from typing import Iterable, Sequence
+
+try:  # numpy приходит вместе с matplotlib; без него работает чистый bisect
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore[assignment]
+
+_INT64_MAX = 2**63 - 1
+
+
+class LevelCurve:
+    """Таблица накопленных порогов опыта для кривой «каждый уровень в ``multiplier`` раз дороже».
+
+    ``thresholds[k]`` — общий опыт, с которого начинается уровень ``k``.
+    Таблица растёт лениво, по мере того как встречаются большие XP/уровни;
+    поиск уровня — ``bisect`` вместо цикла по уровням.
+    """
+
+    def __init__(self, multiplier: float = 1.2, base: int = 100) -> None:
+        self.multiplier = multiplier
+        self.base = base
+        self._thresholds: list[int] = [0]
+        self._next_required = base
+        self._array = None  # кэш numpy-копии порогов для levels_for
+        # Таблицу может дорастить и поток aiosqlite (SQL-функция xp_level)
+        self._lock = threading.Lock()
+
+    def _grow(self) -> None:
+        self._thresholds.append(self._thresholds[-1] + self._next_required)
+        # Как в исходном цикле: int() после умножения; не меньше 1, чтобы не зациклиться
+        self._next_required = max(1, int(self._next_required * self.multiplier))
+        self._array = None
+
+    def _ensure_xp(self, xp: int) -> None:
+        if self._thresholds[-1] <= xp:
+            with self._lock:
+                while self._thresholds[-1] <= xp:
+                    self._grow()
+
+    def _ensure_level(self, level: int) -> None:
+        if len(self._thresholds) <= level:
+            with self._lock:
+                while len(self._thresholds) <= level:
+                    self._grow()
+
+    def _ensure_array(self) -> None:
+        if self._array is None:
+            # Пороги за пределами int64 не нужны: таких XP в массиве быть не может
+            count = bisect.bisect_right(self._thresholds, _INT64_MAX)
+            self._array = np.asarray(self._thresholds[:count], dtype=np.int64)
+
+    @property
+    def thresholds(self) -> Sequence[int]:
+        return self._thresholds
+
+    def level_for(self, xp: int) -> int:
+        """Уровень для общего опыта ``xp``."""
+        if xp <= 0:
+            return 0
+        self._ensure_xp(xp)
+        return bisect.bisect_right(self._thresholds, xp) - 1
+
+    def xp_for_level(self, level: int) -> int:
+        """Общий опыт, необходимый для достижения уровня."""
+        if level <= 0:
+            return 0
+        self._ensure_level(level)
+        return self._thresholds[level]
+
+    def xp_to_next(self, xp: int) -> int:
+        return self.xp_for_level(self.level_for(xp) + 1) - xp
+
+    def progress(self, xp: int) -> tuple[int, int, int]:
+        """(уровень, опыт внутри уровня, размер уровня) — всё для прогресс-бара за один поиск."""
+        level = self.level_for(xp)
+        start = self._thresholds[level]
+        self._ensure_level(level + 1)
+        return level, xp - start, self._thresholds[level + 1] - start
+
+    def levels_for(self, xps: Iterable[int]):
+        """Уровни для массива XP разом.
+
+        С numpy — один ``searchsorted`` по таблице порогов (возвращает
+        ``ndarray``), без него — ``bisect`` в цикле (возвращает ``list``).
+        """
+        if np is not None:
+            values = np.asarray(xps if isinstance(xps, (Sequence, np.ndarray)) else list(xps), dtype=np.int64)
+            if values.size:
+                self._ensure_xp(int(values.max()))
+            self._ensure_array()
+            return np.maximum(np.searchsorted(self._array, values, side="right") - 1, 0)
+        xps = list(xps)
+        if xps:
+            self._ensure_xp(max(xps))
+        thresholds = self._thresholds
+        return [max(0, bisect.bisect_right(thresholds, xp) - 1) for xp in xps]
+
+
+@lru_cache(maxsize=None)
+def curve_for(multiplier: float, base: int = 100) -> LevelCurve:
+    """Одна таблица на каждый множитель: строится при первом обращении."""
+    return LevelCurve(multiplier, base)
@@ -0,0 +1,281 @@
+"""Потоковый импорт/экспорт опыта (user_levels) в CSV и JSONL.
+
+Файлы читаются и пишутся построчно, в памяти — не больше одной пачки.
+Офлайн-запуск, пока бот остановлен (или на копии базы):
+
+    python -m src.utils.levels_io export --db ./src/data/amadeus.db --guild 123 levels.csv.gz
+    python -m src.utils.levels_io import --db ./src/data/amadeus.db --guild 123 --mode max mee6.csv
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import IO, TYPE_CHECKING, Iterator
+
+from .leveling import curve_for
+
+if TYPE_CHECKING:
+    from .db import Database
+
+log = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+IMPORT_MODES = ("replace", "add", "max")
+EXPORT_COLUMNS = ("user_id", "xp", "level", "last_message_time")
+# INTEGER в SQLite (и int64 у numpy в LevelCurve) — больше не влезает
+_MAX_INT64 = 2**63 - 1
+
+# Названия колонок в выгрузках других ботов (после _normalize)
+_USER_ID_ALIASES = ("userid", "id", "user", "memberid", "discordid")
+_XP_ALIASES = ("xp", "totalxp", "experience", "exp", "points")
+
+# Одно выражение на все режимы: при конфликте меняется только формула XP
+_IMPORT_SQL = """
+    INSERT INTO user_levels (guild_id, user_id, xp, level, last_message_time)
+    VALUES (?, ?, ?, ?, NULL)
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET
+        xp = {xp},
+        level = {level}
+"""
+_CONFLICT_XP = {
+    "replace": ("excluded.xp", "excluded.level"),
+    "add": ("xp + excluded.xp", "xp_level(xp + excluded.xp)"),
+    "max": ("max(xp, excluded.xp)", "xp_level(max(xp, excluded.xp))"),
+}
+
+
+@dataclass
+class TransferReport:
+    rows: int = 0
+    skipped: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+
+    @property
+    def rows_per_s(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def detect_format(filename: str) -> str:
+    """Формат по расширению (``.gz`` допускается поверх любого)."""
+    name = filename.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    raise ValueError(f"unsupported file type {filename!r}, expected .csv or .jsonl")
+
+
+def open_text(path: str, mode: str) -> IO[str]:
+    """Текстовый файл; ``*.gz`` прозрачно сжимается/распаковывается."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def _pick(record: dict, aliases: tuple[str, ...]):
+    for alias in aliases:
+        if alias in record:
+            return record[alias]
+    return None
+
+
+def _records(stream: IO[str], fmt: str) -> Iterator[dict | None]:
+    """Записи файла с нормализованными ключами; None — нечитаемая строка."""
+    if fmt == "csv":
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if header is None:
+            return
+        keys = [_normalize(name) for name in header]
+        for row in reader:
+            if row:
+                yield dict(zip(keys, row))
+    elif fmt == "jsonl":
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield {_normalize(k): v for k, v in record.items()} if isinstance(record, dict) else None
+    else:
+        raise ValueError(f"unknown format {fmt!r}")
+
+
+def iter_xp_rows(stream: IO[str], fmt: str, report: TransferReport) -> Iterator[tuple[int, int]]:
+    """Пары (user_id, xp); строки без id, с отрицательным/нечисловым XP или вне int64 пропускаются."""
+    for record in _records(stream, fmt):
+        try:
+            user_id = int(_pick(record, _USER_ID_ALIASES))  # type: ignore[arg-type]
+            xp = int(float(_pick(record, _XP_ALIASES)))  # type: ignore[arg-type]
+        except (TypeError, ValueError, OverflowError):
+            report.skipped += 1
+            continue
+        if not 0 < user_id <= _MAX_INT64 or not 0 <= xp <= _MAX_INT64:
+            report.skipped += 1
+            continue
+        yield user_id, xp
+
+
+def _next_batch(rows: Iterator[tuple[int, int]], size: int) -> list[tuple[int, int]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+async def import_levels(
+    db: Database,
+    guild_id: int,
+    stream: IO[str],
+    fmt: str,
+    *,
+    mode: str = "replace",
+    multiplier: float = 1.2,
+    batch_size: int = 20_000,
+) -> TransferReport:
+    """Заливает опыт из ``stream`` в user_levels сервера.
+
+    ``replace`` — XP из файла заменяет текущий, ``add`` — прибавляется,
+    ``max`` — остаётся больший. Уровень считается по той же таблице
+    порогов, что и у Levels (``curve_for(multiplier)``): для новых строк
+    пачкой в Python, при конфликте — SQL-функцией ``xp_level``. Каждая
+    пачка — одна транзакция; чтение файла идёт в потоке.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"unknown import mode {mode!r}, expected one of {IMPORT_MODES}")
+    curve = curve_for(multiplier)
+    await db.create_function("xp_level", 1, curve.level_for)
+    xp_sql, level_sql = _CONFLICT_XP[mode]
+    sql = _IMPORT_SQL.format(xp=xp_sql, level=level_sql)
+
+    report = TransferReport()
+    rows = iter_xp_rows(stream, fmt, report)
+    started = time.perf_counter()
+    while True:
+        batch = await asyncio.to_thread(_next_batch, rows, batch_size)
+        if not batch:
+            break
+        levels = curve.levels_for([xp for _, xp in batch])
+        async with db.transaction() as tx:
+            await tx.exec_many(
+                sql, [(guild_id, user_id, xp, int(level)) for (user_id, xp), level in zip(batch, levels)]
+            )
+        report.rows += len(batch)
+        report.batches += 1
+    report.seconds = time.perf_counter() - started
+    log.info(
+        "Imported %d XP rows into guild %s (%s, %d skipped) in %.2fs, %.0f rows/s",
+        report.rows, guild_id, mode, report.skipped, report.seconds, report.rows_per_s,
+    )
+    return report
+
+
+def _write_rows(writer, stream: IO[str], fmt: str, rows: list[tuple]) -> None:
+    if fmt == "csv":
+        writer.writerows(rows)
+    else:
+        for user_id, xp, level, last in rows:
+            # id строкой: в JSON большие целые теряют точность у JS-потребителей
+            stream.write(json.dumps(
+                {"user_id": str(user_id), "xp": xp, "level": level, "last_message_time": last}
+            ) + "\n")
+
+
+async def export_levels(
+    db: Database,
+    guild_id: int,
+    stream: IO[str],
+    fmt: str,
+    *,
+    batch_size: int = 20_000,
+) -> TransferReport:
+    """Выгружает user_levels сервера в ``stream`` в порядке user_id (по первичному ключу)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    report = TransferReport()
+    writer = csv.writer(stream) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(EXPORT_COLUMNS)
+    started = time.perf_counter()
+    batch: list[tuple] = []
+    async for row in db.iterate(
+        "SELECT user_id, xp, level, last_message_time FROM user_levels WHERE guild_id = ? ORDER BY user_id",
+        guild_id, chunk_size=5000,
+    ):
+        batch.append(tuple(row))
+        if len(batch) >= batch_size:
+            await asyncio.to_thread(_write_rows, writer, stream, fmt, batch)
+            report.rows += len(batch)
+            report.batches += 1
+            batch = []
+    if batch:
+        await asyncio.to_thread(_write_rows, writer, stream, fmt, batch)
+        report.rows += len(batch)
+        report.batches += 1
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+async def _cli(args: argparse.Namespace) -> TransferReport:
+    from .db import Database
+
+    fmt = args.format or detect_format(args.file)
+    db = Database(args.db, slow_query_ms=0)  # пачки по 20k строк всегда «медленные»
+    await db.connect()
+    try:
+        await db.init_schema()
+        if args.command == "import":
+            with open_text(args.file, "r") as f:
+                return await import_levels(
+                    db, args.guild, f, fmt, mode=args.mode, multiplier=args.multiplier, batch_size=args.batch_size
+                )
+        with open_text(args.file, "w") as f:
+            report = await export_levels(db, args.guild, f, fmt, batch_size=args.batch_size)
+        report.bytes = os.path.getsize(args.file)
+        return report
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Импорт/экспорт опыта user_levels (CSV/JSONL, можно .gz)")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("file")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "./src/data/amadeus.db"))
+    parser.add_argument("--guild", type=int, required=True)
+    parser.add_argument("--format", choices=FORMATS, help="по умолчанию — по расширению файла")
+    parser.add_argument("--mode", choices=IMPORT_MODES, default="replace")
+    parser.add_argument("--multiplier", type=float, default=1.2, help="как Levels.level_multiplier")
+    parser.add_argument("--batch-size", type=int, default=20_000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    report = asyncio.run(_cli(args))
+    print(
+        f"{args.command}: {report.rows} rows, {report.skipped} skipped, {report.batches} batches, "
+        f"{report.seconds:.2f}s, {report.rows_per_s:,.0f} rows/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+if TYPE_CHECKING:
+    from .db import Database, Transaction
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MigrationContext:
+    """Параметры окружения, нужные отдельным миграциям."""
+
+    # Сервер, которому принадлежат строки, созданные до разделения по guild_id
+    # (0 — неизвестен, см. adopt_legacy_rows)
+    legacy_guild_id: int = 0
+
+
+@dataclass(frozen=True)
+class Migration:
+    """Шаг схемы. Номер версии пишется в ``PRAGMA user_version`` после применения."""
+
+    version: int
+    name: str
+    statements: tuple[str, ...] = ()
+    apply: Callable[[Transaction, MigrationContext], Awaitable[None]] | None = None
+
+
+async def _add_welcome_description(tx: Transaction, ctx: MigrationContext) -> None:
+    """Старые базы создавались без колонки welcome_channels.description"""
+    columns = [row[1] for row in await tx.fetchall("PRAGMA table_info(welcome_channels)")]
+    if "description" not in columns:
+        await tx.exec("ALTER TABLE welcome_channels ADD COLUMN description TEXT NOT NULL DEFAULT ''")
+
+
+# Таблицы с составным ключом (guild_id, ...): новая схема и старые колонки
+_GUILD_SCOPED_SCHEMA: dict[str, tuple[str, tuple[str, ...]]] = {
+    "warns": ("""
+        CREATE TABLE warns__new (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    """, ("user_id", "count")),
+    "tickets": ("""
+        CREATE TABLE tickets__new (
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            owner_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (guild_id, channel_id)
+        ) WITHOUT ROWID
+    """, ("channel_id", "owner_id", "created_at")),
+    "message_stats": ("""
+        CREATE TABLE message_stats__new (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    """, ("user_id", "count")),
+    "settings": ("""
+        CREATE TABLE settings__new (
+            guild_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (guild_id, key)
+        ) WITHOUT ROWID
+    """, ("key", "value")),
+    "reaction_roles": ("""
+        CREATE TABLE reaction_roles__new (
+            guild_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            emoji TEXT NOT NULL,
+            role_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, message_id, emoji)
+        ) WITHOUT ROWID
+    """, ("message_id", "emoji", "role_id")),
+    "user_levels": ("""
+        CREATE TABLE user_levels__new (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            xp INTEGER NOT NULL DEFAULT 0,
+            level INTEGER NOT NULL DEFAULT 0,
+            last_message_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    """, ("user_id", "xp", "level", "last_message_time")),
+    "level_rewards": ("""
+        CREATE TABLE level_rewards__new (
+            guild_id INTEGER NOT NULL,
+            level INTEGER NOT NULL,
+            role_id INTEGER NOT NULL,
+            role_name TEXT NOT NULL,
+            PRIMARY KEY (guild_id, level)
+        ) WITHOUT ROWID
+    """, ("level", "role_id", "role_name")),
+    "welcome_channels": ("""
+        CREATE TABLE welcome_channels__new (
+            guild_id INTEGER NOT NULL,
+            channel_type TEXT NOT NULL,
+            channel_id INTEGER NOT NULL,
+            channel_name TEXT NOT NULL,
+            description TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (guild_id, channel_type)
+        ) WITHOUT ROWID
+    """, ("channel_type", "channel_id", "channel_name", "description")),
+    "voice_settings": ("""
+        CREATE TABLE voice_settings__new (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_name TEXT NOT NULL DEFAULT '',
+            user_limit INTEGER NOT NULL DEFAULT 0,
+            is_locked BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    """, ("user_id", "channel_name", "user_limit", "is_locked")),
+}
+
+# Все таблицы, в которых есть guild_id
+GUILD_SCOPED_TABLES: tuple[str, ...] = (*_GUILD_SCOPED_SCHEMA, "moderation_logs")
+
+
+async def _partition_by_guild(tx: Transaction, ctx: MigrationContext) -> None:
+    """Пересоздаёт таблицы с ключом (guild_id, ...), перенося старые строки"""
+    for table, (create_sql, columns) in _GUILD_SCOPED_SCHEMA.items():
+        cols = ", ".join(columns)
+        await tx.exec(create_sql)
+        await tx.exec(
+            f"INSERT INTO {table}__new (guild_id, {cols}) SELECT ?, {cols} FROM {table}",
+            ctx.legacy_guild_id,
+        )
+        await tx.exec(f"DROP TABLE {table}")
+        await tx.exec(f"ALTER TABLE {table}__new RENAME TO {table}")
+    # moderation_logs остаётся rowid-таблицей (AUTOINCREMENT), достаточно колонки
+    await tx.exec("ALTER TABLE moderation_logs ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0")
+    await tx.exec("UPDATE moderation_logs SET guild_id = ?", ctx.legacy_guild_id)
+    await tx.exec("DROP INDEX IF EXISTS idx_moderation_logs_target")
+    # Покрывающие индексы для горячих запросов
+    for statement in (
+        # /leaderboard: WHERE guild_id=? ORDER BY xp DESC — без обращения к таблице
+        "CREATE INDEX idx_user_levels_rank ON user_levels(guild_id, xp DESC, user_id, level)",
+        # TicketButton: WHERE guild_id=? AND owner_id=?
+        "CREATE INDEX idx_tickets_owner ON tickets(guild_id, owner_id)",
+        "CREATE INDEX idx_moderation_logs_target ON moderation_logs(guild_id, target_id, created_at)",
+        "CREATE INDEX idx_moderation_logs_created ON moderation_logs(created_at)",
+    ):
+        await tx.exec(statement)
+
+
+async def adopt_legacy_rows(db: Database, guild_id: int) -> int:
+    """Передаёт строки без сервера (guild_id = 0) указанному серверу.
+
+    Нужна, если база мигрировала без GUILD_ID: бот, работающий на одном
+    сервере, забирает старые данные себе при первом on_ready.
+    """
+    moved = 0
+    async with db.transaction() as tx:
+        for table in GUILD_SCOPED_TABLES:
+            row = await tx.fetchone(f"SELECT COUNT(*) FROM {table} WHERE guild_id = 0")
+            if not row or not row[0]:
+                continue
+            # OR IGNORE: если у сервера уже есть строка с тем же ключом, она главнее
+            await tx.exec(f"UPDATE OR IGNORE {table} SET guild_id = ? WHERE guild_id = 0", guild_id)
+            moved += row[0]
+    if moved:
+        log.info("Adopted %d legacy rows into guild %s", moved, guild_id)
+    return moved
+
+
+# Только добавлять в конец. Новый индекс или колонка = новая Migration
+# со следующим номером; руками базу не трогаем.
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(1, "baseline schema", (
+        """
+        CREATE TABLE IF NOT EXISTS warns (
+            user_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS moderation_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT NOT NULL,
+            target_id INTEGER NOT NULL,
+            moderator_id INTEGER NOT NULL,
+            reason TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            channel_id INTEGER PRIMARY KEY,
+            owner_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS message_stats (
+            user_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS reaction_roles (
+            message_id INTEGER NOT NULL,
+            emoji TEXT NOT NULL,
+            role_id INTEGER NOT NULL,
+            PRIMARY KEY (message_id, emoji)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_levels (
+            user_id INTEGER PRIMARY KEY,
+            xp INTEGER NOT NULL DEFAULT 0,
+            level INTEGER NOT NULL DEFAULT 0,
+            last_message_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS level_rewards (
+            level INTEGER PRIMARY KEY,
+            role_id INTEGER NOT NULL,
+            role_name TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS welcome_channels (
+            channel_type TEXT PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            channel_name TEXT NOT NULL,
+            description TEXT NOT NULL DEFAULT ''
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS voice_settings (
+            user_id INTEGER PRIMARY KEY,
+            channel_name TEXT NOT NULL DEFAULT '',
+            user_limit INTEGER NOT NULL DEFAULT 0,
+            is_locked BOOLEAN NOT NULL DEFAULT FALSE
+        )
+        """,
+    )),
+    Migration(2, "welcome_channels.description", apply=_add_welcome_description),
+    Migration(3, "indexes for hot queries", (
+        # TicketButton: SELECT channel_id FROM tickets WHERE owner_id=?
+        "CREATE INDEX IF NOT EXISTS idx_tickets_owner ON tickets(owner_id)",
+        # /leaderboard: ORDER BY xp DESC LIMIT ?
+        "CREATE INDEX IF NOT EXISTS idx_user_levels_xp ON user_levels(xp DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_moderation_logs_target ON moderation_logs(target_id, created_at)",
+    )),
+    Migration(4, "partition tables by guild_id", apply=_partition_by_guild),
+    Migration(5, "user_levels.in_guild", (
+        # 0 — участник ушёл с сервера: его строка не попадает в рейтинг
+        "ALTER TABLE user_levels ADD COLUMN in_guild INTEGER NOT NULL DEFAULT 1",
+        # /leaderboard: keyset-страницы по (xp DESC, user_id) только среди участников
+        "CREATE INDEX idx_user_levels_board ON user_levels(guild_id, xp DESC, user_id, level) WHERE in_guild = 1",
+        # Заменён частичным индексом выше: запросов с ушедшими участниками больше нет
+        "DROP INDEX IF EXISTS idx_user_levels_rank",
+    )),
+    Migration(6, "reward_sync_progress", (
+        # Курсор /rewards-sync: прерванный прогон продолжается с last_user_id
+        """
+        CREATE TABLE reward_sync_progress (
+            guild_id INTEGER PRIMARY KEY,
+            rewards_digest TEXT NOT NULL,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            scanned INTEGER NOT NULL DEFAULT 0,
+            updated INTEGER NOT NULL DEFAULT 0,
+            unchanged INTEGER NOT NULL DEFAULT 0,
+            missing INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+    )),
+    Migration(7, "activity buckets", (
+        # Сообщения по часам и по суткам; первичный ключ ведёт по (guild_id, время),
+        # так что выборка за любое окно — диапазон по ключу
+        """
+        CREATE TABLE activity_hourly (
+            guild_id INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, hour, channel_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE activity_daily (
+            guild_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, day, channel_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE activity_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """,
+    )),
+    Migration(8, "guild activity buckets", (
+        # Счётчики сервера целиком по часам — источник /stats-chart
+        """
+        CREATE TABLE guild_activity_hourly (
+            guild_id INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            joins INTEGER NOT NULL DEFAULT 0,
+            leaves INTEGER NOT NULL DEFAULT 0,
+            voice_seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, hour)
+        ) WITHOUT ROWID
+        """,
+    )),
+    Migration(9, "voice sessions", (
+        # Журнал законченных сессий, итоги по (участник, канал) и открытые сессии
+        """
+        CREATE TABLE voice_sessions (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            started_at INTEGER NOT NULL,
+            ended_at INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_voice_sessions_user ON voice_sessions(guild_id, user_id, started_at)",
+        "CREATE INDEX idx_voice_sessions_ended ON voice_sessions(ended_at)",
+        """
+        CREATE TABLE voice_totals (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            seconds INTEGER NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, channel_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX idx_voice_totals_channel ON voice_totals(guild_id, channel_id, seconds)",
+        """
+        CREATE TABLE voice_open (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            started_at INTEGER NOT NULL,
+            credited_until INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+        """,
+    )),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def migrate(db: Database, ctx: MigrationContext | None = None) -> list[tuple[Migration, float]]:
+    """Применяет недостающие миграции, каждую в своей транзакции.
+
+    Если схема актуальна, стоит ровно одного чтения ``PRAGMA user_version``.
+    Возвращает применённые миграции с длительностью в миллисекундах.
+    """
+    ctx = ctx or MigrationContext()
+    row = await db.fetchone("PRAGMA user_version")
+    current = row[0] if row else 0
+    if current >= LATEST_VERSION:
+        return []
+
+    applied: list[tuple[Migration, float]] = []
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        started = time.perf_counter()
+        try:
+            async with db.transaction() as tx:
+                for statement in migration.statements:
+                    await tx.exec(statement)
+                if migration.apply is not None:
+                    await migration.apply(tx, ctx)
+                await tx.exec(f"PRAGMA user_version = {int(migration.version)}")
+        except Exception:
+            log.exception("Migration %03d (%s) failed, schema stays at version %d", migration.version, migration.name, current)
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        current = migration.version
+        applied.append((migration, elapsed_ms))
+        log.info("Migration %03d (%s) applied in %.1f ms", migration.version, migration.name, elapsed_ms)
+    return applied
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from .query_stats import LATENCY_BUCKETS_MS, histogram_percentile
+
+if TYPE_CHECKING:
+    import discord
+
+log = logging.getLogger(__name__)
+
+# Порядок стадий: сначала фильтры, которые могут удалить сообщение, потом учёт
+ORDER_SECURITY = 100
+ORDER_STATS = 200
+ORDER_LEVELS = 300
+
+
+@dataclass
+class MessageContext:
+    """Сообщение, разобранное один раз для всех стадий."""
+
+    message: discord.Message
+    guild: discord.Guild
+    author: discord.Member
+    guild_id: int
+    channel_id: int
+    author_id: int
+    content: str  # в нижнем регистре
+    timestamp: float
+    # Данные, которыми стадии делятся между собой
+    state: dict[str, Any] = field(default_factory=dict)
+    stopped_by: str | None = None
+    reason: str | None = None
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> MessageContext | None:
+        """None — сообщение не для конвейера (ЛС или бот)."""
+        guild = message.guild
+        if guild is None or message.author.bot:
+            return None
+        created = getattr(message, "created_at", None)
+        return cls(
+            message=message,
+            guild=guild,
+            author=message.author,  # type: ignore[arg-type]
+            guild_id=guild.id,
+            channel_id=message.channel.id,
+            author_id=message.author.id,
+            content=(message.content or "").lower(),
+            timestamp=created.timestamp() if created is not None else time.time(),
+        )
+
+    def stop(self, reason: str) -> None:
+        """Дальнейшие стадии сообщение не увидят (например, оно удалено как спам)."""
+        self.reason = reason
+
+    @property
+    def stopped(self) -> bool:
+        return self.stopped_by is not None
+
+
+Stage = Callable[[MessageContext], Awaitable[None]]
+
+
+@dataclass
+class StageStats:
+    name: str
+    order: int
+    calls: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    stops: int = 0
+    errors: int = 0
+    buckets: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.calls if self.calls else 0.0
+
+    def percentile(self, q: float) -> float:
+        return histogram_percentile(self.buckets, self.calls, self.max_ms, q)
+
+
+class MessagePipeline:
+    """Упорядоченные стадии обработки сообщений сервера.
+
+    Вместо отдельных слушателей ``on_message`` в каждом cog'е: сообщение
+    разбирается в ``MessageContext`` один раз, стадии идут по возрастанию
+    ``order``, и стадия, вызвавшая ``ctx.stop()``, обрывает цепочку —
+    удалённый как спам текст не попадает ни в статистику, ни в опыт.
+    Ошибка стадии логируется и цепочку не обрывает. Время каждой стадии
+    копится в ``StageStats``.
+    """
+
+    def __init__(self) -> None:
+        self._stages: list[tuple[int, str, Stage]] = []
+        self._stats: dict[str, StageStats] = {}
+        self.messages = 0
+        self.stopped = 0
+
+    def register(self, name: str, stage: Stage, *, order: int) -> None:
+        """Добавляет стадию; стадия с тем же именем заменяется (перезагрузка cog'а)."""
+        self.unregister(name)
+        self._stages.append((order, name, stage))
+        self._stages.sort(key=lambda item: (item[0], item[1]))
+        stats = self._stats.get(name)
+        if stats is None:
+            self._stats[name] = StageStats(name, order)
+        else:
+            stats.order = order
+
+    def unregister(self, name: str) -> None:
+        self._stages = [item for item in self._stages if item[1] != name]
+
+    @property
+    def stages(self) -> list[str]:
+        return [name for _, name, _ in self._stages]
+
+    async def process(self, message: discord.Message) -> MessageContext | None:
+        ctx = MessageContext.from_message(message)
+        if ctx is None:
+            return None
+        self.messages += 1
+        for _, name, stage in tuple(self._stages):
+            stats = self._stats[name]
+            started = time.perf_counter()
+            try:
+                await stage(ctx)
+            except Exception:
+                stats.errors += 1
+                log.exception("Message pipeline stage %s failed", name)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            if elapsed_ms > stats.max_ms:
+                stats.max_ms = elapsed_ms
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            if ctx.reason is not None:
+                ctx.stopped_by = name
+                stats.stops += 1
+                self.stopped += 1
+                break
+        return ctx
+
+    def stats(self) -> list[StageStats]:
+        """Статистика зарегистрированных стадий в порядке выполнения."""
+        return [self._stats[name] for _, name, _ in self._stages]
+
+    def reset(self) -> None:
+        self.messages = self.stopped = 0
+        for name, stats in list(self._stats.items()):
+            self._stats[name] = StageStats(name, stats.order)
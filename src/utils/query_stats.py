@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import bisect
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+# Верхние границы корзин гистограммы латентности, мс (последняя — всё остальное)
+LATENCY_BUCKETS_MS: tuple[float, ...] = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(query: str) -> str:
+    """Ключ статистики: литералы заменены на ?, пробелы схлопнуты."""
+    text = _STRING_RE.sub("?", query)
+    text = _NUMBER_RE.sub("?", text)
+    return _SPACE_RE.sub(" ", text).strip().rstrip(";")
+
+
+def histogram_percentile(buckets: list[int], calls: int, max_ms: float, q: float) -> float:
+    """Оценка перцентиля по гистограмме ``LATENCY_BUCKETS_MS`` (верхняя граница корзины)."""
+    if not calls:
+        return 0.0
+    target = q * calls
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else max_ms
+    return max_ms
+
+
+@dataclass
+class StatementStats:
+    sql: str
+    calls: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    rows: int = 0
+    buckets: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.calls if self.calls else 0.0
+
+    def percentile(self, q: float) -> float:
+        return histogram_percentile(self.buckets, self.calls, self.max_ms, q)
+
+
+class QueryMetrics:
+    """Латентность, число вызовов и строк по нормализованному тексту SQL."""
+
+    def __init__(self, slow_query_ms: float = 100.0) -> None:
+        self.slow_query_ms = slow_query_ms
+        self._stats: dict[str, StatementStats] = {}
+
+    def record(self, query: str, elapsed_ms: float, rows: int = 0) -> bool:
+        """Учитывает выполнение запроса; True, если он медленнее порога."""
+        key = normalize_sql(query)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = StatementStats(key)
+        stats.calls += 1
+        stats.total_ms += elapsed_ms
+        stats.rows += max(rows, 0)
+        if elapsed_ms > stats.max_ms:
+            stats.max_ms = elapsed_ms
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        return 0 < self.slow_query_ms <= elapsed_ms
+
+    def top(self, n: int = 10, by: str = "total_ms") -> list[StatementStats]:
+        return sorted(self._stats.values(), key=lambda s: getattr(s, by), reverse=True)[:n]
+
+    @property
+    def total_calls(self) -> int:
+        return sum(s.calls for s in self._stats.values())
+
+    def reset(self) -> None:
+        self._stats.clear()
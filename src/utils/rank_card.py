@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import io
+import logging
+from dataclasses import dataclass
+
+from .render_pool import PooledRenderer
+
+log = logging.getLogger(__name__)
+
+# Размер карточки в пикселях (figsize * dpi)
+CARD_WIDTH = 900
+CARD_HEIGHT = 270
+_DPI = 100
+
+_BACKGROUND = "#23272a"
+_TRACK = "#3a3e44"
+_ACCENT = "#5865f2"
+_TEXT = "#ffffff"
+_MUTED = "#b9bbbe"
+
+
+@dataclass(frozen=True)
+class RankCard:
+    """Всё, что нужно нарисовать карточку; передаётся в процесс-воркер целиком."""
+
+    name: str
+    level: int
+    xp: int
+    into: int  # опыт внутри уровня
+    span: int  # размер уровня
+    rank: int | None = None
+    total: int = 0
+    avatar: bytes | None = None  # PNG
+
+
+def render_rank_card(card: RankCard) -> bytes:
+    """Рисует карточку и возвращает PNG. Выполняется в процессе-воркере."""
+    import warnings
+
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    from matplotlib.image import imread
+    from matplotlib.patches import Circle, Wedge
+
+    # Глифов эмодзи в DejaVu нет — это не повод засорять лог
+    warnings.filterwarnings("ignore", message="Glyph .* missing")
+
+    fig = Figure(figsize=(CARD_WIDTH / _DPI, CARD_HEIGHT / _DPI), dpi=_DPI, facecolor=_BACKGROUND)
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_xlim(0, CARD_WIDTH)
+    ax.set_ylim(0, CARD_HEIGHT)
+    ax.set_aspect("equal")
+    ax.axis("off")
+
+    cx, cy, radius = 135, CARD_HEIGHT / 2, 95
+    fraction = min(1.0, card.into / card.span) if card.span > 0 else 1.0
+    # Кольцо прогресса вокруг аватара: по часовой стрелке от «12 часов»
+    ax.add_patch(Wedge((cx, cy), radius + 16, 0, 360, width=10, color=_TRACK))
+    if fraction > 0:
+        ax.add_patch(Wedge((cx, cy), radius + 16, 90 - 360 * fraction, 90, width=10, color=_ACCENT))
+
+    clip = Circle((cx, cy), radius, transform=ax.transData)
+    if card.avatar:
+        try:
+            image = imread(io.BytesIO(card.avatar), format="png")
+            ax.imshow(image, extent=(cx - radius, cx + radius, cy - radius, cy + radius), clip_path=clip, zorder=2)
+        except Exception:
+            ax.add_patch(Circle((cx, cy), radius, color=_TRACK))
+    else:
+        ax.add_patch(Circle((cx, cy), radius, color=_TRACK))
+
+    left = 280
+    name = card.name if len(card.name) <= 24 else card.name[:23] + "…"
+    ax.text(left, 195, name, color=_TEXT, fontsize=26, fontweight="bold", va="center")
+    ax.text(left, 135, f"Уровень {card.level}", color=_TEXT, fontsize=20, va="center")
+    if card.rank:
+        ax.text(CARD_WIDTH - 40, 195, f"#{card.rank}", color=_ACCENT, fontsize=30, fontweight="bold", ha="right", va="center")
+        ax.text(CARD_WIDTH - 40, 150, f"из {card.total:,}", color=_MUTED, fontsize=13, ha="right", va="center")
+    ax.text(left, 75, f"{card.into:,} / {card.span:,} XP", color=_MUTED, fontsize=15, va="center")
+    ax.text(CARD_WIDTH - 40, 75, f"{fraction:.0%}", color=_MUTED, fontsize=15, ha="right", va="center")
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", facecolor=_BACKGROUND)
+    return buffer.getvalue()
+
+
+def _warm_up() -> None:
+    # Импорт matplotlib и шрифтов — самое дорогое в первом рендере
+    render_rank_card(RankCard("warm-up", 0, 0, 0, 1))
+
+
+class RankCardRenderer(PooledRenderer):
+    """Рендер карточек в пуле процессов с LRU-кэшем готовых PNG.
+
+    Кэш ограничен суммарным размером PNG; ключ —
+    ``(user_id, level, xp // xp_bucket, avatar_hash)``, так что карточка
+    перерисовывается, когда опыт ушёл дальше корзины, сменился уровень или
+    аватар.
+    """
+
+    def __init__(self, *, workers: int = 1, cache_bytes: int = 16 * 1024 * 1024, xp_bucket: int = 50) -> None:
+        super().__init__(workers=workers, max_bytes=cache_bytes)
+        self.xp_bucket = max(1, xp_bucket)
+
+    def key(self, user_id: int, level: int, xp: int, avatar_hash: str | None) -> tuple:
+        return (user_id, level, xp // self.xp_bucket, avatar_hash)
+
+    async def warm_up(self) -> None:
+        """Поднимает воркеры заранее, чтобы первый /lvl не ждал импорта matplotlib."""
+        await self._run_all(_warm_up)
+
+    async def render(self, key: tuple, card: RankCard) -> bytes:
+        """PNG карточки: из кэша или свежий рендер в пуле."""
+        return await self._render(key, render_rank_card, card)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+from typing import TYPE_CHECKING, Callable, Iterable
+
+if TYPE_CHECKING:
+    from .db import Database
+
+
+class GuildRanking:
+    """Рейтинг одного сервера: отсортированный массив ключей ``(-xp, user_id)``.
+
+    Поиск места и начала страницы — ``bisect`` за O(log n); обновление XP — удаление
+    и вставка в массив (сдвиг памяти в C, для десятков тысяч записей это
+    микросекунды). При равном XP выше тот, у кого меньше user_id — так же,
+    как ``ORDER BY xp DESC, user_id`` в SQL.
+    """
+
+    def __init__(self, rows: Iterable[tuple[int, int]] = ()) -> None:
+        self._xp: dict[int, int] = {user_id: xp for user_id, xp in rows}
+        self._keys: list[tuple[int, int]] = sorted((-xp, user_id) for user_id, xp in self._xp.items())
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._xp
+
+    def xp(self, user_id: int) -> int | None:
+        return self._xp.get(user_id)
+
+    def update(self, user_id: int, xp: int) -> None:
+        old = self._xp.get(user_id)
+        if old == xp:
+            return
+        keys = self._keys
+        if old is not None:
+            del keys[bisect.bisect_left(keys, (-old, user_id))]
+        bisect.insort(keys, (-xp, user_id))
+        self._xp[user_id] = xp
+
+    def remove(self, user_id: int) -> None:
+        old = self._xp.pop(user_id, None)
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, user_id))]
+
+    def rank(self, user_id: int) -> int | None:
+        """Место пользователя (с 1) или None, если его нет в рейтинге."""
+        xp = self._xp.get(user_id)
+        if xp is None:
+            return None
+        return bisect.bisect_left(self._keys, (-xp, user_id)) + 1
+
+    def after(self, cursor: tuple[int, int] | None, n: int) -> list[tuple[int, int]]:
+        """``n`` записей ``(user_id, xp)`` строго ниже курсора ``(xp, user_id)``; None — с первого места."""
+        start = 0 if cursor is None else bisect.bisect_right(self._keys, (-cursor[0], cursor[1]))
+        return [(user_id, -neg_xp) for neg_xp, user_id in self._keys[start:start + n]]
+
+
+class RankingIndex:
+    """Рейтинги серверов в памяти; каждый загружается из БД при первом обращении.
+
+    Дальше его держит в актуальном состоянии код начисления опыта через
+    ``update``; обращения к рейтингу в SQLite не ходят.
+    """
+
+    def __init__(self, db: Database) -> None:
+        self._db = db
+        self._guilds: dict[int, GuildRanking] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        # Изменения, пришедшие во время загрузки рейтинга: чтение могло их не застать
+        self._loading: dict[int, dict[int, int | None]] = {}
+
+    async def guild(
+        self,
+        guild_id: int,
+        overlay: Callable[[], Iterable[tuple[int, int]]] | None = None,
+    ) -> GuildRanking:
+        """Рейтинг сервера. ``overlay`` — свежие XP, которых ещё нет в БД
+        (буфер начислений); применяется один раз, сразу после загрузки."""
+        ranking = self._guilds.get(guild_id)
+        if ranking is not None:
+            return ranking
+        lock = self._locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            ranking = self._guilds.get(guild_id)
+            if ranking is None:
+                rows = []
+                changes = self._loading[guild_id] = {}
+                try:
+                    # Покрывающий частичный индекс idx_user_levels_board: только участники
+                    async for row in self._db.iterate(
+                        "SELECT user_id, xp FROM user_levels WHERE guild_id = ? AND in_guild = 1",
+                        guild_id, chunk_size=5000,
+                    ):
+                        rows.append(row)
+                finally:
+                    del self._loading[guild_id]
+                ranking = GuildRanking(rows)
+                for user_id, xp in overlay() if overlay is not None else ():
+                    ranking.update(user_id, xp)
+                for user_id, xp in changes.items():
+                    if xp is None:
+                        ranking.remove(user_id)
+                    else:
+                        ranking.update(user_id, xp)
+                self._guilds[guild_id] = ranking
+        return ranking
+
+    def update(self, guild_id: int, user_id: int, xp: int) -> None:
+        """Новое значение XP; незагруженные рейтинги не трогаем — они прочитают его из БД."""
+        ranking = self._guilds.get(guild_id)
+        if ranking is not None:
+            ranking.update(user_id, xp)
+        elif guild_id in self._loading:
+            self._loading[guild_id][user_id] = xp
+
+    def remove(self, guild_id: int, user_id: int) -> None:
+        ranking = self._guilds.get(guild_id)
+        if ranking is not None:
+            ranking.remove(user_id)
+        elif guild_id in self._loading:
+            self._loading[guild_id][user_id] = None
+
+    def invalidate(self, guild_id: int | None = None) -> None:
+        """Сбрасывает рейтинг (после массового изменения user_levels в обход cog'а)."""
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+
+class PooledRenderer:
+    """Рендер PNG в пуле процессов с LRU-кэшем готовых картинок.
+
+    Растеризация идёт в отдельных процессах, event loop её не ждёт и GIL
+    не делит. Кэш ограничен числом записей и (или) суммарным размером PNG;
+    у записи может быть срок годности ``expires_at``. Одновременные запросы
+    одного ключа ждут один рендер. Наследники задают функцию рендера и ключ.
+    """
+
+    def __init__(self, *, workers: int = 1, max_entries: int | None = None, max_bytes: int | None = None) -> None:
+        self.workers = max(1, workers)
+        self.max_entries = max(1, max_entries) if max_entries is not None else None
+        self.max_bytes = max_bytes
+        self._pool: ProcessPoolExecutor | None = None
+        # key -> (expires_at или None, PNG)
+        self._cache: OrderedDict[tuple, tuple[float | None, bytes]] = OrderedDict()
+        self._cached_bytes = 0
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: форк процесса с потоками aiosqlite и event loop небезопасен
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def _run_all(self, func: Callable[[], Any]) -> None:
+        """Запускает ``func`` по разу на каждый воркер (прогрев пула)."""
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        await asyncio.gather(*(loop.run_in_executor(pool, func) for _ in range(self.workers)))
+
+    def _evict(self, key: tuple) -> None:
+        _, png = self._cache.pop(key)
+        self._cached_bytes -= len(png)
+
+    def cached(self, key: tuple, now: float | None = None) -> bytes | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, png = entry
+        if expires_at is not None and (time.time() if now is None else now) >= expires_at:
+            self._evict(key)
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return png
+
+    def _store(self, key: tuple, png: bytes, expires_at: float | None) -> None:
+        if self.max_bytes is not None and len(png) > self.max_bytes:
+            return
+        if key in self._cache:
+            self._evict(key)
+        self._cache[key] = (expires_at, png)
+        self._cached_bytes += len(png)
+        while (self.max_bytes is not None and self._cached_bytes > self.max_bytes) or (
+            self.max_entries is not None and len(self._cache) > self.max_entries
+        ):
+            self._evict(next(iter(self._cache)))
+
+    async def _render(self, key: tuple, func: Callable[[Any], bytes], arg: Any, *, expires_at: float | None = None) -> bytes:
+        """PNG по ключу: из кэша или ``func(arg)`` в пуле."""
+        png = self.cached(key)
+        if png is not None:
+            return png
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor(), func, arg)
+        self._inflight[key] = future
+        try:
+            png = await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+        self._store(key, png, expires_at)
+        return png
+
+    @property
+    def cached_bytes(self) -> int:
+        return self._cached_bytes
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
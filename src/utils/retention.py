@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from .db import Database
+
+log = logging.getLogger(__name__)
+
+# Возвращает id участников сервера или None, если список неполон
+# (сервер недоступен или участники ещё не загружены) — тогда сервер пропускается
+MemberLookup = Callable[[int], "set[int] | None"]
+
+# Нет свежего XP: участник давно ничего не писал (или записи нет вовсе)
+_NO_RECENT_ACTIVITY = (
+    "NOT EXISTS (SELECT 1 FROM user_levels u WHERE u.guild_id = t.guild_id"
+    " AND u.user_id = t.user_id AND u.last_message_time >= ?)"
+)
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """Что и когда удалять из одной таблицы.
+
+    ``where`` — условие на строки-кандидаты с одним параметром (порог
+    времени). Для ``departed_only`` дополнительно требуется, чтобы
+    участника ``user_id`` уже не было на сервере.
+    """
+
+    name: str
+    table: str
+    key: tuple[str, ...]
+    where: str
+    days: int
+    departed_only: bool = False
+    archive: bool = False
+    # формат порога: как время хранится в колонке, по которой идёт сравнение
+    utc_cutoff: bool = False
+
+
+@dataclass
+class PolicyReport:
+    name: str
+    rows: int = 0
+    bytes: int | None = 0
+    archived: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    skipped_guilds: int = 0
+
+
+@dataclass
+class RetentionReport:
+    dry_run: bool
+    policies: list[PolicyReport]
+    vacuumed_bytes: int = 0
+    # База не в auto_vacuum=INCREMENTAL: место не возвращено, нужна разовая конвертация
+    vacuum_conversion_needed: bool = False
+
+    @property
+    def rows(self) -> int:
+        return sum(p.rows for p in self.policies)
+
+
+def default_policies(*, modlog_days: int, departed_days: int) -> list[RetentionPolicy]:
+    """Политики по умолчанию; 0 дней — политика выключена."""
+    policies = []
+    if modlog_days > 0:
+        policies.append(RetentionPolicy(
+            "moderation_logs", "moderation_logs", ("id",),
+            "created_at < ?", modlog_days, archive=True, utc_cutoff=True,
+        ))
+    if departed_days > 0:
+        # NULL — опыт только из импорта или за голос, сообщений не было вовсе
+        policies.append(RetentionPolicy(
+            "user_levels", "user_levels", ("guild_id", "user_id"),
+            "(last_message_time < ? OR last_message_time IS NULL)", departed_days,
+            departed_only=True, archive=True,
+        ))
+        for table in ("message_stats", "voice_settings"):
+            policies.append(RetentionPolicy(
+                table, table, ("guild_id", "user_id"),
+                _NO_RECENT_ACTIVITY, departed_days, departed_only=True,
+            ))
+    return policies
+
+
+def _cutoff(policy: RetentionPolicy) -> str:
+    if policy.utc_cutoff:
+        # CURRENT_TIMESTAMP в SQLite: UTC, "YYYY-MM-DD HH:MM:SS"
+        return (datetime.now(timezone.utc) - timedelta(days=policy.days)).strftime("%Y-%m-%d %H:%M:%S")
+    # last_message_time пишется как datetime.now().isoformat()
+    return (datetime.now() - timedelta(days=policy.days)).isoformat()
+
+
+async def _avg_row_bytes(db: Database, table: str) -> float | None:
+    """Средний размер строки вместе с индексами таблицы (по dbstat)."""
+    try:
+        row = await db.fetchone(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE tbl_name = ?)",
+            table,
+        )
+        count = await db.fetchone(f"SELECT COUNT(*) FROM {table}")
+    except sqlite3.Error:
+        return None  # SQLite собран без SQLITE_ENABLE_DBSTAT_VTAB
+    if not row or not row[0] or not count or not count[0]:
+        return 0.0
+    return row[0] / count[0]
+
+
+def _archive(archive_dir: str, table: str, columns: list[str], rows: list[tuple]) -> None:
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{table}-{datetime.now(timezone.utc):%Y%m%d}.jsonl")
+    with open(path, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n")
+
+
+async def _guild_ids(db: Database, table: str) -> list[int]:
+    return [row[0] for row in await db.fetchall(f"SELECT DISTINCT guild_id FROM {table}")]
+
+
+async def _apply_policy(
+    db: Database,
+    policy: RetentionPolicy,
+    *,
+    members: MemberLookup | None,
+    dry_run: bool,
+    batch_size: int,
+    pause: float,
+    archive_dir: str,
+) -> PolicyReport:
+    report = PolicyReport(policy.name)
+    started = time.perf_counter()
+    cutoff = _cutoff(policy)
+    key_cols = ", ".join(policy.key)
+    key_match = " AND ".join(f"{col} = ?" for col in policy.key)
+    archive = policy.archive and bool(archive_dir) and not dry_run
+
+    if policy.departed_only:
+        if members is None:
+            return report
+        scopes: list[tuple[int | None, set[int] | None]] = []
+        for guild_id in await _guild_ids(db, policy.table):
+            member_ids = members(guild_id)
+            if member_ids is None:
+                report.skipped_guilds += 1
+            else:
+                scopes.append((guild_id, member_ids))
+    else:
+        scopes = [(None, None)]
+
+    for guild_id, member_ids in scopes:
+        scope_sql = "" if guild_id is None else " AND t.guild_id = ?"
+        scope_params = () if guild_id is None else (guild_id,)
+        last: tuple | None = None
+        while True:
+            # Keyset-проход по ключу: каждая пачка — короткое чтение и короткая запись
+            after_sql = "" if last is None else f" AND ({key_cols}) > ({', '.join('?' * len(policy.key))})"
+            select_cols = "*" if archive else key_cols
+            rows = await db.fetchall(
+                f"SELECT {select_cols} FROM {policy.table} t WHERE {policy.where}{scope_sql}{after_sql} "
+                f"ORDER BY {key_cols} LIMIT ?",
+                cutoff, *scope_params, *(last or ()), batch_size,
+            )
+            if not rows:
+                break
+            if archive:
+                columns = [r[1] for r in await db.fetchall(f"PRAGMA table_info({policy.table})")]
+                key_idx = [columns.index(col) for col in policy.key]
+                keys = [tuple(row[i] for i in key_idx) for row in rows]
+            else:
+                keys = [tuple(row) for row in rows]
+            last = keys[-1]
+
+            victims = list(zip(keys, rows))
+            if member_ids is not None:
+                user_idx = policy.key.index("user_id")
+                victims = [(k, r) for k, r in victims if k[user_idx] not in member_ids]
+            if victims and not dry_run:
+                if archive:
+                    await asyncio.to_thread(_archive, archive_dir, policy.table, columns, [r for _, r in victims])
+                    report.archived += len(victims)
+                async with db.transaction() as tx:
+                    await tx.exec_many(f"DELETE FROM {policy.table} WHERE {key_match}", [k for k, _ in victims])
+                report.batches += 1
+            report.rows += len(victims)
+            if len(rows) < batch_size:
+                break
+            if pause > 0 and not dry_run:
+                await asyncio.sleep(pause)
+
+    if dry_run:
+        avg = await _avg_row_bytes(db, policy.table)
+        report.bytes = None if avg is None else int(avg * report.rows)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+async def incremental_vacuum_enabled(db: Database) -> bool:
+    row = await db.fetchone("PRAGMA auto_vacuum")
+    return bool(row) and row[0] == 2
+
+
+async def convert_to_incremental_vacuum(db: Database) -> None:
+    """Переводит базу в auto_vacuum=INCREMENTAL одним полным VACUUM.
+
+    Новые базы получают этот режим ещё при создании (см. Database.connect).
+    Для старых это разовая операция: VACUUM переписывает весь файл и всё
+    это время держит блокировку записи, поэтому из планового прогона она
+    не вызывается — только явно (``/db-retention convert_vacuum``).
+    """
+    started = time.perf_counter()
+    await db.exec("PRAGMA auto_vacuum = INCREMENTAL; VACUUM;")
+    log.info("Converted database to incremental auto_vacuum in %.2fs", time.perf_counter() - started)
+
+
+async def incremental_vacuum(db: Database, *, pages_per_step: int = 512, pause: float = 0.05) -> int:
+    """Возвращает свободные страницы файлу порциями; результат — число страниц."""
+    freed = 0
+    while True:
+        (free_pages,) = await db.fetchone("PRAGMA freelist_count")
+        if not free_pages:
+            break
+        step = min(free_pages, pages_per_step)
+        await db.exec(f"PRAGMA incremental_vacuum({int(step)})")
+        (left,) = await db.fetchone("PRAGMA freelist_count")
+        if left >= free_pages:
+            break  # auto_vacuum выключен — страницы не освобождаются
+        freed += free_pages - left
+        if pause > 0:
+            await asyncio.sleep(pause)
+    return freed
+
+
+async def run_retention(
+    db: Database,
+    policies: list[RetentionPolicy],
+    *,
+    members: MemberLookup | None = None,
+    dry_run: bool = False,
+    batch_size: int = 500,
+    pause: float = 0.05,
+    archive_dir: str = "",
+    convert_vacuum: bool = False,
+) -> RetentionReport:
+    """Прогоняет политики по очереди, затем освобождает место incremental vacuum.
+
+    В ``dry_run`` ничего не меняется: считаются строки и оценка байт,
+    которые каждая политика освободила бы. Если база ещё не в режиме
+    incremental auto_vacuum, место возвращается только с
+    ``convert_vacuum=True`` (полный VACUUM); иначе отчёт помечается
+    ``vacuum_conversion_needed``.
+    """
+    report = RetentionReport(dry_run, [])
+    for policy in policies:
+        try:
+            result = await _apply_policy(
+                db, policy, members=members, dry_run=dry_run,
+                batch_size=max(1, batch_size), pause=pause, archive_dir=archive_dir,
+            )
+        except Exception:
+            log.exception("Retention policy %s failed", policy.name)
+            continue
+        report.policies.append(result)
+        log.info(
+            "Retention %s%s: %d rows in %d batches (%.2fs, %d guilds skipped)",
+            policy.name, " [dry-run]" if dry_run else "", result.rows,
+            result.batches, result.seconds, result.skipped_guilds,
+        )
+    if dry_run:
+        return report
+    incremental = await incremental_vacuum_enabled(db)
+    if not incremental and not convert_vacuum:
+        # Сообщить об этом — дело вызывающего: плановый цикл пишет в лог, /db-retention — в embed
+        report.vacuum_conversion_needed = True
+        return report
+    if report.rows or not incremental:
+        (page_size,) = await db.fetchone("PRAGMA page_size")
+        (before,) = await db.fetchone("PRAGMA page_count")
+        if incremental:
+            await incremental_vacuum(db)
+        else:
+            await convert_to_incremental_vacuum(db)
+        (after,) = await db.fetchone("PRAGMA page_count")
+        report.vacuumed_bytes = max(0, before - after) * page_size
+    return report
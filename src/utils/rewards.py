@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Iterable
+
+import discord
+
+if TYPE_CHECKING:
+    from .db import Database
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RewardTable:
+    """Награды сервера, отсортированные по уровню.
+
+    Роли за уровни накапливаются: на уровне N у участника должны быть все
+    награды с уровнем ≤ N и ни одной из более высоких.
+    """
+
+    levels: tuple[int, ...] = ()
+    role_ids: tuple[int, ...] = ()
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[int, int]]) -> RewardTable:
+        """``rows`` — пары (level, role_id) в любом порядке."""
+        ordered = sorted((int(level), int(role_id)) for level, role_id in rows)
+        return cls(tuple(level for level, _ in ordered), tuple(role_id for _, role_id in ordered))
+
+    def __bool__(self) -> bool:
+        return bool(self.levels)
+
+    @property
+    def all_roles(self) -> frozenset[int]:
+        return frozenset(self.role_ids)
+
+    def roles_for(self, level: int) -> frozenset[int]:
+        """Роли, положенные на уровне ``level``."""
+        return frozenset(self.role_ids[:bisect.bisect_right(self.levels, level)])
+
+    @property
+    def digest(self) -> str:
+        """Отпечаток набора наград: прогресс синхронизации со старым набором не продолжается."""
+        data = ",".join(f"{level}:{role_id}" for level, role_id in zip(self.levels, self.role_ids))
+        return hashlib.sha1(data.encode()).hexdigest()
+
+
+def plan_roles(
+    current: Iterable[int],
+    table: RewardTable,
+    level: int,
+    assignable: Callable[[int], bool],
+) -> list[int] | None:
+    """Новый список ролей участника или None, если менять нечего.
+
+    Трогаются только наградные роли, которые бот может выдавать
+    (``assignable``); остальные роли участника остаются как есть.
+    """
+    current = set(current)
+    target = table.roles_for(level)
+    add = {r for r in target - current if assignable(r)}
+    remove = {r for r in (table.all_roles - target) & current if assignable(r)}
+    if not add and not remove:
+        return None
+    return sorted((current - remove) | add)
+
+
+@dataclass
+class RewardSyncReport:
+    guild_id: int
+    scanned: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    missing: int = 0
+    failed: int = 0
+    rate_limited: int = 0
+    resumed: bool = False
+    finished: bool = False
+    seconds: float = 0.0
+    last_user_id: int = 0
+    started: float = field(default_factory=time.perf_counter, repr=False)
+
+
+_COUNTERS = ("scanned", "updated", "unchanged", "missing", "failed")
+
+
+async def _load_progress(db: Database, guild_id: int, digest: str, report: RewardSyncReport) -> None:
+    row = await db.fetchone(
+        f"SELECT rewards_digest, last_user_id, finished_at, {', '.join(_COUNTERS)} "
+        "FROM reward_sync_progress WHERE guild_id = ?",
+        guild_id,
+    )
+    if row is None or row[0] != digest or row[2] is not None:
+        return  # начинаем заново: прогона не было, он завершён или награды поменялись
+    report.resumed = True
+    report.last_user_id = row[1]
+    for name, value in zip(_COUNTERS, row[3:]):
+        setattr(report, name, value)
+
+
+async def _save_progress(db: Database, report: RewardSyncReport, digest: str, *, finished: bool = False) -> None:
+    await db.exec(
+        f"""
+        INSERT INTO reward_sync_progress (guild_id, rewards_digest, last_user_id, {', '.join(_COUNTERS)}, finished_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, {'CURRENT_TIMESTAMP' if finished else 'NULL'})
+        ON CONFLICT (guild_id) DO UPDATE SET
+            rewards_digest = excluded.rewards_digest,
+            last_user_id = excluded.last_user_id,
+            {', '.join(f'{name} = excluded.{name}' for name in _COUNTERS)},
+            updated_at = CURRENT_TIMESTAMP,
+            finished_at = excluded.finished_at
+        """,
+        report.guild_id, digest, report.last_user_id, *(getattr(report, name) for name in _COUNTERS),
+        durable=True,
+    )
+
+
+class _Throttle:
+    """Общая пауза для всех воркеров после 429: пока ждёт один, не стреляют и остальные."""
+
+    def __init__(self) -> None:
+        self._until = 0.0
+
+    async def wait(self) -> None:
+        delay = self._until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def hold(self, seconds: float) -> None:
+        self._until = max(self._until, time.monotonic() + seconds)
+
+
+async def _edit_member(
+    member: discord.Member,
+    roles: list[int],
+    throttle: _Throttle,
+    report: RewardSyncReport,
+    reason: str,
+) -> None:
+    # Один PATCH на участника; повтор — только если Discord попросил подождать
+    for attempt in range(3):
+        await throttle.wait()
+        try:
+            await member.edit(roles=[discord.Object(role_id) for role_id in roles], reason=reason)
+            report.updated += 1
+            return
+        except discord.RateLimited as e:
+            retry_after = e.retry_after
+        except discord.HTTPException as e:
+            if e.status != 429:
+                log.warning("Failed to sync reward roles of %s: %s", member, e)
+                report.failed += 1
+                return
+            retry_after = 1.0 * (attempt + 1)
+        report.rate_limited += 1
+        throttle.hold(retry_after)
+    report.failed += 1
+
+
+async def run_reward_sync(
+    db: Database,
+    guild: discord.Guild,
+    table: RewardTable,
+    *,
+    chunk_size: int = 500,
+    concurrency: int = 4,
+    restart: bool = False,
+    on_chunk: Callable[[RewardSyncReport], None] | None = None,
+) -> RewardSyncReport:
+    """Приводит наградные роли всех участников сервера в соответствие с их уровнем.
+
+    user_levels читается keyset-пачками по user_id (ушедшие отсекаются
+    условием ``in_guild = 1``). Курсор и счётчики пишутся в
+    reward_sync_progress после каждой пачки: прерванный прогон продолжается
+    с места остановки, если набор наград с тех пор не менялся. Число
+    одновременных ``member.edit`` ограничено ``concurrency``; сами бакеты
+    Discord отслеживает discord.py.
+    """
+    report = RewardSyncReport(guild.id)
+    digest = table.digest
+    if not restart:
+        await _load_progress(db, guild.id, digest, report)
+    if not report.resumed:
+        await db.exec("DELETE FROM reward_sync_progress WHERE guild_id = ?", guild.id)
+
+    me = guild.me
+    assignable_cache: dict[int, bool] = {}
+
+    def assignable(role_id: int) -> bool:
+        if role_id not in assignable_cache:
+            role = guild.get_role(role_id)
+            assignable_cache[role_id] = role is not None and me is not None and role.is_assignable()
+        return assignable_cache[role_id]
+
+    throttle = _Throttle()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    reason = "Синхронизация наград за уровни"
+
+    async def edit(member: discord.Member, roles: list[int]) -> None:
+        async with semaphore:
+            await _edit_member(member, roles, throttle, report, reason)
+
+    while True:
+        rows = await db.fetchall(
+            "SELECT user_id, level FROM user_levels WHERE guild_id = ? AND in_guild = 1 AND user_id > ? "
+            "ORDER BY user_id LIMIT ?",
+            guild.id, report.last_user_id, chunk_size,
+        )
+        if not rows:
+            break
+        edits = []
+        for user_id, level in rows:
+            report.scanned += 1
+            member = guild.get_member(user_id)
+            if member is None:
+                report.missing += 1
+                continue
+            roles = plan_roles((role.id for role in member.roles if not role.is_default()), table, level, assignable)
+            if roles is None:
+                report.unchanged += 1
+            else:
+                edits.append(edit(member, roles))
+        if edits:
+            await asyncio.gather(*edits)
+        report.last_user_id = rows[-1][0]
+        await _save_progress(db, report, digest)
+        if on_chunk is not None:
+            on_chunk(report)
+        if len(rows) < chunk_size:
+            break
+
+    report.finished = True
+    await _save_progress(db, report, digest, finished=True)
+    report.seconds = time.perf_counter() - report.started
+    log.info(
+        "Reward sync for guild %s: %d scanned, %d updated, %d unchanged, %d missing, %d failed (%.1fs%s)",
+        guild.id, report.scanned, report.updated, report.unchanged, report.missing, report.failed,
+        report.seconds, ", resumed" if report.resumed else "",
+    )
+    return report
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import discord
+
+if TYPE_CHECKING:
+    from .db import Database
+
+
+class SettingsStore:
+    """Кэш таблицы ``settings`` в памяти с записью сквозь в БД.
+
+    Таблица читается целиком один раз в ``load()``; дальше чтения идут из
+    словаря, а ``set``/``delete`` сначала пишут в БД, затем обновляют кэш.
+    Cog'и читают настройку в момент использования, поэтому она применяется
+    без перезапуска. Настройки хранятся отдельно для каждого сервера.
+    """
+
+    def __init__(self, db: Database) -> None:
+        self._db = db
+        self._values: dict[tuple[int, str], str] = {}
+
+    async def load(self) -> None:
+        rows = await self._db.fetchall("SELECT guild_id, key, value FROM settings")
+        self._values = {(guild_id, key): value for guild_id, key, value in rows}
+
+    def get(self, guild_id: int, key: str, default: str | None = None) -> str | None:
+        return self._values.get((guild_id, key), default)
+
+    def get_int(self, guild_id: int, key: str, default: int | None = None) -> int | None:
+        value = self._values.get((guild_id, key))
+        return int(value) if value is not None and value.isdigit() else default
+
+    def get_url(self, guild_id: int, key: str) -> str | None:
+        value = self._values.get((guild_id, key))
+        return value if value and value.startswith(("http://", "https://")) else None
+
+    def get_channel(self, guild: discord.Guild, key: str):
+        channel_id = self.get_int(guild.id, key)
+        return guild.get_channel(channel_id) if channel_id else None
+
+    def get_role(self, guild: discord.Guild, key: str) -> discord.Role | None:
+        role_id = self.get_int(guild.id, key)
+        return guild.get_role(role_id) if role_id else None
+
+    async def set(self, guild_id: int, key: str, value: str | int) -> None:
+        value = str(value)
+        await self._db.exec(
+            "INSERT OR REPLACE INTO settings(guild_id, key, value) VALUES(?, ?, ?)", guild_id, key, value, durable=True
+        )
+        self._values[(guild_id, key)] = value
+
+    async def delete(self, guild_id: int, key: str) -> None:
+        await self._db.exec("DELETE FROM settings WHERE guild_id=? AND key=?", guild_id, key, durable=True)
+        self._values.pop((guild_id, key), None)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from .activity import HOUR
+
+if TYPE_CHECKING:
+    from .db import Database
+
+log = logging.getLogger(__name__)
+
+# Бот был выключен дольше — не знаем, сидел ли участник всё это время:
+# сессия закрывается на последней отметке, новая открывается с запуска
+MAX_RESUME_GAP = 15 * 60
+
+_TOTALS_UPSERT = """
+    INSERT INTO voice_totals (guild_id, user_id, channel_id, seconds, sessions) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (guild_id, user_id, channel_id) DO UPDATE SET
+        seconds = seconds + excluded.seconds,
+        sessions = sessions + excluded.sessions
+"""
+_GUILD_VOICE_UPSERT = """
+    INSERT INTO guild_activity_hourly (guild_id, hour, voice_seconds) VALUES (?, ?, ?)
+    ON CONFLICT (guild_id, hour) DO UPDATE SET voice_seconds = voice_seconds + excluded.voice_seconds
+"""
+_OPEN_UPSERT = """
+    INSERT INTO voice_open (guild_id, user_id, channel_id, started_at, credited_until) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET
+        channel_id = excluded.channel_id,
+        started_at = excluded.started_at,
+        credited_until = excluded.credited_until
+"""
+
+
+@dataclass
+class VoiceSession:
+    channel_id: int
+    started_at: int
+    credited_until: int  # до этого момента секунды уже в voice_totals
+
+
+class VoiceSessionTracker:
+    """Голосовые сессии: открытые — в памяти, законченные — пачкой в БД.
+
+    Сессия открывается при входе в канал и закрывается при выходе,
+    переходе в другой канал или отключении. Итоги копятся инкрементально:
+    каждый ``flush`` прибавляет к voice_totals (участник × канал) и к
+    guild_activity_hourly секунды с прошлой отметки — и для закрытых, и
+    для ещё открытых сессий, — дописывает законченные сессии в
+    voice_sessions и сохраняет открытые в voice_open. Всё это одна
+    транзакция, поэтому после перезапуска ни одна секунда не учитывается
+    дважды: ``load`` поднимает voice_open, а ``reconcile`` сверяет его с
+    кэшем шлюза.
+
+    Время — целые unix-секунды.
+    """
+
+    def __init__(self, db: Database, *, max_resume_gap: int = MAX_RESUME_GAP) -> None:
+        self._db = db
+        self.max_resume_gap = max_resume_gap
+        self._open: dict[tuple[int, int], VoiceSession] = {}
+        # Закрытые с прошлого flush: (guild_id, user_id, сессия, ended_at)
+        self._finished: list[tuple[int, int, VoiceSession, int]] = []
+
+    async def load(self) -> int:
+        rows = await self._db.fetchall(
+            "SELECT guild_id, user_id, channel_id, started_at, credited_until FROM voice_open"
+        )
+        for guild_id, user_id, channel_id, started_at, credited_until in rows:
+            self._open[(guild_id, user_id)] = VoiceSession(channel_id, started_at, credited_until)
+        return len(rows)
+
+    @property
+    def open_sessions(self) -> int:
+        return len(self._open)
+
+    def session(self, guild_id: int, user_id: int) -> VoiceSession | None:
+        return self._open.get((guild_id, user_id))
+
+    def _close(self, key: tuple[int, int], ended_at: int) -> None:
+        self._finished.append((*key, self._open.pop(key), ended_at))
+
+    def moved(self, guild_id: int, user_id: int, channel_id: int | None, at: float | None = None) -> None:
+        """Участник теперь в ``channel_id`` (None — вышел из голоса)."""
+        now = int(time.time() if at is None else at)
+        key = (guild_id, user_id)
+        current = self._open.get(key)
+        if current is not None:
+            if current.channel_id == channel_id:
+                return
+            self._close(key, now)
+        if channel_id is not None:
+            self._open[key] = VoiceSession(channel_id, now, now)
+
+    def reconcile(self, present: dict[int, dict[int, int]], at: float | None = None) -> tuple[int, int, int]:
+        """Сверяет открытые сессии с кэшем шлюза: ``{guild_id: {user_id: channel_id}}``.
+
+        Кто по-прежнему в том же канале и отметка свежая, продолжает
+        сессию (секунды простоя засчитаются следующим ``flush``); остальные
+        сессии закрываются на последней сохранённой отметке. Кто в голосе,
+        но без сессии, получает новую с текущего момента. Серверы, которых
+        нет в ``present``, считаются недоступными — их сессии закрываются.
+        Возвращает (продолжено, закрыто, открыто).
+        """
+        now = int(time.time() if at is None else at)
+        resumed = closed = opened = 0
+        for key, session in list(self._open.items()):
+            channel_id = present.get(key[0], {}).get(key[1])
+            if channel_id == session.channel_id and now - session.credited_until <= self.max_resume_gap:
+                resumed += 1
+                continue
+            self._close(key, session.credited_until)
+            closed += 1
+        for guild_id, members in present.items():
+            for user_id, channel_id in members.items():
+                if (guild_id, user_id) not in self._open:
+                    self._open[(guild_id, user_id)] = VoiceSession(channel_id, now, now)
+                    opened += 1
+        if closed or opened:
+            log.info("Voice sessions reconciled: %d resumed, %d closed, %d opened", resumed, closed, opened)
+        return resumed, closed, opened
+
+    async def flush(self, at: float | None = None) -> int:
+        """Засчитывает секунды по ``at`` и пишет всё одной транзакцией; возвращает число закрытых сессий."""
+        now = int(time.time() if at is None else at)
+        finished, self._finished = self._finished, []
+        totals: defaultdict[tuple[int, int, int], list[int]] = defaultdict(lambda: [0, 0])
+        hourly: defaultdict[tuple[int, int], int] = defaultdict(int)
+
+        def credit(guild_id: int, user_id: int, channel_id: int, start: int, end: int) -> None:
+            if end <= start:
+                return
+            totals[(guild_id, user_id, channel_id)][0] += end - start
+            # Секунды раскладываются по часам, в которые они пришлись
+            while start < end:
+                boundary = min(end, (start // HOUR + 1) * HOUR)
+                hourly[(guild_id, start // HOUR)] += boundary - start
+                start = boundary
+
+        log_rows = []
+        for guild_id, user_id, session, ended_at in finished:
+            # Сессия могла закрыться, пока писался прошлый flush, уже засчитавший её до отметки
+            ended_at = max(ended_at, session.credited_until)
+            credit(guild_id, user_id, session.channel_id, session.credited_until, ended_at)
+            totals[(guild_id, user_id, session.channel_id)][1] += 1
+            log_rows.append((guild_id, user_id, session.channel_id, session.started_at, ended_at))
+        checkpoints = []
+        for (guild_id, user_id), session in self._open.items():
+            credited = max(session.credited_until, now)
+            credit(guild_id, user_id, session.channel_id, session.credited_until, credited)
+            checkpoints.append((guild_id, user_id, session, credited))
+        if not finished and not checkpoints:
+            return 0
+
+        try:
+            async with self._db.transaction() as tx:
+                if log_rows:
+                    await tx.exec_many(
+                        "INSERT INTO voice_sessions (guild_id, user_id, channel_id, started_at, ended_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        log_rows,
+                    )
+                    await tx.exec_many(
+                        "DELETE FROM voice_open WHERE guild_id = ? AND user_id = ?",
+                        [row[:2] for row in log_rows],
+                    )
+                if totals:
+                    await tx.exec_many(_TOTALS_UPSERT, [(*key, *value) for key, value in totals.items()])
+                    await tx.exec_many(_GUILD_VOICE_UPSERT, [(*key, value) for key, value in hourly.items()])
+                if checkpoints:
+                    await tx.exec_many(_OPEN_UPSERT, [
+                        (guild_id, user_id, session.channel_id, session.started_at, credited)
+                        for guild_id, user_id, session, credited in checkpoints
+                    ])
+        except Exception:
+            # Ничего не записано: закрытые сессии вернутся в следующую пачку
+            self._finished = finished + self._finished
+            raise
+        # Отметка ставится и сессиям, закрывшимся за время записи: их хвост посчитается от неё
+        for _, _, session, credited in checkpoints:
+            session.credited_until = max(session.credited_until, credited)
+        return len(finished)
+
+    async def prune(self, before: float) -> int:
+        """Удаляет из журнала сессии, закончившиеся раньше ``before``; итоги не трогает."""
+        # changes() читается в той же транзакции, на соединении записи
+        async with self._db.transaction() as tx:
+            await tx.exec("DELETE FROM voice_sessions WHERE ended_at < ?", int(before))
+            row = await tx.fetchone("SELECT changes()")
+        return row[0] if row else 0
+
+    async def top(
+        self, guild_id: int, *, by: str = "user_id", channel_id: int | None = None, limit: int = 10
+    ) -> list[tuple[int, int]]:
+        """Пары (id, секунд) по итогам за всё время; данные — по последний ``flush``."""
+        if by not in ("user_id", "channel_id"):
+            raise ValueError(f"unknown grouping {by!r}")
+        extra, params = "", [guild_id]
+        if channel_id is not None:
+            extra, params = " AND channel_id = ?", [guild_id, channel_id]
+        rows = await self._db.fetchall(
+            f"SELECT {by}, SUM(seconds) AS total FROM voice_totals WHERE guild_id = ?{extra} "
+            "GROUP BY 1 ORDER BY total DESC, 1 LIMIT ?",
+            *params, limit,
+        )
+        return [(row[0], row[1]) for row in rows]